@@ -0,0 +1,46 @@
+"""create video job outputs table
+
+Revision ID: 3b8e51c0d2a7
+Revises: f6965eddfbf8
+Create Date: 2026-10-18 10:12:41.508113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e51c0d2a7'
+down_revision: Union[str, None] = 'f6965eddfbf8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'video_job_outputs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('profile_detail_id', sa.Integer(), nullable=True),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['video_jobs.id']),
+        sa.ForeignKeyConstraint(['profile_detail_id'], ['encode_profile_details.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_video_job_outputs_id'), 'video_job_outputs', ['id'], unique=False)
+    op.create_index(op.f('ix_video_job_outputs_job_id'), 'video_job_outputs', ['job_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_video_job_outputs_job_id'), table_name='video_job_outputs')
+    op.drop_index(op.f('ix_video_job_outputs_id'), table_name='video_job_outputs')
+    op.drop_table('video_job_outputs')
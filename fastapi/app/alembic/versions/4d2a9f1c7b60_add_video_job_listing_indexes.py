@@ -0,0 +1,30 @@
+"""add video job listing indexes
+
+Revision ID: 4d2a9f1c7b60
+Revises: 9c41d7e2f5b3
+Create Date: 2026-10-18 14:21:45.108233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d2a9f1c7b60'
+down_revision: Union[str, None] = '9c41d7e2f5b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_video_jobs_status_created_at', 'video_jobs', ['status', 'created_at'], unique=False)
+    op.create_index('ix_video_jobs_encoding_profile', 'video_jobs', ['encoding_profile'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_video_jobs_encoding_profile', table_name='video_jobs')
+    op.drop_index('ix_video_jobs_status_created_at', table_name='video_jobs')
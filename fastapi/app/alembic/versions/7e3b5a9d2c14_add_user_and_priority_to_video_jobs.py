@@ -0,0 +1,34 @@
+"""add user and priority to video jobs
+
+Revision ID: 7e3b5a9d2c14
+Revises: 4d2a9f1c7b60
+Create Date: 2026-10-18 16:02:37.514920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e3b5a9d2c14'
+down_revision: Union[str, None] = '4d2a9f1c7b60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('video_jobs', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.add_column('video_jobs', sa.Column('priority', sa.String(length=10), server_default='normal', nullable=False))
+    op.create_index(op.f('ix_video_jobs_user_id'), 'video_jobs', ['user_id'], unique=False)
+    op.create_foreign_key('fk_video_jobs_user_id_users', 'video_jobs', 'users', ['user_id'], ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('fk_video_jobs_user_id_users', 'video_jobs', type_='foreignkey')
+    op.drop_index(op.f('ix_video_jobs_user_id'), table_name='video_jobs')
+    op.drop_column('video_jobs', 'priority')
+    op.drop_column('video_jobs', 'user_id')
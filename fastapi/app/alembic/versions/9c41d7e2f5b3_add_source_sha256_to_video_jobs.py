@@ -0,0 +1,30 @@
+"""add source sha256 to video jobs
+
+Revision ID: 9c41d7e2f5b3
+Revises: 3b8e51c0d2a7
+Create Date: 2026-10-18 11:02:17.336902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c41d7e2f5b3'
+down_revision: Union[str, None] = '3b8e51c0d2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('video_jobs', sa.Column('source_sha256', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_video_jobs_source_sha256'), 'video_jobs', ['source_sha256'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_video_jobs_source_sha256'), table_name='video_jobs')
+    op.drop_column('video_jobs', 'source_sha256')
@@ -0,0 +1,44 @@
+"""add sampled quality verification
+
+Revision ID: a7e3c9f25d14
+Revises: f1b6d3a8c470
+Create Date: 2026-10-18 21:26:52.119304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e3c9f25d14'
+down_revision: Union[str, None] = 'f1b6d3a8c470'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('encode_profiles', sa.Column('verify_quality', sa.Boolean(), server_default='0', nullable=False))
+    op.add_column('encode_profiles', sa.Column('min_ssim', sa.Float(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('min_psnr', sa.Float(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('min_vmaf', sa.Float(), nullable=True))
+    op.add_column('video_jobs', sa.Column('quality_status', sa.String(length=20), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('ssim', sa.Float(), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('psnr', sa.Float(), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('vmaf', sa.Float(), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('quality_flagged', sa.Boolean(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('video_job_outputs', 'quality_flagged')
+    op.drop_column('video_job_outputs', 'vmaf')
+    op.drop_column('video_job_outputs', 'psnr')
+    op.drop_column('video_job_outputs', 'ssim')
+    op.drop_column('video_jobs', 'quality_status')
+    op.drop_column('encode_profiles', 'min_vmaf')
+    op.drop_column('encode_profiles', 'min_psnr')
+    op.drop_column('encode_profiles', 'min_ssim')
+    op.drop_column('encode_profiles', 'verify_quality')
@@ -0,0 +1,28 @@
+"""index video jobs by user and created_at
+
+Revision ID: b0d4e8a21c67
+Revises: a7e3c9f25d14
+Create Date: 2026-10-18 22:04:15.630281
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b0d4e8a21c67'
+down_revision: Union[str, None] = 'a7e3c9f25d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_video_jobs_user_id_created_at', 'video_jobs', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_video_jobs_user_id_created_at', table_name='video_jobs')
@@ -0,0 +1,30 @@
+"""add batch id to video jobs
+
+Revision ID: b52e8d1f6a03
+Revises: 7e3b5a9d2c14
+Create Date: 2026-10-18 17:11:09.382715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52e8d1f6a03'
+down_revision: Union[str, None] = '7e3b5a9d2c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('video_jobs', sa.Column('batch_id', sa.String(length=36), nullable=True))
+    op.create_index(op.f('ix_video_jobs_batch_id'), 'video_jobs', ['batch_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_video_jobs_batch_id'), table_name='video_jobs')
+    op.drop_column('video_jobs', 'batch_id')
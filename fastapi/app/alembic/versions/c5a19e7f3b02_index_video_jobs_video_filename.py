@@ -0,0 +1,28 @@
+"""index video jobs video_filename
+
+Revision ID: c5a19e7f3b02
+Revises: b0d4e8a21c67
+Create Date: 2026-10-18 22:31:48.907512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a19e7f3b02'
+down_revision: Union[str, None] = 'b0d4e8a21c67'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_video_jobs_video_filename'), 'video_jobs', ['video_filename'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_video_jobs_video_filename'), table_name='video_jobs')
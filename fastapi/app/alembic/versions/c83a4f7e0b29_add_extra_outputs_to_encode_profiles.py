@@ -0,0 +1,44 @@
+"""add extra outputs to encode profiles
+
+Revision ID: c83a4f7e0b29
+Revises: b52e8d1f6a03
+Create Date: 2026-10-18 18:05:41.227604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c83a4f7e0b29'
+down_revision: Union[str, None] = 'b52e8d1f6a03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('encode_profiles', sa.Column('poster_width', sa.Integer(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('poster_time', sa.Float(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('sprite_width', sa.Integer(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('sprite_interval', sa.Float(), server_default='10', nullable=True))
+    op.add_column('encode_profiles', sa.Column('sprite_columns', sa.Integer(), server_default='10', nullable=True))
+    op.add_column('encode_profiles', sa.Column('sprite_rows', sa.Integer(), server_default='10', nullable=True))
+    op.add_column('encode_profiles', sa.Column('preview_width', sa.Integer(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('preview_start', sa.Float(), nullable=True))
+    op.add_column('encode_profiles', sa.Column('preview_duration', sa.Float(), server_default='10', nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('encode_profiles', 'preview_duration')
+    op.drop_column('encode_profiles', 'preview_start')
+    op.drop_column('encode_profiles', 'preview_width')
+    op.drop_column('encode_profiles', 'sprite_rows')
+    op.drop_column('encode_profiles', 'sprite_columns')
+    op.drop_column('encode_profiles', 'sprite_interval')
+    op.drop_column('encode_profiles', 'sprite_width')
+    op.drop_column('encode_profiles', 'poster_time')
+    op.drop_column('encode_profiles', 'poster_width')
@@ -0,0 +1,32 @@
+"""add streaming output to encode profiles
+
+Revision ID: e4a7c2d9b815
+Revises: c83a4f7e0b29
+Create Date: 2026-10-18 19:12:08.513927
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a7c2d9b815'
+down_revision: Union[str, None] = 'c83a4f7e0b29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('encode_profiles', sa.Column('output_format', sa.String(length=10), server_default='mp4', nullable=False))
+    op.add_column('encode_profiles', sa.Column('segment_duration', sa.Integer(), server_default='6', nullable=True))
+    op.add_column('encode_profiles', sa.Column('hls_segment_type', sa.String(length=10), server_default='fmp4', nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('encode_profiles', 'hls_segment_type')
+    op.drop_column('encode_profiles', 'segment_duration')
+    op.drop_column('encode_profiles', 'output_format')
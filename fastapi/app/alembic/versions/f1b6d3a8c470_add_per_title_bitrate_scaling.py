@@ -0,0 +1,42 @@
+"""add per-title bitrate scaling
+
+Revision ID: f1b6d3a8c470
+Revises: e4a7c2d9b815
+Create Date: 2026-10-18 20:41:37.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b6d3a8c470'
+down_revision: Union[str, None] = 'e4a7c2d9b815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('encode_profiles', sa.Column('per_title', sa.Boolean(), server_default='0', nullable=False))
+    op.add_column('encode_profiles', sa.Column('per_title_min_scale', sa.Float(), server_default='0.5', nullable=True))
+    op.add_column('encode_profiles', sa.Column('per_title_max_scale', sa.Float(), server_default='1.5', nullable=True))
+    op.add_column('video_jobs', sa.Column('complexity_kbps', sa.Float(), nullable=True))
+    op.add_column('video_jobs', sa.Column('bitrate_scale', sa.Float(), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('video_bitrate', sa.Integer(), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('max_bitrate', sa.Integer(), nullable=True))
+    op.add_column('video_job_outputs', sa.Column('bufsize', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('video_job_outputs', 'bufsize')
+    op.drop_column('video_job_outputs', 'max_bitrate')
+    op.drop_column('video_job_outputs', 'video_bitrate')
+    op.drop_column('video_jobs', 'bitrate_scale')
+    op.drop_column('video_jobs', 'complexity_kbps')
+    op.drop_column('encode_profiles', 'per_title_max_scale')
+    op.drop_column('encode_profiles', 'per_title_min_scale')
+    op.drop_column('encode_profiles', 'per_title')
@@ -1,31 +1,278 @@
-from fastapi import Depends, HTTPException
+import os
+import threading
+import time
+from typing import NamedTuple
+from fastapi import HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from db.database import redis_client
+from auth import tokens
+from db.database import redis_client, async_redis_client
 from models.user import User
-from utils.security import verify_password
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils.cache import TTLCache
+from utils.security import verify_and_update_password
+from logging_config import logger as app_logger
 from uuid import uuid4
-from db.database import SessionLocal
 from datetime import timedelta
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
+logger = app_logger.getChild("auth")
+
+# Resolved users are kept briefly in memory so an authenticated request costs
+# one Dragonfly round trip and no MySQL read. Changes to a user are published
+# on PRINCIPAL_CHANNEL so every API process drops its copy right away.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CHANNEL = "principals:invalidate"
+# Longest wait between attempts to resubscribe after losing Dragonfly
+LISTENER_MAX_BACKOFF = 30
+
+# blacklisted_tokens keeps a member per blacklisting; entries whose
+# blacklisted:* key has expired are swept out on this interval
+BLACKLIST_COMPACT_INTERVAL = int(os.getenv("BLACKLIST_COMPACT_INTERVAL", "300"))
+BLACKLIST_COMPACT_BATCH = 1000
+
+
+class Principal(NamedTuple):
+    id: int
+    unique_id: str
+    role: str
+    is_activated: bool
+
+
+_principals = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+
+def cached_principal(unique_id):
+    return _principals.get(unique_id)
+
+
+def cache_principal(principal):
+    _principals.set(principal.unique_id, principal)
+
+
+def forget_principal(unique_id=None):
+    if unique_id is None:
+        _principals.clear()
+    else:
+        _principals.pop(unique_id)
+
+
+def invalidate_principal(unique_id):
+    forget_principal(unique_id)
+    try:
+        redis_client.publish(PRINCIPAL_CHANNEL, unique_id)
+    except Exception as e:
+        # Other processes still drop it once the TTL runs out
+        logger.warning("Could not publish principal invalidation for %s: %s", unique_id, e)
+
+
+def listen_for_principal_invalidations(stop_event):
+    delay = 1
+    while not stop_event.is_set():
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(PRINCIPAL_CHANNEL)
+            # Anything published while we weren't subscribed is lost, so start clean
+            forget_principal()
+            delay = 1
+            while not stop_event.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message and message["type"] == "message":
+                    forget_principal(message["data"])
+        except Exception:
+            logger.exception("Principal invalidation listener failed, resubscribing in %ss", delay)
+            stop_event.wait(delay)
+            delay = min(delay * 2, LISTENER_MAX_BACKOFF)
+        finally:
+            pubsub.close()
+
+
+def start_principal_listener(stop_event):
+    thread = threading.Thread(target=listen_for_principal_invalidations, args=(stop_event,), daemon=True)
+    thread.start()
+    return thread
+
+
+def compact_blacklist():
+    """Drop blacklisted_tokens members whose blacklist entry has expired."""
+    removed = 0
+    cursor = 0
+    while True:
+        cursor, members = redis_client.sscan("blacklisted_tokens", cursor, count=BLACKLIST_COMPACT_BATCH)
+        if members:
+            pipe = redis_client.pipeline(transaction=False)
+            for token in members:
+                pipe.exists(f"blacklisted:{token}")
+            expired = [token for token, alive in zip(members, pipe.execute()) if not alive]
+            if expired:
+                removed += redis_client.srem("blacklisted_tokens", *expired)
+        if cursor == 0:
+            return removed
+
+
+def compact_blacklist_periodically(stop_event):
+    while not stop_event.wait(BLACKLIST_COMPACT_INTERVAL):
+        try:
+            # One API node per interval does the sweep
+            if redis_client.set("blacklisted_tokens:compact_lock", 1, nx=True, ex=BLACKLIST_COMPACT_INTERVAL):
+                removed = compact_blacklist()
+                if removed:
+                    logger.info("Removed %s expired entries from blacklisted_tokens", removed)
+        except Exception:
+            logger.exception("Blacklist compaction failed")
+
+
+def start_blacklist_compactor(stop_event):
+    thread = threading.Thread(target=compact_blacklist_periodically, args=(stop_event,), daemon=True)
+    thread.start()
+    return thread
+
+
+def resolve_token(token: str):
+    """Return the user id an access token belongs to, or None. One round trip."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.exists(f"blacklisted:{token}")
+    pipe.get(f"token:{token}")
+    blacklisted, user_id = pipe.execute()
+    if blacklisted:
+        raise HTTPException(status_code=401, detail="Token has been blacklisted")
+    return user_id
+
+
+def load_principal(db: Session, unique_id: str):
+    principal = cached_principal(unique_id)
+    if principal is not None:
+        return principal
+
+    row = db.query(User.id, User.unique_id, User.role, User.is_activated).filter(User.unique_id == unique_id).first()
+    if row is None:
+        return None
+    principal = Principal(id=row.id, unique_id=row.unique_id, role=row.role, is_activated=bool(row.is_activated))
+    cache_principal(principal)
+    return principal
+
+
+ACCESS_TOKEN_EXPIRY = timedelta(minutes=15)
+REFRESH_TOKEN_EXPIRY = timedelta(days=7)
 
 
 def store_token(token: str, user_id: str, is_refresh=False):
     if is_refresh:
-        expiration_time = timedelta(days=7)
+        expiration_time = REFRESH_TOKEN_EXPIRY
         redis_key = f"refresh_token:{token}"
     else:
-        expiration_time = timedelta(minutes=15)
+        expiration_time = ACCESS_TOKEN_EXPIRY
         redis_key = f"token:{token}"
-    
+
     redis_client.set(redis_key, user_id, ex=expiration_time)
     redis_client.sadd(f"user_tokens:{user_id}", token)
 
-    
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.password):
+async def issue_login_tokens(user):
+    """Return (access_token, refresh_token) for a login.
+
+    A live opaque access token is reused when there is one. Entries of
+    user_tokens:* whose token has expired or been blacklisted are pruned on
+    the way, so the set stays small. Costs three round trips however many
+    tokens the user has.
+    """
+    user_tokens_key = f"user_tokens:{user.unique_id}"
+    members = await async_redis_client.smembers(user_tokens_key)
+
+    dead = []
+    opaque = []
+    for token in members:
+        if tokens.is_signed_token(token):
+            if tokens.decode_signed_token(token) is None:
+                dead.append(token)
+        else:
+            opaque.append(token)
+
+    access_token = None
+    if opaque:
+        pipe = async_redis_client.pipeline(transaction=False)
+        for token in opaque:
+            pipe.exists(f"blacklisted:{token}")
+            pipe.exists(f"token:{token}")
+            pipe.exists(f"refresh_token:{token}")
+        results = await pipe.execute()
+        for index, token in enumerate(opaque):
+            blacklisted, access_live, refresh_live = results[index * 3:index * 3 + 3]
+            if blacklisted or not (access_live or refresh_live):
+                dead.append(token)
+            elif access_live and access_token is None and tokens.TOKEN_MODE != "signed":
+                access_token = token
+
+    pipe = async_redis_client.pipeline(transaction=False)
+    if dead:
+        pipe.srem(user_tokens_key, *dead)
+    if access_token is None:
+        if tokens.TOKEN_MODE == "signed":
+            access_token = tokens.issue_signed_token(user.id, user.unique_id, user.role)
+        else:
+            access_token = str(uuid4())
+            pipe.set(f"token:{access_token}", user.unique_id, ex=ACCESS_TOKEN_EXPIRY)
+        # Signed tokens are listed too, so the blacklist endpoint can find them
+        pipe.sadd(user_tokens_key, access_token)
+    refresh_token = str(uuid4())
+    pipe.set(f"refresh_token:{refresh_token}", user.unique_id, ex=REFRESH_TOKEN_EXPIRY)
+    pipe.sadd(user_tokens_key, refresh_token)
+    await pipe.execute()
+
+    return access_token, refresh_token
+
+
+def verify_signed_access_token(token: str):
+    """Principal for a signed token, checked without touching Dragonfly or MySQL."""
+    claims = tokens.decode_signed_token(token)
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    if tokens.is_revoked(token):
+        raise HTTPException(status_code=401, detail="Token has been blacklisted")
+    return Principal(id=claims["uid"], unique_id=claims["sub"], role=claims["role"], is_activated=True)
+
+
+def revoke_signed_tokens(unique_id):
+    """Blacklist the user's live signed access tokens.
+
+    Signed tokens carry the role and are never checked against the user row,
+    so deactivating a user or changing their role has to revoke them. Each
+    entry expires together with its token. Returns how many were revoked.
+    """
+    live = []
+    for token in redis_client.smembers(f"user_tokens:{unique_id}"):
+        if not tokens.is_signed_token(token):
+            continue
+        claims = tokens.decode_signed_token(token)
+        if claims is not None:
+            live.append((token, max(1, int(claims["exp"] - time.time()))))
+    if not live:
+        return 0
+
+    pipe = redis_client.pipeline(transaction=False)
+    for token, ttl in live:
+        pipe.set(f"blacklisted:{token}", "1", ex=ttl)
+        pipe.sadd("blacklisted_tokens", token)
+    pipe.execute()
+    for token, _ in live:
+        tokens.revoke_locally(token)
+    # Publish the new filter now; other nodes pick it up on their next refresh
+    tokens.refresh_revocation_filter(rebuild=True)
+    return len(live)
+
+
+
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await db.scalar(select(User).where(User.email == email))
+    if not user:
+        return None
+    valid, new_hash = await verify_and_update_password(password, user.password)
+    if not valid:
         return None
+    if new_hash:
+        # Stored hash used an old cost factor (BCRYPT_ROUNDS) or scheme
+        user.password = new_hash
+        await db.commit()
     return user
\ No newline at end of file
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import threading
+import time
+from uuid import uuid4
+from db.database import redis_client
+from utils import metrics
+from logging_config import logger as app_logger
+
+logger = app_logger.getChild("tokens")
+
+# TOKEN_MODE=signed issues HMAC-signed access tokens that are verified in
+# process, with no Dragonfly lookup per request. Opaque (uuid4) tokens keep
+# working in either mode, so switching modes doesn't log anyone out.
+TOKEN_MODE = os.getenv("TOKEN_MODE", "opaque")
+TOKEN_SECRET = os.getenv("TOKEN_SECRET", "")
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", str(15 * 60)))
+
+# Revoked tokens are distributed as a Bloom filter built from the
+# blacklisted_tokens set.
+# One API node rebuilds it per interval and stores it in Dragonfly; every
+# node downloads it on the same interval and keeps the last good copy if
+# Dragonfly is unreachable.
+REVOCATION_REFRESH_INTERVAL = int(os.getenv("REVOCATION_REFRESH_INTERVAL", "10"))
+REVOCATION_FALSE_POSITIVE_RATE = float(os.getenv("REVOCATION_FALSE_POSITIVE_RATE", "0.001"))
+REVOCATION_FILTER_KEY = "revocation_filter"
+REVOCATION_LOCK_KEY = "revocation_filter:lock"
+REVOCATION_SCAN_BATCH = 1000
+
+if TOKEN_MODE == "signed" and not TOKEN_SECRET:
+    raise RuntimeError("TOKEN_MODE=signed needs TOKEN_SECRET")
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+
+
+def is_signed_token(token):
+    # Opaque tokens are uuid4 strings and never contain a dot
+    return "." in token
+
+
+def issue_signed_token(user_id, unique_id, role):
+    claims = {
+        "uid": user_id,
+        "sub": unique_id,
+        "role": role,
+        "exp": int(time.time()) + ACCESS_TOKEN_TTL,
+        "jti": uuid4().hex,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_b64encode(_sign(payload))}"
+
+
+def decode_signed_token(token):
+    """Claims of a correctly signed, unexpired token, or None."""
+    if not TOKEN_SECRET:
+        return None
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(_b64decode(signature), _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=REVOCATION_FALSE_POSITIVE_RATE, bits=None, hashes=None):
+        capacity = max(capacity, 1)
+        self.size = bits or max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.sha256(item.encode()).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(item))
+
+    def dumps(self):
+        return f"{self.size}:{self.hashes}:{_b64encode(bytes(self.bits))}"
+
+    @classmethod
+    def loads(cls, text):
+        size, hashes, bits = text.split(":", 2)
+        bloom = cls(1, bits=int(size), hashes=int(hashes))
+        bloom.bits = bytearray(_b64decode(bits))
+        return bloom
+
+
+_revoked = BloomFilter(1)
+_revoked_at = time.monotonic()
+_revoked_lock = threading.Lock()
+# A filter that stops refreshing misses every revocation made since
+metrics.REVOCATION_FILTER_AGE.set_function(lambda: time.monotonic() - _revoked_at)
+
+
+def build_revocation_filter():
+    # SSCAN over the set rather than SCAN over the keyspace, which holds every
+    # access, refresh, upload and progress key too. Members whose blacklist
+    # entry expired since the last compaction only cost a confirming EXISTS.
+    tokens = list(redis_client.sscan_iter("blacklisted_tokens", count=REVOCATION_SCAN_BATCH))
+    bloom = BloomFilter(len(tokens))
+    for token in tokens:
+        bloom.add(token)
+    redis_client.set(REVOCATION_FILTER_KEY, bloom.dumps())
+    return bloom
+
+
+def refresh_revocation_filter(rebuild=False):
+    global _revoked, _revoked_at
+    # Only one node pays for the SSCAN each interval
+    if rebuild or redis_client.set(REVOCATION_LOCK_KEY, 1, nx=True, ex=REVOCATION_REFRESH_INTERVAL):
+        bloom = build_revocation_filter()
+    else:
+        blob = redis_client.get(REVOCATION_FILTER_KEY)
+        if blob is None:
+            return
+        bloom = BloomFilter.loads(blob)
+    with _revoked_lock:
+        _revoked = bloom
+        _revoked_at = time.monotonic()
+
+
+def revoke_locally(token):
+    with _revoked_lock:
+        _revoked.add(token)
+
+
+def maybe_revoked(token):
+    with _revoked_lock:
+        return token in _revoked
+
+
+def is_revoked(token):
+    if not maybe_revoked(token):
+        return False
+    # Possible false positive: confirm, and refuse the token if we can't
+    try:
+        return bool(redis_client.exists(f"blacklisted:{token}"))
+    except Exception:
+        return True
+
+
+def refresh_revocations(stop_event):
+    while not stop_event.is_set():
+        try:
+            refresh_revocation_filter()
+        except Exception:
+            metrics.REVOCATION_REFRESH_FAILURES.inc()
+            logger.exception("Could not refresh the revocation filter, keeping the last one")
+        stop_event.wait(REVOCATION_REFRESH_INTERVAL)
+
+
+def start_revocation_refresher(stop_event):
+    thread = threading.Thread(target=refresh_revocations, args=(stop_event,), daemon=True)
+    thread.start()
+    return thread
@@ -1,9 +1,17 @@
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import redis
+import redis.asyncio
+import redis.asyncio.client
+import redis.client
+from utils import metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,19 +19,136 @@ load_dotenv()
 # Fetch URLs from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_URL = os.getenv("DRAGONFLY_URL")
+# Defaults to DATABASE_URL with its driver swapped for asyncmy
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 
+# Connection pool sizing, per engine and per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle below MySQL's wait_timeout so the server never drops a pooled connection first
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
 
-engine = create_engine(DATABASE_URL)
+
+def async_url(url):
+    url = make_url(url)
+    if url.get_backend_name() == "mysql":
+        return url.set(drivername="mysql+asyncmy")
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")  # local development only
+    return url
+
+
+# Pools that time how long a caller waits for a connection, including
+# opening a new one. There is no pool event for the start of a checkout.
+class TimedQueuePool(QueuePool):
+    def connect(self):
+        with metrics.timed(metrics.DB_POOL_CHECKOUT_SECONDS, "sync"):
+            return super().connect()
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def connect(self):
+        with metrics.timed(metrics.DB_POOL_CHECKOUT_SECONDS, "async"):
+            return super().connect()
+
+
+def pool_options(url, asyncio=False):
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if asyncio else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+# Sync engine: encode workers, alembic and the remaining sync routes
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+# Async engine for `async def` routes, so queries don't block the event loop
+async_database_url = ASYNC_DATABASE_URL or async_url(DATABASE_URL)
+async_engine = create_async_engine(async_database_url, **pool_options(async_database_url, asyncio=True))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+def time_queries(sync_engine, name):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.DB_QUERY_SECONDS.labels(name, metrics.statement_kind(statement)).observe(elapsed)
+
+    # A failed statement never reaches after_cursor_execute
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+time_queries(engine, "sync")
+time_queries(async_engine.sync_engine, "async")
+
 Base = declarative_base()
 
+
+# Redis clients that record each command's round trip. A pipeline is one
+# round trip and is recorded once as PIPELINE.
+class TimedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with metrics.timed(metrics.REDIS_COMMAND_SECONDS, "PIPELINE"):
+            return super().execute(raise_on_error)
+
+
+class TimedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        with metrics.timed(metrics.REDIS_COMMAND_SECONDS, str(args[0]).upper()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TimedAsyncPipeline(redis.asyncio.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        with metrics.timed(metrics.REDIS_COMMAND_SECONDS, "PIPELINE"):
+            return await super().execute(raise_on_error)
+
+
+class TimedAsyncRedis(redis.asyncio.Redis):
+    async def execute_command(self, *args, **options):
+        with metrics.timed(metrics.REDIS_COMMAND_SECONDS, str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedAsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
 # Set up Redis client
-redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+redis_client = TimedRedis.from_url(REDIS_URL, decode_responses=True)
 
-# Dependency to get the database session
+# Async client for use inside async route handlers
+async_redis_client = TimedAsyncRedis.from_url(REDIS_URL, decode_responses=True)
+
+# Dependency to get the database session (sync `def` routes)
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Dependency to get an async database session (`async def` routes)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,9 +1,16 @@
-from fastapi import FastAPI
-from db.database import Base, engine
+import threading
+import time
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from db.database import Base, engine, async_engine, async_redis_client
+from auth import tokens
+from auth.auth import start_blacklist_compactor, start_principal_listener
 from routes import user as user_routes
 from routes.encoding import router as encoding_routes
 from routes.encodeprofile import router as encode_profile_routes
 from fastapi.middleware.cors import CORSMiddleware
+from services.uploads import start_stream_sweeper
+from utils import metrics
 
 # Initialize FastAPI app
 # from services.profile_service import get_profiles_with_details
@@ -24,6 +31,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Latency per route template (not per raw path, which would explode the label set)
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            request.method, getattr(route, "path", "unmatched"), str(status)
+        ).observe(time.perf_counter() - started)
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Include routers (your routes from user, encoding, and encodeprofile)
 app.include_router(user_routes.router)
 app.include_router(encode_profile_routes)  # Correctly use the router from encodeprofile
@@ -31,3 +59,25 @@ app.include_router(encoding_routes, prefix="/encoding")  # Prefix '/encoding' fo
 
 # Create DB tables at startup
 Base.metadata.create_all(bind=engine)
+
+
+stop_event = threading.Event()
+
+
+# Drop cached users when another API process changes them, keep the token
+# blacklist set from growing without bound and clear out abandoned streams
+@app.on_event("startup")
+async def start_listeners():
+    start_principal_listener(stop_event)
+    start_blacklist_compactor(stop_event)
+    start_stream_sweeper(stop_event)
+    if tokens.TOKEN_MODE == "signed":
+        tokens.start_revocation_refresher(stop_event)
+
+
+# Release pooled connections on shutdown
+@app.on_event("shutdown")
+async def close_connections():
+    stop_event.set()
+    await async_engine.dispose()
+    await async_redis_client.aclose()
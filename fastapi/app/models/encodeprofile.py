@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Float
 from sqlalchemy.orm import relationship
 from db.database import Base
 
@@ -8,6 +8,37 @@ class EncodeProfiles(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(200), nullable=False)
 
+    # Optional outputs cut from the same decode as the renditions. Each one
+    # is off while its width is NULL; heights follow the source's aspect ratio.
+    poster_width = Column(Integer)
+    poster_time = Column(Float)  # Seconds into the source; NULL picks 10% in
+    sprite_width = Column(Integer)  # Width of one tile of the seek-preview sprite sheets
+    sprite_interval = Column(Float, default=10)  # Seconds between tiles
+    sprite_columns = Column(Integer, default=10)
+    sprite_rows = Column(Integer, default=10)
+    preview_width = Column(Integer)
+    preview_start = Column(Float)  # Seconds into the source; NULL picks 10% in
+    preview_duration = Column(Float, default=10)
+
+    # mp4, hls, dash or hls_dash. The streaming formats are packaged from the
+    # MP4 renditions, which then get a keyframe every segment_duration seconds.
+    output_format = Column(String(10), nullable=False, default="mp4", server_default="mp4")
+    segment_duration = Column(Integer, default=6, server_default="6")  # Seconds
+    hls_segment_type = Column(String(10), default="fmp4", server_default="fmp4")  # fmp4 or mpegts
+
+    # Per-title encoding: scale every rendition's bitrate, maxrate and bufsize
+    # by the source's measured complexity, within these bounds
+    per_title = Column(Boolean, nullable=False, default=False, server_default="0")
+    per_title_min_scale = Column(Float, default=0.5, server_default="0.5")
+    per_title_max_scale = Column(Float, default=1.5, server_default="1.5")
+
+    # Sampled SSIM/PSNR/VMAF check of finished renditions; renditions scoring
+    # under a floor are flagged. VMAF needs an ffmpeg built with libvmaf.
+    verify_quality = Column(Boolean, nullable=False, default=False, server_default="0")
+    min_ssim = Column(Float)
+    min_psnr = Column(Float)
+    min_vmaf = Column(Float)
+
     # Relationship to VideoJob model, assuming it's defined elsewhere
     video_jobs = relationship("VideoJob", back_populates="encode_profile")
 
@@ -1,16 +1,65 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, BigInteger, Index, Float
 from sqlalchemy.orm import relationship
 from db.database import Base
 
 class VideoJob(Base):
     __tablename__ = 'video_jobs'
+    __table_args__ = (
+        # Job listing: filter by status, page by created_at
+        Index("ix_video_jobs_status_created_at", "status", "created_at"),
+        # A user's own job listing
+        Index("ix_video_jobs_user_id_created_at", "user_id", "created_at"),
+        Index("ix_video_jobs_encoding_profile", "encoding_profile"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    video_filename = Column(String(220), nullable=False)
+    video_filename = Column(String(220), nullable=False, index=True)
     encoding_profile = Column(Integer, ForeignKey("encode_profiles.id"), nullable=False)
     status = Column(String(200), nullable=False)
+    source_sha256 = Column(String(64), index=True)  # Content hash of the uploaded source
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)  # Uploader, if authenticated
+    priority = Column(String(10), nullable=False, default="normal", server_default="normal")  # low, normal or high
+    batch_id = Column(String(36), index=True)  # Set for jobs submitted together through /jobs/batch
+    # Per-title analysis: the probe encode's bitrate and the factor applied to
+    # the ladder's bitrates. NULL when the profile uses its fixed bitrates.
+    complexity_kbps = Column(Float)
+    bitrate_scale = Column(Float)
+    # pending, passed, flagged or error once the profile verifies quality
+    quality_status = Column(String(20))
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
 
     # Relationship to EncodeProfiles
     encode_profile = relationship("EncodeProfiles", back_populates="video_jobs")
+
+    # Files produced by the job, one row per rendition
+    outputs = relationship(
+        "VideoJobOutput",
+        back_populates="video_job",
+        cascade="all, delete-orphan"
+    )
+
+class VideoJobOutput(Base):
+    __tablename__ = 'video_job_outputs'
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("video_jobs.id"), nullable=False, index=True)
+    profile_detail_id = Column(Integer, ForeignKey("encode_profile_details.id"))
+    kind = Column(String(50), nullable=False, default="rendition")
+    filename = Column(String(255), nullable=False)
+    width = Column(Integer)
+    height = Column(Integer)
+    size_bytes = Column(BigInteger)
+    # Rate control the rendition was encoded with, in kbps
+    video_bitrate = Column(Integer)
+    max_bitrate = Column(Integer)
+    bufsize = Column(Integer)
+    # Sampled scores against the source, for renditions of profiles that verify quality
+    ssim = Column(Float)
+    psnr = Column(Float)
+    vmaf = Column(Float)
+    quality_flagged = Column(Boolean)
+    created_at = Column(DateTime)
+
+    # Relationship to VideoJob
+    video_job = relationship("VideoJob", back_populates="outputs")
@@ -1,29 +1,33 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from db.database import get_db, SessionLocal
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.database import get_async_db
 from models.encodeprofile import EncodeProfiles, EncodeProfileDetails
 from schemas.encodeprofile import EncodeProfileCreate, EncodeProfileDetailsCreate
+from services import profile_service
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/encode-profile", response_model=EncodeProfileCreate)
-async def create_encode_profile(profile: EncodeProfileCreate, db: Session = Depends(get_db)):
-    db_profile = EncodeProfiles(name=profile.name)
+async def create_encode_profile(profile: EncodeProfileCreate, db: AsyncSession = Depends(get_async_db)):
+    db_profile = EncodeProfiles(**profile.model_dump())
+    try:
+        profile_service.validate_extras(db_profile)
+        profile_service.validate_packaging(db_profile)
+        profile_service.validate_per_title(db_profile)
+        profile_service.validate_quality(db_profile)
+    except profile_service.ProfileError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     db.add(db_profile)
-    db.commit()
-    db.refresh(db_profile)
+    await db.commit()
+    await db.refresh(db_profile)
+    await run_in_threadpool(profile_service.invalidate_profile, db_profile.id)
     return db_profile
 
 @router.post("/encode-profile-details", response_model=EncodeProfileDetailsCreate)
-async def create_encode_profile_details(details: EncodeProfileDetailsCreate, db: Session = Depends(get_db)):
-    db_profile = db.query(EncodeProfiles).filter(EncodeProfiles.id == details.profile_id).first()
+async def create_encode_profile_details(details: EncodeProfileDetailsCreate, db: AsyncSession = Depends(get_async_db)):
+    db_profile = await db.scalar(select(EncodeProfiles).where(EncodeProfiles.id == details.profile_id))
 
     if not db_profile:
         raise HTTPException(status_code=404, detail="Encode Profile not found")
@@ -46,8 +50,16 @@ async def create_encode_profile_details(details: EncodeProfileDetailsCreate, db:
         acodec=details.acodec,
         vcodec=details.vcodec,
     )
+
+    # Reject settings the encoders can't handle now rather than when a job runs
+    try:
+        await run_in_threadpool(profile_service.validate_detail, db_profile_details)
+    except profile_service.ProfileError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     db.add(db_profile_details)
-    db.commit()
-    db.refresh(db_profile_details)
+    await db.commit()
+    await db.refresh(db_profile_details)
+    await run_in_threadpool(profile_service.invalidate_profile, details.profile_id)
 
     return db_profile_details
@@ -1,128 +1,497 @@
-from fastapi import APIRouter, UploadFile, File, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Request, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from datetime import datetime
+from typing import Optional
+from sqlalchemy import and_, or_
+import json
 import uuid
-import ffmpeg
 import os
-import shutil
-from db.database import SessionLocal
-from models.encodeprofile import EncodeProfileDetails
+from db.database import get_async_db
+from auth.auth import Principal
+from models.encodeprofile import EncodeProfiles
 from models.videojob import VideoJob
+from routes.user import get_current_user, get_optional_user
+from schemas.upload import UploadInit, UploadFinalize
+from schemas.videojob import BatchSubmit, VideoJobRead, VideoJobStatus, JobStatusRequest
+from services.job_queue import enqueue_job, enqueue_jobs
+from services import outputs, probe, progress, scheduler, uploads
+from utils import metrics
+from utils.pagination import decode_cursor, encode_cursor, parse_fields
+from logging_config import logger as app_logger
 
 # FastAPI setup
 router = APIRouter()
+logger = app_logger.getChild("encoding")
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
+# Jobs accepted by one POST /jobs/batch
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "50000"))
+
+async def create_video_job(db, video_filename, encoding_profile, source_sha256=None, user_id=None, priority="normal"):
+    video_job = VideoJob(
+        video_filename=video_filename,
+        encoding_profile=encoding_profile,
+        status="queued",
+        source_sha256=source_sha256,
+        user_id=user_id,
+        priority=priority,
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow()
+    )
+
+    db.add(video_job)
+    await db.commit()
+    await db.refresh(video_job)
+    return video_job
+
+
+def is_admin(current_user):
+    return current_user.role in ("admin", "super_admin")
+
+
+def can_see(current_user, user_id):
+    # Jobs belong to their uploader; admins see every job
+    return is_admin(current_user) or user_id == current_user.id
+
+
+def job_priority(current_user, requested):
+    # Anonymous uploads are allowed and get the plain user's class
     try:
-        yield db
-    finally:
-        db.close()
+        return scheduler.priority_for(current_user.role if current_user else None, requested)
+    except ValueError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+async def reject_undecodable(video_path, sha256):
+    # Probe in the API so bad files never reach an encode worker; the result
+    # is cached by content hash for the worker's own probe
+    try:
+        await run_in_threadpool(probe.probe_source, video_path, sha256)
+    except probe.ProbeError as e:
+        logger.info("Rejected upload %s: %s", video_path, e)
+        if os.path.exists(video_path):
+            os.remove(video_path)
+        raise HTTPException(status_code=422, detail="Unsupported or corrupt video file")
+
 
 @router.put("/upload_video")
-async def upload_video(video: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_video(
+    request: Request,
+    video: Optional[UploadFile] = File(None),
+    stream: bool = Query(False, description="Send the raw file as the body and start encoding while it uploads"),
+    filename: Optional[str] = Query(None, description="Original file name, required with stream=true"),
+    priority: Optional[str] = Query(None, pattern="^(low|normal|high)$", description="Defaults to the uploader's role"),
+    current_user: Optional[Principal] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    user_id = current_user.id if current_user else None
+    priority = job_priority(current_user, priority)
+    if stream:
+        if video is not None or not filename:
+            raise HTTPException(status_code=400, detail="Stream mode takes the raw file as the body and a filename query parameter")
+        return await stream_upload_video(request, filename, db, user_id, priority)
+
+    if video is None:
+        raise HTTPException(status_code=422, detail="No video file uploaded")
+
     video_filename = f"{uuid.uuid4()}_{video.filename}"
     video_path = f"./videos/{video_filename}"
 
-    # Ensure the video directory exists
-    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    # Save uploaded video (off the event loop), hashing it for the dedup cache
+    with metrics.timed(metrics.UPLOAD_WRITE_SECONDS):
+        sha256 = await run_in_threadpool(uploads.save_and_hash, video.file, video_path)
+    await reject_undecodable(video_path, sha256)
 
-    # Save uploaded video
-    with open(video_path, "wb") as f:
-        shutil.copyfileobj(video.file, f)
+    video_job = await create_video_job(db, video_filename, 1, sha256, user_id, priority)  # Static encoding profile (you can modify this)
 
-    # Create a VideoJob entry in the database without user_id
-    video_job = VideoJob(
-        video_filename=video_filename,
-        encoding_profile=1,  # Static encoding profile (you can modify this)
-        status="queued",
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow()
+    # Hand the job to the encode workers; they pick it up from Dragonfly
+    await run_in_threadpool(enqueue_job, video_job.id, priority=priority)
+
+    return {"message": "Video uploaded and queued for encoding", "job_id": video_job.id}
+
+
+async def stream_upload_video(request, filename, db, user_id, priority):
+    upload_id, state = await uploads.create_upload(filename, None, 1, user_id, priority, stream=True)
+    streamable, chunks = await uploads.peek_stream(request.stream())
+
+    video_job = None
+    if streamable:
+        # Queue right away; the worker feeds ffmpeg from the file as it grows
+        video_job = await create_video_job(db, state["video_filename"], 1, user_id=user_id, priority=priority)
+        await run_in_threadpool(enqueue_job, video_job.id, priority=priority, upload_id=upload_id)
+
+    try:
+        await uploads.append_chunk(upload_id, state, 0, chunks, checkpoint_bytes=uploads.STREAM_CHECKPOINT_BYTES)
+    except BaseException:
+        # Includes ClientDisconnect; stops an encoder that is following the file
+        await uploads.abort_upload(upload_id, state["path"])
+        raise
+
+    state = await uploads.get_upload(upload_id)
+    sha256 = await uploads.upload_digest(upload_id, state)
+
+    if streamable:
+        video_job.source_sha256 = sha256
+        await db.commit()
+        await uploads.complete_upload(upload_id, state["video_filename"])
+        message = "Video uploaded; encoding started during upload"
+    else:
+        # moov atom at the end (or unknown container): encode after the save as usual
+        await uploads.discard_upload(upload_id, state["video_filename"])
+        await reject_undecodable(state["path"], sha256)
+        video_job = await create_video_job(db, state["video_filename"], 1, sha256, user_id, priority)
+        await run_in_threadpool(enqueue_job, video_job.id, priority=priority)
+        message = "Video uploaded and queued for encoding"
+
+    return {"message": message, "job_id": video_job.id, "streamed": bool(streamable), "sha256": sha256}
+
+
+# Resumable uploads: init, append chunks at an offset, then finalize.
+# Chunks are written straight to ./videos and hashed as they arrive.
+async def get_owned_upload(upload_id, current_user):
+    state = await uploads.get_upload(upload_id)
+    # Uploads belong to whoever started them, anonymous ones to anonymous
+    # callers; someone else's upload reads as missing, like their jobs
+    if current_user is None:
+        allowed = state and state["user_id"] is None
+    else:
+        allowed = state and can_see(current_user, state["user_id"])
+    if not allowed:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    return state
+
+
+@router.post("/uploads")
+async def init_upload(upload: UploadInit, current_user: Optional[Principal] = Depends(get_optional_user)):
+    upload_id, state = await uploads.create_upload(
+        upload.filename, upload.size, upload.encoding_profile,
+        current_user.id if current_user else None, job_priority(current_user, upload.priority),
     )
+    return {"upload_id": upload_id, "offset": state["offset"]}
 
-    db.add(video_job)
-    db.commit()
-    db.refresh(video_job)
 
-    # Process the video encoding (blocking)
-    process_video_encoding(video_job, db)
+@router.get("/uploads/{upload_id}")
+async def get_upload_status(upload_id: str, current_user: Optional[Principal] = Depends(get_optional_user)):
+    state = await get_owned_upload(upload_id, current_user)
+    return {
+        "upload_id": upload_id,
+        "offset": state["offset"],
+        "size": state["size"] if state["size"] >= 0 else None,
+    }
+
+
+@router.patch("/uploads/{upload_id}")
+async def append_upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    current_user: Optional[Principal] = Depends(get_optional_user),
+):
+    state = await get_owned_upload(upload_id, current_user)
+
+    try:
+        offset = await uploads.append_chunk(upload_id, state, upload_offset, request.stream())
+    except uploads.UploadConflict as e:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Offset mismatch, resume from {e.offset}",
+            headers={"Upload-Offset": str(e.offset)},
+        )
+    except uploads.UploadBusy:
+        raise HTTPException(status_code=409, detail="Another chunk for this upload is in progress")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"upload_id": upload_id, "offset": offset}
+
 
-    return {"message": "Video uploaded and encoding started", "job_id": video_job.id}
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    body: Optional[UploadFinalize] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[Principal] = Depends(get_optional_user),
+):
+    state = await get_owned_upload(upload_id, current_user)
+    if state["size"] >= 0 and state["offset"] != state["size"]:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete, resume from {state['offset']}")
 
+    sha256 = await uploads.upload_digest(upload_id, state)
+    if body and body.sha256 and body.sha256.lower() != sha256:
+        raise HTTPException(status_code=422, detail="Content hash mismatch")
+    await uploads.discard_upload(upload_id)
+    await reject_undecodable(state["path"], sha256)
 
-def process_video_encoding(video_job, db):
-    encoding_profile = db.query(EncodeProfileDetails).filter(
-        EncodeProfileDetails.profile_id == video_job.encoding_profile
-    ).first()
+    video_job = await create_video_job(
+        db, state["video_filename"], state["encoding_profile"], sha256, state["user_id"], state["priority"]
+    )
+    await run_in_threadpool(enqueue_job, video_job.id, priority=state["priority"])
 
-    if not encoding_profile:
-        print("Encoding profile not found!")
-        video_job.status = "failed"
-        video_job.updated_at = datetime.utcnow()
-        db.commit()
-        send_job_failure_notification(video_job)
-        return
+    return {"message": "Video uploaded and queued for encoding", "job_id": video_job.id, "sha256": sha256}
 
-    video_path = f"./videos/{video_job.video_filename}"
-    output_path = f"./videos/{video_job.video_filename.replace('.mp4', f'_{encoding_profile.profile}_encoded.mp4')}"
 
-    if not video_job.video_filename.lower().endswith(".mp4"):
-        video_job.status = "failed"
-        video_job.updated_at = datetime.utcnow()
-        db.commit()
-        send_job_failure_notification(video_job)
-        return {"message": "Only MP4 files are allowed."}
+# Many jobs at once, for backfills: files already in ./videos or, for admins,
+# files under INGEST_ROOT. One INSERT round trip and one Dragonfly pipeline
+# for the whole batch.
+@router.post("/jobs/batch")
+async def submit_batch(
+    body: BatchSubmit,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if len(body.jobs) > BATCH_MAX_JOBS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_JOBS} jobs per batch")
+    admin = is_admin(current_user)
+    if not admin and any(job.path is not None for job in body.jobs):
+        raise HTTPException(status_code=403, detail="Only admins can ingest local paths")
 
+    priorities = {requested: job_priority(current_user, requested) for requested in {job.priority for job in body.jobs}}
+    profile_ids = {job.encoding_profile for job in body.jobs}
+    known = set(await db.scalars(select(EncodeProfiles.id).where(EncodeProfiles.id.in_(profile_ids))))
+    if profile_ids - known:
+        raise HTTPException(status_code=422, detail=f"Unknown encoding profiles: {sorted(profile_ids - known)}")
+
+    sources = await uploads.submittable_sources(
+        db, {job.video_filename for job in body.jobs if job.video_filename is not None},
+        None if admin else current_user.id,
+    )
     try:
-        # Use FFmpeg to encode the video
-        ffmpeg.input(video_path).output(
-            output_path,
-            vcodec=encoding_profile.vcodec,
-            acodec=encoding_profile.acodec,
-            s=f"{encoding_profile.width}x{encoding_profile.height}",
-            bitrate=f"{encoding_profile.video_bitrate}k",
-            audio_bitrate=f"{encoding_profile.audio_bitrate}k",
-            ac=encoding_profile.audio_channel,
-            ar=encoding_profile.audio_frequency,
-            level=encoding_profile.level,
-            maxrate=f"{encoding_profile.max_bitrate}k",
-            bufsize=f"{encoding_profile.bufsize}k",
-            movflags=encoding_profile.movflags,
-            pix_fmt=encoding_profile.pix_fmt,
-        ).run()
-
-        video_job.status = "completed"
-        video_job.updated_at = datetime.utcnow()
-        db.commit()
-
-        send_job_completion_notification(video_job)
-
-    except ffmpeg.Error as e:
-        print(f"FFmpeg error: {e}")
-        video_job.status = "failed"
-        video_job.updated_at = datetime.utcnow()
-        db.commit()
-        send_job_failure_notification(video_job)
-    except Exception as e:
-        print(f"Unknown error: {str(e)}")
-        video_job.status = "failed"
-        video_job.updated_at = datetime.utcnow()
-        db.commit()
-        send_job_failure_notification(video_job)
-
-
-def send_job_completion_notification(video_job):
-    print(f"Job {video_job.id} completed successfully!")
-
-
-def send_job_failure_notification(video_job):
-    print(f"Job {video_job.id} failed!")
+        filenames = await run_in_threadpool(uploads.resolve_batch_sources, body.jobs, sources)
+    except uploads.IngestError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    batch_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    rows = [
+        {
+            "video_filename": video_filename,
+            "encoding_profile": job.encoding_profile,
+            "status": "queued",
+            "priority": priorities[job.priority],
+            "user_id": current_user.id,
+            "batch_id": batch_id,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for job, video_filename in zip(body.jobs, filenames)
+    ]
+    # executemany: the driver packs the rows into multi-row INSERTs. MySQL has
+    # no RETURNING, so the ids are read back by batch_id.
+    await db.execute(insert(VideoJob), rows)
+    await db.commit()
+    jobs = (await db.execute(
+        select(VideoJob.id, VideoJob.priority).where(VideoJob.batch_id == batch_id).order_by(VideoJob.id)
+    )).all()
+
+    await run_in_threadpool(enqueue_jobs, [(job_id, priority) for job_id, priority in jobs])
+    return {"batch_id": batch_id, "job_ids": [job_id for job_id, _ in jobs]}
+
+
+# Job history, newest first. Keyset pagination on (created_at, id), which the
+# (status, created_at) index serves when a status filter is given.
+@router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = Query(None),
+    encoding_profile: Optional[int] = Query(None),
+    batch_id: Optional[str] = Query(None),
+    created_from: Optional[datetime] = Query(None),
+    created_to: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma separated subset of the job fields"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    columns = parse_fields(fields, VideoJobRead.model_fields, required=("id", "created_at"))
+    query = select(*[getattr(VideoJob, column) for column in columns])
+    if not is_admin(current_user):
+        query = query.where(VideoJob.user_id == current_user.id)
+    if status is not None:
+        query = query.where(VideoJob.status == status)
+    if encoding_profile is not None:
+        query = query.where(VideoJob.encoding_profile == encoding_profile)
+    if batch_id is not None:
+        query = query.where(VideoJob.batch_id == batch_id)
+    if created_from is not None:
+        query = query.where(VideoJob.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(VideoJob.created_at < created_to)
+    if cursor:
+        try:
+            last_created_at, last_id = decode_cursor(cursor)
+            last_created_at = datetime.fromisoformat(last_created_at)
+            if type(last_id) is not int:
+                raise ValueError(last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(or_(
+            VideoJob.created_at < last_created_at,
+            and_(VideoJob.created_at == last_created_at, VideoJob.id < last_id),
+        ))
+
+    query = query.order_by(VideoJob.created_at.desc(), VideoJob.id.desc()).limit(limit)
+    rows = (await db.execute(query)).mappings().all()
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor([rows[-1]["created_at"].isoformat(), rows[-1]["id"]])
+    return {"jobs": [dict(row) for row in rows], "next_cursor": next_cursor}
+
+
+# Job status: DB record plus live progress from Dragonfly
+@router.get("/jobs/{job_id}", response_model=VideoJobStatus)
+async def get_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    video_job = await db.scalar(
+        select(VideoJob).options(selectinload(VideoJob.outputs)).where(VideoJob.id == job_id)
+    )
+    # Someone else's job reads as missing rather than forbidden
+    if not video_job or not can_see(current_user, video_job.user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "id": video_job.id,
+        "video_filename": video_job.video_filename,
+        "encoding_profile": video_job.encoding_profile,
+        "status": video_job.status,
+        "priority": video_job.priority,
+        "user_id": video_job.user_id,
+        "batch_id": video_job.batch_id,
+        "complexity_kbps": video_job.complexity_kbps,
+        "bitrate_scale": video_job.bitrate_scale,
+        "quality_status": video_job.quality_status,
+        "created_at": video_job.created_at,
+        "updated_at": video_job.updated_at,
+        "outputs": video_job.outputs,
+        "progress": await progress.get_progress(job_id),
+    }
+
+
+async def serve_output(request, db, current_user, job_id, rendition=None, filename=None):
+    output = await outputs.find_output(db, job_id, rendition=rendition, filename=filename)
+    if output is None or not can_see(current_user, output.user_id):
+        raise HTTPException(status_code=404, detail="Output not found")
+
+    headers = {
+        "ETag": output.etag,
+        "Last-Modified": output.last_modified,
+        "Cache-Control": f"private, max-age={outputs.OUTPUT_MAX_AGE}",
+    }
+    if outputs.not_modified(output, request.headers):
+        return Response(status_code=304, headers=headers)
+    if outputs.OUTPUT_ACCEL_PREFIX:
+        headers["X-Accel-Redirect"] = outputs.OUTPUT_ACCEL_PREFIX + output.filename
+        return Response(media_type=output.media_type, headers=headers)
+
+    # Range, multi-range and If-Range are handled by FileResponse; the cached
+    # stat spares it another one
+    return outputs.OutputFileResponse(
+        output.path, media_type=output.media_type, stat_result=output.stat, headers=headers,
+    )
+
+
+# Download a completed job's output: its largest rendition, or ?rendition=<profile detail id>
+@router.api_route("/jobs/{job_id}/output", methods=["GET", "HEAD"])
+async def download_output(
+    job_id: int,
+    request: Request,
+    rendition: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    return await serve_output(request, db, current_user, job_id, rendition=rendition)
+
+
+# Any output by filename, so the sprite index and streaming manifests can
+# refer to their sheets, playlists and segments relatively
+@router.api_route("/jobs/{job_id}/output/{filename:path}", methods=["GET", "HEAD"])
+async def download_output_file(
+    job_id: int,
+    filename: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    return await serve_output(request, db, current_user, job_id, filename=filename)
+
+
+# Server-sent events for dashboards; ends once the job completes or fails
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    video_job = await db.get(VideoJob, job_id)
+    if not video_job or not can_see(current_user, video_job.user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    initial_status = video_job.status
+
+    async def events():
+        # Subscribe before reading the snapshot so no update falls in between
+        pubsub = await progress.subscribe(job_id)
+        try:
+            snapshot = await progress.get_progress(job_id) or {"job_id": job_id, "status": initial_status}
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot.get("status") in progress.FINAL_STATUSES:
+                return
+
+            while not await request.is_disconnected():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message['data']}\n\n"
+                if json.loads(message["data"]).get("status") in progress.FINAL_STATUSES:
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# Bulk status; answered from Dragonfly, MySQL only for jobs that have not started
+@router.post("/jobs/status")
+async def get_jobs_status(
+    body: JobStatusRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    if len(body.job_ids) > 1000:
+        raise HTTPException(status_code=400, detail="At most 1000 job ids per request")
+
+    job_ids = list(dict.fromkeys(body.job_ids))
+    owned = None
+    if not is_admin(current_user):
+        # Ownership is only in MySQL; other users' jobs are left out like unknown ids
+        owned = dict((await db.execute(
+            select(VideoJob.id, VideoJob.status).where(VideoJob.id.in_(job_ids), VideoJob.user_id == current_user.id)
+        )).all())
+        job_ids = [job_id for job_id in job_ids if job_id in owned]
+    statuses = await progress.get_progress_many(job_ids)
+
+    missing = [job_id for job_id in job_ids if job_id not in statuses]
+    if missing:
+        if owned is None:
+            rows = await db.execute(select(VideoJob.id, VideoJob.status).where(VideoJob.id.in_(missing)))
+        else:
+            rows = [(job_id, owned[job_id]) for job_id in missing]
+        for job_id, status in rows:
+            statuses[job_id] = {"job_id": job_id, "status": status}
+
+    return {"jobs": [statuses[job_id] for job_id in job_ids if job_id in statuses]}
 
 
 # Admin endpoint to initialize the system
 @router.get("/admin/init")
-async def init_admin(db: Session = Depends(get_db)):
-    if not db.query(VideoJob).filter(VideoJob.status == "queued").first():
+async def init_admin(db: AsyncSession = Depends(get_async_db)):
+    if not await db.scalar(select(VideoJob.id).where(VideoJob.status == "queued").limit(1)):
         return {"message": "Please configure the super admin account"}
     return {"message": "System initialized"}
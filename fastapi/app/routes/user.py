@@ -1,52 +1,59 @@
-import redis
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from uuid import uuid4
+from typing import Optional
+from sqlalchemy import select
 from fastapi import Query
 from schemas.user import UserCreate, UserOut
 from models.user import User
+from utils.pagination import decode_cursor, encode_cursor, parse_fields
 from utils.security import hash_password
-from db.database import SessionLocal, redis_client
-from auth.auth import store_token, authenticate_user
+from db.database import get_db, get_async_db, redis_client, async_redis_client
+from auth import tokens as auth_tokens
+from auth.auth import (
+    Principal, authenticate_user, resolve_token, load_principal, invalidate_principal,
+    issue_login_tokens, revoke_signed_tokens, verify_signed_access_token,
+)
 
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 # OAuth2 token handler
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# For routes that also serve anonymous callers
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 # API Router
 router = APIRouter()
 
 
-# Dependency to get a DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    if auth_tokens.is_signed_token(token):
+        return verify_signed_access_token(token)
 
-
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    # Check if the token is blacklisted
-    if redis_client.exists(f"blacklisted:{token}"):
-        raise HTTPException(status_code=401, detail="Token has been blacklisted")
-
-    user_id = redis_client.get(f"token:{token}")
+    # Blacklist and token lookups go out as one pipeline
+    user_id = resolve_token(token)
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = db.query(User).filter(User.unique_id == user_id).first()
+    user = load_principal(db, user_id)
     if not user or not user.is_activated:
         raise HTTPException(status_code=403, detail="User is deactivated or not found")
 
     return user
 
 
+# Like get_current_user, but a request without a token gets None
+def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme), db: Session = Depends(get_db)
+) -> Optional[Principal]:
+    if token is None:
+        return None
+    return get_current_user(token, db)
+
+
 # Dependency for admin or super admin access
-def get_admin_user(current_user: User = Depends(get_current_user)):
+def get_admin_user(current_user: Principal = Depends(get_current_user)):
     if current_user.role not in ("admin", "super_admin"):
         raise HTTPException(status_code=403, detail="Insufficient privileges")
     return current_user
@@ -54,33 +61,14 @@ def get_admin_user(current_user: User = Depends(get_current_user)):
 
 
 @router.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
     if not user.is_activated:
         raise HTTPException(status_code=403, detail="User is deactivated")
 
-    existing_tokens = redis_client.smembers(f"user_tokens:{user.unique_id}")
-
-    valid_access_token = None
-    for token in existing_tokens:
-        token_str = token.decode() if isinstance(token, bytes) else token
-        # Check if token is blacklisted before assigning it as valid
-        if redis_client.exists(f"blacklisted:{token_str}"):
-            continue  # Skip blacklisted tokens
-        if redis_client.exists(f"token:{token_str}"):
-            valid_access_token = token_str
-            break
-
-    if valid_access_token:
-        access_token = valid_access_token
-    else:
-        access_token = str(uuid4())
-        store_token(access_token, user.unique_id)
-
-    refresh_token = str(uuid4())
-    store_token(refresh_token, user.unique_id, is_refresh=True)
+    access_token, refresh_token = await issue_login_tokens(user)
 
     response = JSONResponse(content={
         "access_token": access_token,
@@ -97,17 +85,39 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 
 
-# USERS: Get all users
+# USERS: List users by id. Pass next_cursor back as cursor for the next page.
 
-@router.get("/users", response_model=List[UserOut])
-def get_all_users(db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
-    return db.query(User).all()
+@router.get("/users")
+async def get_all_users(
+    role: Optional[str] = Query(None, pattern="^(user|admin|super_admin)$"),
+    is_activated: Optional[bool] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma separated subset of the user fields"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_admin_user),
+):
+    columns = parse_fields(fields, UserOut.model_fields)
+    query = select(*[getattr(User, column) for column in columns])
+    if role is not None:
+        query = query.where(User.role == role)
+    if is_activated is not None:
+        query = query.where(User.is_activated == is_activated)
+    if cursor:
+        last_id = decode_cursor(cursor)
+        if type(last_id) is not int:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(User.id > last_id)
+
+    rows = (await db.execute(query.order_by(User.id).limit(limit))).mappings().all()
+    next_cursor = encode_cursor(rows[-1]["id"]) if len(rows) == limit else None
+    return {"users": [dict(row) for row in rows], "next_cursor": next_cursor}
 
 
 # USERS: Create user
 
 @router.post("/users/create", response_model=UserOut)
-def create_user(user_data: UserCreate, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+def create_user(user_data: UserCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_admin_user)):
     # Check for duplicate email
     if db.query(User).filter(User.email == user_data.email).first():
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -146,7 +156,7 @@ def create_user(user_data: UserCreate, db: Session = Depends(get_db), current_us
 # USERS: Update user
 
 @router.put("/users/update/{user_id}", response_model=UserOut)
-def update_user(user_id: str, user_data: UserCreate, db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+def update_user(user_id: str, user_data: UserCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_admin_user)):
     db_user = db.query(User).filter(User.unique_id == user_id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -165,6 +175,8 @@ def update_user(user_id: str, user_data: UserCreate, db: Session = Depends(get_d
     if db.query(User).filter(User.email == user_data.email, User.unique_id != user_id).first():
         raise HTTPException(status_code=400, detail="Email already in use")
 
+    previous_role, was_activated = db_user.role, bool(db_user.is_activated)
+
     # Update user details
     db_user.name = user_data.name
     db_user.email = user_data.email
@@ -183,6 +195,10 @@ def update_user(user_id: str, user_data: UserCreate, db: Session = Depends(get_d
 
     db.commit()
     db.refresh(db_user)
+    invalidate_principal(db_user.unique_id)
+    if db_user.role != previous_role or (was_activated and not db_user.is_activated):
+        # Signed tokens would otherwise keep the old role or access until they expire
+        revoke_signed_tokens(db_user.unique_id)
     return db_user
 
 
@@ -192,7 +208,7 @@ def update_user(user_id: str, user_data: UserCreate, db: Session = Depends(get_d
 def blacklist_user_token(
     user_id: str,
     duration_minutes: int = Query(None, description="Duration in minutes to blacklist the token"),
-    current_user: User = Depends(get_admin_user)
+    current_user: Principal = Depends(get_admin_user)
 ):
     # Step 1: Fetch tokens from Redis
     tokens = redis_client.smembers(f"user_tokens:{user_id}")
@@ -209,10 +225,15 @@ def blacklist_user_token(
     for token in tokens:
         token_str = token.decode() if isinstance(token, bytes) else token
         redis_client.set(f"blacklisted:{token_str}", "1", ex=duration_minutes * 60 if duration_minutes else None)
-        redis_client.sadd("blacklisted_tokens", token_str)  
-        redis_client.set(f"token:{token_str}", user_id)      
+        redis_client.sadd("blacklisted_tokens", token_str)
+        redis_client.set(f"token:{token_str}", user_id)
+        if auth_tokens.is_signed_token(token_str):
+            auth_tokens.revoke_locally(token_str)
 
-       
+    invalidate_principal(user_id)
+    if auth_tokens.TOKEN_MODE == "signed":
+        # Publish the new filter now; other nodes pick it up on their next refresh
+        auth_tokens.refresh_revocation_filter(rebuild=True)
 
     return {
         "message": f"Tokens for user {user_id} have been blacklisted",
@@ -221,48 +242,50 @@ def blacklist_user_token(
 
 
 
-@router.get("/blacklisted-tokens/details")
-def get_blacklisted_token_details():
-    tokens = redis_client.smembers("blacklisted_tokens")
-    details = []
-    for token in tokens:
-        token_str = token.decode() if isinstance(token, bytes) else token
+def remaining_duration(ttl_seconds):
+    if ttl_seconds == -1:
+        return "permanent"
+    if ttl_seconds == -2:
+        return "expired"
+    return f"{ttl_seconds // 60} minutes"
 
-      
-        user_id = redis_client.get(f"token:{token_str}")
-        if user_id:
-            user_id = user_id.decode() if isinstance(user_id, bytes) else user_id
 
-        
-        ttl_seconds = redis_client.ttl(f"blacklisted:{token_str}")
+# Both listings page through Dragonfly with SCAN cursors instead of reading
+# every key at once; pass back next_cursor until it is 0.
+@router.get("/blacklisted-tokens/details")
+async def get_blacklisted_token_details(
+    cursor: int = Query(0, ge=0, description="Cursor from the previous page, 0 to start"),
+    count: int = Query(100, ge=1, le=1000, description="Approximate page size"),
+):
+    next_cursor, tokens = await async_redis_client.sscan("blacklisted_tokens", cursor, count=count)
 
-      
-        if ttl_seconds == -1:
-            duration = "permanent"
-        elif ttl_seconds == -2:
-            duration = "expired"
-        else:
-            duration = f"{ttl_seconds // 60} minutes"
+    pipe = async_redis_client.pipeline(transaction=False)
+    for token in tokens:
+        pipe.get(f"token:{token}")
+        pipe.ttl(f"blacklisted:{token}")
+    results = await pipe.execute()
 
-        details.append({
-            "token": token_str,
-            "user_id": user_id,
-            "remaining_duration": duration
-        })
+    details = [
+        {
+            "token": token,
+            "user_id": results[index * 2],
+            "remaining_duration": remaining_duration(results[index * 2 + 1]),
+        }
+        for index, token in enumerate(tokens)
+    ]
+    return {"blacklisted_tokens": details, "next_cursor": next_cursor}
 
-    return {"blacklisted_tokens": details}
 
 @router.get("/tokens/stored")
-def get_all_stored_tokens():
-    keys = redis_client.keys("token:*")
-    tokens = []
-    for key in keys:
-        token = key.decode().replace("token:", "") if isinstance(key, bytes) else key.replace("token:", "")
-        user_id = redis_client.get(key)
-        if user_id:
-            user_id = user_id.decode() if isinstance(user_id, bytes) else user_id
-        tokens.append({"token": token, "user_id": user_id})
-    return {"stored_tokens": tokens}
-
-
-
+async def get_all_stored_tokens(
+    cursor: int = Query(0, ge=0, description="Cursor from the previous page, 0 to start"),
+    count: int = Query(100, ge=1, le=1000, description="Approximate page size"),
+):
+    next_cursor, keys = await async_redis_client.scan(cursor, match="token:*", count=count)
+    user_ids = await async_redis_client.mget(keys) if keys else []
+
+    tokens = [
+        {"token": key[len("token:"):], "user_id": user_id}
+        for key, user_id in zip(keys, user_ids)
+    ]
+    return {"stored_tokens": tokens, "next_cursor": next_cursor}
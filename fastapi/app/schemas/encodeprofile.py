@@ -1,7 +1,34 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class EncodeProfileCreate(BaseModel):
     name: str
+    # Poster frame, seek-preview sprite sheets and preview clip; each is off without its width
+    poster_width: Optional[int] = None
+    poster_time: Optional[float] = None
+    sprite_width: Optional[int] = None
+    sprite_interval: float = 10
+    sprite_columns: int = 10
+    sprite_rows: int = 10
+    preview_width: Optional[int] = None
+    preview_start: Optional[float] = None
+    preview_duration: float = 10
+    # Adaptive streaming: mp4, hls, dash or hls_dash, cut into segment_duration second segments
+    output_format: str = "mp4"
+    segment_duration: int = 6
+    hls_segment_type: str = "fmp4"
+    # Scale the ladder's bitrates by the source's complexity, within these bounds
+    per_title: bool = False
+    per_title_min_scale: float = 0.5
+    per_title_max_scale: float = 1.5
+    # Score finished renditions against the source; floors left unset aren't checked
+    verify_quality: bool = False
+    min_ssim: Optional[float] = None
+    min_psnr: Optional[float] = None
+    min_vmaf: Optional[float] = None
+
+    class Config:
+        orm_mode = True
 
 class EncodeProfileDetailsCreate(BaseModel):
     profile_id: int
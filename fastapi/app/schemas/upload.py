@@ -0,0 +1,11 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+class UploadInit(BaseModel):
+    filename: str
+    size: Optional[int] = None  # Total bytes, if the client knows it up front
+    encoding_profile: int = 1
+    priority: Optional[str] = Field(None, pattern="^(low|normal|high)$")  # Defaults to the uploader's role
+
+class UploadFinalize(BaseModel):
+    sha256: Optional[str] = None  # Checked against the server-side hash when given
@@ -1,13 +1,55 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
 
 class VideoJobRead(BaseModel):
     id: int
     video_filename: str
     encoding_profile: int
     status: str
+    priority: str = "normal"
+    user_id: Optional[int] = None
+    batch_id: Optional[str] = None
+    complexity_kbps: Optional[float] = None
+    bitrate_scale: Optional[float] = None
+    quality_status: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
     class Config:
         orm_mode = True
+
+class VideoJobOutputRead(BaseModel):
+    id: int
+    profile_detail_id: Optional[int] = None
+    kind: str
+    filename: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    size_bytes: Optional[int] = None
+    video_bitrate: Optional[int] = None
+    max_bitrate: Optional[int] = None
+    bufsize: Optional[int] = None
+    ssim: Optional[float] = None
+    psnr: Optional[float] = None
+    vmaf: Optional[float] = None
+    quality_flagged: Optional[bool] = None
+
+    class Config:
+        orm_mode = True
+
+class VideoJobStatus(VideoJobRead):
+    outputs: List[VideoJobOutputRead] = []
+    progress: Optional[dict] = None  # Live ffmpeg progress from Dragonfly, if the job has started
+
+class JobStatusRequest(BaseModel):
+    job_ids: List[int]
+
+class BatchJob(BaseModel):
+    video_filename: Optional[str] = None  # A file already in the videos directory
+    path: Optional[str] = None  # Relative to INGEST_ROOT on the API host (admins only)
+    encoding_profile: int
+    priority: Optional[str] = Field(None, pattern="^(low|normal|high)$")
+
+class BatchSubmit(BaseModel):
+    jobs: List[BatchJob] = Field(..., min_length=1)
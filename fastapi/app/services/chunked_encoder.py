@@ -0,0 +1,228 @@
+import csv
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ffmpeg
+from db.database import redis_client
+from services import job_queue, scheduler
+from services.progress import ProgressReporter
+
+# Sources at least this long (seconds) are cut into segments and encoded in
+# parallel. "pool" encodes the segments in a local process pool, "queue"
+# hands them to the encode workers of every node through the job queue (the
+# videos directory must then be shared storage).
+CHUNK_MIN_DURATION = float(os.getenv("CHUNK_MIN_DURATION", "600"))
+CHUNK_DURATION = int(os.getenv("CHUNK_DURATION", "60"))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_DISPATCH = os.getenv("CHUNK_DISPATCH", "pool")
+# Initial VBV fill assumed at the start of every segment. Keeping it below
+# the x264 default means a segment never spends bits the previous one may
+# already have used, so maxrate/bufsize still hold across the joins.
+CHUNK_VBV_INIT = float(os.getenv("CHUNK_VBV_INIT", "0.5"))
+
+CHUNK_DIR = "./videos/.chunks"
+
+
+def should_chunk(duration):
+    return CHUNK_MIN_DURATION > 0 and duration >= CHUNK_MIN_DURATION
+
+
+def work_dir(job_id):
+    path = f"{CHUNK_DIR}/{job_id}"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def split_source(video_path, work):
+    """Cut the source's video at keyframes into stream-copied segments.
+
+    Returns the segment paths. A finished split is reused when the job is
+    picked up again after a worker restart.
+    """
+    segment_list = f"{work}/segments.csv"
+    done_marker = f"{work}/split.done"
+
+    if not os.path.exists(done_marker):
+        ffmpeg.input(video_path).output(
+            f"{work}/source_%05d.mkv",
+            map="0:v:0",
+            c="copy",
+            f="segment",
+            segment_time=CHUNK_DURATION,
+            segment_list=segment_list,
+            segment_list_type="csv",
+            reset_timestamps=1,
+        ).run(overwrite_output=True, quiet=True)
+        open(done_marker, "w").close()
+
+    with open(segment_list) as f:
+        return [f"{work}/{row[0]}" for row in csv.reader(f) if row]
+
+
+def segment_output_path(segment_path, spec):
+    return f"{os.path.splitext(segment_path)[0]}_{spec['id']}.mp4"
+
+
+def audio_output_path(work, index):
+    return f"{work}/audio_{index}.m4a"
+
+
+def encode_segment(segment_path, specs, threads):
+    """Encode one source segment into every rendition (video only).
+
+    threads is the segment's whole thread budget, shared between the
+    renditions; 0 lets ffmpeg pick.
+    """
+    pending = [spec for spec in specs if not os.path.exists(segment_output_path(segment_path, spec))]
+    if not pending:
+        return
+
+    if threads:
+        output_threads = scheduler.split_threads(threads, [(spec["width"], spec["height"]) for spec in pending])
+    else:
+        output_threads = [0] * len(pending)
+
+    split = ffmpeg.input(segment_path).video.filter_multi_output("split")
+    outputs = []
+    for index, spec in enumerate(pending):
+        args = dict(spec["video_args"])
+        # Closed GOPs so every segment decodes on its own after the concat
+        args["flags"] = "+cgop"
+        if spec["bufsize"]:
+            args["rc_init_occupancy"] = int(spec["bufsize"] * 1000 * CHUNK_VBV_INIT)
+        outputs.append(ffmpeg.output(
+            split[index].filter("scale", spec["width"], spec["height"]),
+            segment_output_path(segment_path, spec) + ".part",
+            f="mp4",
+            threads=output_threads[index],
+            **args,
+        ))
+    ffmpeg.merge_outputs(*outputs).run(overwrite_output=True, quiet=True)
+
+    # Rename only once the whole segment is written so restarts never reuse a torn file
+    for spec in pending:
+        output_path = segment_output_path(segment_path, spec)
+        os.replace(output_path + ".part", output_path)
+
+
+def encode_audio(video_path, args, output_path):
+    # Audio is cheap; encoding it whole avoids priming gaps at segment joins
+    if os.path.exists(output_path):
+        return
+    ffmpeg.input(video_path).output(
+        output_path + ".part", map="0:a:0", f="mp4", **args
+    ).run(overwrite_output=True, quiet=True)
+    os.replace(output_path + ".part", output_path)
+
+
+def assemble(work, segments, specs, audio_paths, output_paths):
+    # Join the encoded segments per rendition with a stream copy and add the audio
+    for spec, output_path in zip(specs, output_paths):
+        concat_list = f"{work}/concat_{spec['id']}.txt"
+        with open(concat_list, "w") as f:
+            for segment_path in segments:
+                f.write(f"file '{os.path.abspath(segment_output_path(segment_path, spec))}'\n")
+
+        streams = [ffmpeg.input(concat_list, f="concat", safe=0).video]
+        audio_path = audio_paths.get(spec["audio_group"])
+        if audio_path:
+            streams.append(ffmpeg.input(audio_path).audio)
+        ffmpeg.output(
+            *streams, output_path, c="copy", movflags=spec["movflags"]
+        ).run(overwrite_output=True, quiet=True)
+
+
+def audio_jobs(video_path, work, specs, with_audio):
+    if not with_audio:
+        return {}
+    jobs = {}
+    for spec in specs:
+        if spec["audio_group"] not in jobs:
+            jobs[spec["audio_group"]] = (spec["audio_args"], audio_output_path(work, spec["audio_group"]))
+    return jobs
+
+
+def encode_chunked(job_id, video_path, specs, output_paths, with_audio, user_id=None):
+    """Encode a long source segment-parallel in a local process pool."""
+    work = work_dir(job_id)
+    segments = split_source(video_path, work)
+    audio = audio_jobs(video_path, work, specs, with_audio)
+    threads = max(1, scheduler.NODE_CPUS // CHUNK_WORKERS)
+
+    reporter = ProgressReporter(job_id, user_id=user_id)
+
+    with ProcessPoolExecutor(max_workers=CHUNK_WORKERS) as pool:
+        futures = [pool.submit(encode_segment, segment, specs, threads) for segment in segments]
+        futures += [pool.submit(encode_audio, video_path, args, path) for args, path in audio.values()]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            reporter.report_parts(done, len(futures))
+
+    assemble(work, segments, specs, {group: path for group, (_, path) in audio.items()}, output_paths)
+    shutil.rmtree(work, ignore_errors=True)
+
+
+def dispatch_chunks(job_id, video_path, specs, with_audio, rendition_ids, priority=job_queue.DEFAULT_PRIORITY,
+                    with_extras=False):
+    """Split the source and fan the segments out over the job queue.
+
+    with_extras adds one more task for the profile's posters, sprites and
+    preview, which need a decode of the whole source of their own.
+    """
+    work = work_dir(job_id)
+    segments = split_source(video_path, work)
+    audio = audio_jobs(video_path, work, specs, with_audio)
+
+    tasks = [
+        job_queue.make_task("chunk", job_id=job_id, renditions=rendition_ids, segment=index, priority=priority)
+        for index in range(len(segments))
+    ]
+    tasks += [
+        job_queue.make_task("chunk", job_id=job_id, renditions=rendition_ids, audio_group=group, priority=priority)
+        for group in audio
+    ]
+    if with_extras:
+        tasks.append(
+            job_queue.make_task("chunk", job_id=job_id, renditions=rendition_ids, extras=True, priority=priority)
+        )
+    redis_client.set(f"chunks:{job_id}:total", len(tasks))
+    job_queue.enqueue_many([(task, priority) for task in tasks])
+    return len(tasks)
+
+
+def run_chunk(job_id, video_path, specs, with_audio, segment=None, audio_group=None, threads=0, user_id=None):
+    """Encode one queued chunk. Returns True when it was the job's last one."""
+    work = work_dir(job_id)
+    if segment is not None:
+        segments = split_source(video_path, work)
+        encode_segment(segments[segment], specs, threads)
+        member = f"segment:{segment}"
+    else:
+        args, path = audio_jobs(video_path, work, specs, with_audio)[audio_group]
+        encode_audio(video_path, args, path)
+        member = f"audio:{audio_group}"
+    return mark_chunk_done(job_id, member, user_id)
+
+
+def mark_chunk_done(job_id, member, user_id=None):
+    """Record a finished chunk. Returns True when it was the job's last one."""
+    # A set rather than a counter, so a redelivered chunk is not counted twice
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.sadd(f"chunks:{job_id}:done", member)
+    pipe.scard(f"chunks:{job_id}:done")
+    pipe.get(f"chunks:{job_id}:total")
+    _, done, total = pipe.execute()
+    if total is None:
+        return False
+    ProgressReporter(job_id, user_id=user_id).report_parts(int(done), int(total))
+    return int(done) >= int(total)
+
+
+def assemble_chunks(job_id, video_path, specs, output_paths, with_audio):
+    work = work_dir(job_id)
+    segments = split_source(video_path, work)
+    audio = audio_jobs(video_path, work, specs, with_audio)
+    assemble(work, segments, specs, {group: path for group, (_, path) in audio.items()}, output_paths)
+
+    shutil.rmtree(work, ignore_errors=True)
+    redis_client.delete(f"chunks:{job_id}:done", f"chunks:{job_id}:total")
@@ -0,0 +1,70 @@
+import os
+import ffmpeg
+from db.database import redis_client
+
+# Per-title analysis: a few short windows of the source are encoded at low
+# resolution with a fixed CRF, and the bitrate that takes is compared with
+# what typical content needs at the same settings. Slides and talking heads
+# come out well below the reference, sports and grain above it; the ladder's
+# bitrates are scaled by that ratio within the profile's bounds.
+PER_TITLE_WIDTH = int(os.getenv("PER_TITLE_WIDTH", "640"))
+PER_TITLE_CRF = int(os.getenv("PER_TITLE_CRF", "23"))
+PER_TITLE_PRESET = os.getenv("PER_TITLE_PRESET", "veryfast")
+PER_TITLE_SAMPLES = int(os.getenv("PER_TITLE_SAMPLES", "5"))
+PER_TITLE_SAMPLE_SECONDS = float(os.getenv("PER_TITLE_SAMPLE_SECONDS", "4"))
+# Probe bitrate, at the settings above, of the content the ladders were tuned for
+PER_TITLE_REFERENCE_KBPS = float(os.getenv("PER_TITLE_REFERENCE_KBPS", "800"))
+# Probe results are keyed by content hash like ffprobe's, so re-encodes of a
+# source under other profiles don't repeat the probe
+PER_TITLE_CACHE_TTL = int(os.getenv("PER_TITLE_CACHE_TTL", str(7 * 24 * 60 * 60)))
+
+
+def sample_windows(duration, count=PER_TITLE_SAMPLES, length=PER_TITLE_SAMPLE_SECONDS):
+    """(start, length) of each window, spread evenly and clear of the very start and end."""
+    if duration <= count * length:
+        return [(0.0, duration)]
+    step = duration / count
+    return [(step * index + (step - length) / 2, length) for index in range(count)]
+
+
+def probe_width(meta):
+    width = min(meta["video"]["width"], PER_TITLE_WIDTH)
+    return width - width % 2
+
+
+def probe_kbps(video_path, meta, threads=0):
+    """Bitrate of the CRF probe encode over the sampled windows."""
+    width = probe_width(meta)
+    bits, seconds = 0, 0.0
+    for start, length in sample_windows(meta["duration"]):
+        # Raw H.264 to a pipe: only its size matters
+        encoded, _ = (
+            ffmpeg.input(video_path, ss=start, t=length).video
+            .filter("scale", width, -2)
+            .output("pipe:", f="h264", vcodec="libx264", crf=PER_TITLE_CRF, preset=PER_TITLE_PRESET,
+                    pix_fmt="yuv420p", threads=threads)
+            .run(capture_stdout=True, quiet=True)
+        )
+        bits += len(encoded) * 8
+        seconds += length
+    return bits / seconds / 1000 if seconds else PER_TITLE_REFERENCE_KBPS
+
+
+def measure_kbps(video_path, meta, source_sha256=None, threads=0):
+    # The probe settings are part of the key: changing them changes the result
+    cache_key = (
+        f"complexity:{source_sha256}:{PER_TITLE_WIDTH}:{PER_TITLE_CRF}:{PER_TITLE_PRESET}"
+        f":{PER_TITLE_SAMPLES}:{PER_TITLE_SAMPLE_SECONDS}"
+    ) if source_sha256 else None
+    if cache_key:
+        cached = redis_client.get(cache_key)
+        if cached:
+            return float(cached)
+    kbps = probe_kbps(video_path, meta, threads)
+    if cache_key:
+        redis_client.set(cache_key, kbps, ex=PER_TITLE_CACHE_TTL)
+    return kbps
+
+
+def bitrate_scale(kbps, config):
+    return min(config.max_scale, max(config.min_scale, kbps / PER_TITLE_REFERENCE_KBPS))
@@ -0,0 +1,106 @@
+import os
+import shutil
+import time
+from db.database import redis_client
+
+# Encoded renditions keyed by (source content hash, rendition fingerprint).
+# Job outputs are hard links to the cached file, so the file's link count is
+# the reference count: an entry with st_nlink == 1 is only held by the cache
+# and is the only kind whose eviction actually frees disk space.
+CACHE_DIR = "./videos/cache"
+CACHE_QUOTA_BYTES = int(os.getenv("ENCODE_CACHE_QUOTA_BYTES", str(50 * 1024 ** 3)))
+CACHE_ENABLED = os.getenv("ENCODE_CACHE_ENABLED", "1") == "1"
+
+LRU_KEY = "encode_cache:lru"
+SIZES_KEY = "encode_cache:sizes"
+EVICT_LOCK_KEY = "encode_cache:evict_lock"
+
+
+def cache_key(source_sha256, fingerprint):
+    return f"{source_sha256}_{fingerprint}"
+
+
+def cache_path(key):
+    return f"{CACHE_DIR}/{key[:2]}/{key}.mp4"
+
+
+def _link(source, target):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Different filesystem: fall back to a real copy
+        shutil.copyfile(source, target)
+
+
+def lookup(source_sha256, fingerprint):
+    key = cache_key(source_sha256, fingerprint)
+    path = cache_path(key)
+    if not os.path.exists(path):
+        return None
+    redis_client.zadd(LRU_KEY, {key: time.time()})
+    return path
+
+
+def link_cached(source_sha256, fingerprint, output_path):
+    """Point output_path at a cached encode. Returns False on a miss."""
+    path = lookup(source_sha256, fingerprint)
+    if path is None:
+        return False
+    try:
+        _link(path, output_path)
+    except FileNotFoundError:
+        # Evicted between the lookup and the link
+        return False
+    return True
+
+
+def store(source_sha256, fingerprint, output_path):
+    key = cache_key(source_sha256, fingerprint)
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        try:
+            os.link(output_path, path)
+        except FileExistsError:
+            pass  # Same encode finished concurrently on another slot
+        except OSError:
+            shutil.copyfile(output_path, path)
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(LRU_KEY, {key: time.time()})
+    pipe.hset(SIZES_KEY, key, os.path.getsize(path))
+    pipe.execute()
+
+    evict()
+
+
+def evict():
+    """Drop least recently used, unreferenced entries until under quota."""
+    if not redis_client.set(EVICT_LOCK_KEY, 1, nx=True, ex=60):
+        return  # Another worker is already evicting
+    try:
+        sizes = redis_client.hgetall(SIZES_KEY)
+        total = sum(int(size) for size in sizes.values())
+        if total <= CACHE_QUOTA_BYTES:
+            return
+
+        for key in redis_client.zrange(LRU_KEY, 0, -1):
+            if total <= CACHE_QUOTA_BYTES:
+                break
+            path = cache_path(key)
+            try:
+                if os.stat(path).st_nlink > 1:
+                    continue  # Still referenced by job outputs
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.zrem(LRU_KEY, key)
+            pipe.hdel(SIZES_KEY, key)
+            pipe.execute()
+            total -= int(sizes.get(key, 0))
+    finally:
+        redis_client.delete(EVICT_LOCK_KEY)
@@ -0,0 +1,619 @@
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from functools import partial
+import ffmpeg
+from models.videojob import VideoJobOutput
+from services import (
+    chunked_encoder, complexity, encode_cache, extras, job_queue, packager, probe, profile_service, quality, scheduler,
+    stream_ingest, webhooks,
+)
+from services.progress import ProgressReporter, publish_status
+from utils import metrics
+from logging_config import logger as app_logger
+
+logger = app_logger.getChild("encoder")
+
+VIDEO_DIR = "./videos"
+# Bump when the encode pipeline changes in a way that alters output bytes,
+# so the dedup cache stops serving files made by the old pipeline
+ENCODER_VERSION = 1
+# Bytes of a streaming upload to wait for before probing it
+STREAM_PROBE_BYTES = int(os.getenv("STREAM_PROBE_BYTES", str(2 * 1024 * 1024)))
+
+
+# Renditions are CompiledRendition tuples from profile_service; their
+# ffmpeg arguments were built and validated when the profile was compiled
+def video_args(detail):
+    return dict(detail.video_args)
+
+
+def audio_args(detail):
+    return dict(detail.audio_args)
+
+
+def audio_key(detail):
+    # Renditions with the same key get byte-identical audio
+    return (detail.acodec, detail.audio_bitrate, detail.audio_channel, detail.audio_frequency)
+
+
+def rendition_fingerprint(detail):
+    settings = {
+        "version": ENCODER_VERSION,
+        "width": detail.width,
+        "height": detail.height,
+        "movflags": detail.movflags,
+        "video": video_args(detail),
+        "audio": audio_args(detail),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def rendition_output_path(video_filename, detail):
+    stem, _ = os.path.splitext(video_filename)
+    return f"{VIDEO_DIR}/{stem}_{detail.id}_{detail.width}x{detail.height}_encoded.mp4"
+
+
+def rendition_specs(renditions):
+    # Plain-data view of the ladder that can be shipped to other processes
+    audio_groups = {}
+    return [
+        {
+            "id": detail.id,
+            "width": detail.width,
+            "height": detail.height,
+            "bufsize": detail.bufsize,
+            "movflags": detail.movflags,
+            "video_args": video_args(detail),
+            "audio_args": audio_args(detail),
+            "audio_group": audio_groups.setdefault(audio_key(detail), len(audio_groups)),
+        }
+        for detail in renditions
+    ]
+
+
+def source_metadata(video_job, video_path):
+    return probe.probe_source(video_path, video_job.source_sha256)
+
+
+def ladder_cost(meta, renditions):
+    return scheduler.encode_cost(
+        meta["video"]["width"], meta["video"]["height"], [(detail.width, detail.height) for detail in renditions]
+    )
+
+
+def plan_renditions(meta, renditions):
+    """Drop renditions that would upscale the source.
+
+    If every rendition is larger than the source the smallest one is kept,
+    so the job still produces an output.
+    """
+    kept = [detail for detail in renditions if not probe.would_upscale(meta, detail)]
+    if not kept and renditions:
+        kept = [min(renditions, key=lambda detail: detail.width * detail.height)]
+    for detail in renditions:
+        if detail not in kept:
+            logger.info("Skipping rendition %s (%sx%s): source is %sx%s", detail.id, detail.width, detail.height,
+                        meta["video"]["width"], meta["video"]["height"])
+    return kept
+
+
+def remux_rendition(video_path, detail, output_path, meta):
+    # The source video already fits this rendition: copy it, and the audio too when it fits
+    source = ffmpeg.input(video_path)
+    streams = [source.video]
+    args = {"vcodec": "copy", "movflags": detail.movflags}
+    if meta["audio"] is not None:
+        streams.append(source.audio)
+        if probe.can_copy_audio(meta, detail):
+            args["acodec"] = "copy"
+        else:
+            args.update(audio_args(detail))
+    ffmpeg.output(*streams, output_path, **args).run(overwrite_output=True)
+
+
+def run_graph(graph, reporter=None, feed=None):
+    """Run an ffmpeg graph, streaming -progress to reporter and feeding stdin from feed."""
+    if reporter is None and feed is None:
+        graph.run(overwrite_output=True)
+        return
+
+    if reporter is not None:
+        graph = graph.global_args("-progress", "pipe:1", "-nostats")
+    process = graph.run_async(
+        pipe_stdin=feed is not None,
+        pipe_stdout=reporter is not None,
+        overwrite_output=True,
+    )
+
+    reader = None
+    if reporter is not None:
+        reader = threading.Thread(target=reporter.consume, args=(process.stdout,), daemon=True)
+        reader.start()
+    try:
+        if feed is not None:
+            feed(process.stdin)
+            process.stdin.close()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+
+    returncode = process.wait()
+    if reader is not None:
+        reader.join()
+    if returncode != 0:
+        raise ffmpeg.Error("ffmpeg", None, None)
+
+
+def encode_ladder(video_path, renditions, output_paths, with_audio, upload_id=None, reporter=None, threads=0,
+                  extras_plan=None):
+    """Encode every rendition from a single decode of the source.
+
+    The decoded video is split once and scaled per rendition. Audio that
+    several renditions share is encoded once into a side file and muxed
+    into each of them afterwards with a stream copy. With an upload_id the
+    source is read through stdin while it is still being uploaded. threads
+    caps the filter graph and is shared between the video encoders; 0 lets
+    ffmpeg size them to the machine. The profile's posters, sprites and
+    preview in extras_plan are further branches of the same split.
+    """
+    source = ffmpeg.input("pipe:0" if upload_id else video_path)
+    split = source.video.filter_multi_output("split")
+
+    audio_groups = defaultdict(list)
+    if with_audio:
+        for index, detail in enumerate(renditions):
+            audio_groups[audio_key(detail)].append(index)
+
+    shared_audio = {}
+    for key, members in audio_groups.items():
+        if len(members) > 1:
+            stem, _ = os.path.splitext(output_paths[members[0]])
+            shared_audio[key] = f"{stem}.audio.m4a"
+
+    output_threads = scheduler.split_threads(threads, [(detail.width, detail.height) for detail in renditions])
+
+    outputs = []
+    remux = []
+    for index, detail in enumerate(renditions):
+        scaled = split[index].filter("scale", detail.width, detail.height)
+        output_path = output_paths[index]
+        encoder_args = video_args(detail)
+        if threads:
+            encoder_args["threads"] = output_threads[index]
+
+        if with_audio and audio_key(detail) in shared_audio:
+            video_only_path = f"{os.path.splitext(output_path)[0]}.video.mp4"
+            outputs.append(ffmpeg.output(scaled, video_only_path, **encoder_args))
+            remux.append((video_only_path, shared_audio[audio_key(detail)], output_path, detail.movflags))
+        elif with_audio:
+            outputs.append(ffmpeg.output(
+                scaled, source.audio, output_path,
+                movflags=detail.movflags, **encoder_args, **audio_args(detail)
+            ))
+        else:
+            outputs.append(ffmpeg.output(scaled, output_path, movflags=detail.movflags, **encoder_args))
+
+    extras.clear(extras_plan)
+    for index, branch in enumerate(extras.branches(extras_plan), start=len(renditions)):
+        outputs.append(branch(split[index]))
+
+    for key, audio_path in shared_audio.items():
+        detail = renditions[audio_groups[key][0]]
+        outputs.append(ffmpeg.output(source.audio, audio_path, **audio_args(detail)))
+
+    try:
+        # Feed ffmpeg's stdin from the upload as it lands on disk
+        feed = partial(stream_ingest.follow_upload, upload_id, video_path) if upload_id else None
+        graph = ffmpeg.merge_outputs(*outputs)
+        if threads:
+            graph = graph.global_args("-filter_complex_threads", str(threads))
+        run_graph(graph, reporter=reporter, feed=feed)
+
+        # Stream copy only; no decoding or encoding happens here
+        for video_only_path, audio_path, output_path, movflags in remux:
+            ffmpeg.output(
+                ffmpeg.input(video_only_path).video,
+                ffmpeg.input(audio_path).audio,
+                output_path,
+                c="copy",
+                movflags=movflags,
+            ).run(overwrite_output=True)
+    finally:
+        for video_only_path, _, _, _ in remux:
+            if os.path.exists(video_only_path):
+                os.remove(video_only_path)
+        for audio_path in shared_audio.values():
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+
+
+def discard_stream_source(video_job):
+    # A failed stream encode is never resumed, and its source may be partial
+    stream_ingest.discard_partial_source(f"{VIDEO_DIR}/{video_job.video_filename}")
+
+
+def mark_job_failed(video_job, db):
+    db.rollback()
+    video_job.status = "failed"
+    video_job.updated_at = datetime.utcnow()
+    db.commit()
+    publish_status(video_job.id, "failed")
+    metrics.ENCODE_JOBS.labels(str(video_job.encoding_profile), "failed").inc()
+    send_job_failure_notification(video_job)
+
+
+def record_encode_metrics(video_job, started_at, source_seconds, output_bytes):
+    profile = str(video_job.encoding_profile)
+    # Spans every task of a chunked job, whichever nodes ran them
+    elapsed = (video_job.updated_at - started_at).total_seconds()
+    metrics.ENCODE_JOBS.labels(profile, "completed").inc()
+    metrics.ENCODE_OUTPUT_BYTES.labels(profile).inc(output_bytes)
+    metrics.ENCODE_SECONDS.labels(profile).observe(elapsed)
+    if source_seconds and elapsed > 0:
+        metrics.ENCODE_REALTIME_FACTOR.labels(profile).observe(source_seconds / elapsed)
+
+
+def complete_job(video_job, db, renditions, output_paths, source_seconds=None, extra_outputs=()):
+    output_bytes = 0
+    for detail, output_path in zip(renditions, output_paths):
+        size_bytes = os.path.getsize(output_path)
+        output_bytes += size_bytes
+        db.add(VideoJobOutput(
+            job_id=video_job.id,
+            profile_detail_id=detail.id,
+            kind="rendition",
+            filename=os.path.basename(output_path),
+            width=detail.width,
+            height=detail.height,
+            size_bytes=size_bytes,
+            video_bitrate=detail.video_bitrate,
+            max_bitrate=detail.max_bitrate,
+            bufsize=detail.bufsize,
+            created_at=datetime.utcnow(),
+        ))
+    for extra in extra_outputs:
+        if extra.kind in packager.PACKAGE_KINDS:
+            size_bytes = packager.package_size(extra.path)
+        else:
+            size_bytes = os.path.getsize(extra.path)
+        output_bytes += size_bytes
+        db.add(VideoJobOutput(
+            job_id=video_job.id,
+            kind=extra.kind,
+            # Packages are recorded by their manifest, below their own directory
+            filename=os.path.relpath(extra.path, VIDEO_DIR),
+            width=extra.width,
+            height=extra.height,
+            size_bytes=size_bytes,
+            created_at=datetime.utcnow(),
+        ))
+
+    # updated_at was last set when the job went to processing
+    started_at = video_job.updated_at
+    video_job.status = "completed"
+    video_job.updated_at = datetime.utcnow()
+    db.commit()
+    publish_status(video_job.id, "completed")
+    record_encode_metrics(video_job, started_at, source_seconds, output_bytes)
+
+    send_job_completion_notification(video_job)
+
+
+def load_renditions(video_job, db, rendition_ids=None):
+    profile = profile_service.get_profile(video_job.encoding_profile, db)
+    if profile is None:
+        return []
+    renditions = list(profile.renditions)
+    if rendition_ids is not None:
+        renditions = [detail for detail in renditions if detail.id in rendition_ids]
+    # Chunk and assembly tasks pick up the scale the job was analysed at
+    if video_job.bitrate_scale is not None:
+        renditions = [profile_service.scale_bitrates(detail, video_job.bitrate_scale) for detail in renditions]
+    return renditions
+
+
+def analyse_complexity(video_job, db, video_path, meta, renditions):
+    """Scale the ladder's bitrates to the source's complexity if its profile asks for it."""
+    profile = profile_service.get_profile(video_job.encoding_profile, db)
+    # A retried job was scaled by load_renditions already
+    if profile is None or profile.per_title is None or video_job.bitrate_scale is not None:
+        return renditions
+    width = complexity.probe_width(meta)
+    cost = scheduler.encode_cost(
+        meta["video"]["width"], meta["video"]["height"],
+        [(width, round(width * meta["video"]["height"] / meta["video"]["width"]))],
+    )
+    with scheduler.budget.reserve(cost):
+        kbps = complexity.measure_kbps(video_path, meta, video_job.source_sha256, threads=cost.threads)
+    video_job.complexity_kbps = round(kbps, 1)
+    video_job.bitrate_scale = round(complexity.bitrate_scale(kbps, profile.per_title), 3)
+    db.commit()
+    logger.info("Job %s: complexity %.0f kbps, bitrates scaled by %s", video_job.id, kbps, video_job.bitrate_scale)
+    return [profile_service.scale_bitrates(detail, video_job.bitrate_scale) for detail in renditions]
+
+
+def finish_job(video_job, db, renditions, output_paths, meta, plan):
+    """Package the finished renditions for streaming, then record every output."""
+    stem, _ = os.path.splitext(video_job.video_filename)
+    packages = packager.package(
+        load_packaging(video_job, db), f"{VIDEO_DIR}/{stem}", renditions, output_paths,
+        meta["audio"] is not None, [spec["audio_group"] for spec in rendition_specs(renditions)],
+    )
+    profile = profile_service.get_profile(video_job.encoding_profile, db)
+    verify = profile is not None and profile.quality is not None
+    if verify:
+        video_job.quality_status = "pending"
+    complete_job(video_job, db, renditions, output_paths, meta["duration"], extras.collect(plan) + packages)
+    if verify:
+        # Behind encodes: the job is usable already, the check only reports on it
+        job_queue.enqueue(job_queue.make_task("verify", job_id=video_job.id, priority="low"), priority="low")
+
+
+def verify_job_quality(video_job, db):
+    """Score each rendition against the source and flag those under the profile's floors."""
+    profile = profile_service.get_profile(video_job.encoding_profile, db)
+    if profile is None or profile.quality is None:
+        return
+    video_path = f"{VIDEO_DIR}/{video_job.video_filename}"
+    outputs = (
+        db.query(VideoJobOutput)
+        .filter(VideoJobOutput.job_id == video_job.id, VideoJobOutput.kind == "rendition")
+        .all()
+    )
+    try:
+        meta = source_metadata(video_job, video_path)
+        # Both streams are decoded and compared at the source's size
+        width, height = meta["video"]["width"], meta["video"]["height"]
+        cost = scheduler.encode_cost(width, height, [(width, height)])
+        for output in outputs:
+            with scheduler.budget.reserve(cost):
+                scores = quality.measure(video_path, f"{VIDEO_DIR}/{output.filename}", meta, threads=cost.threads)
+            output.ssim, output.psnr, output.vmaf = scores
+            failed = quality.below_floor(scores, profile.quality)
+            output.quality_flagged = bool(failed)
+            if failed:
+                logger.warning("Job %s: rendition %s is below the %s floor (SSIM %s, PSNR %s, VMAF %s)",
+                               video_job.id, output.profile_detail_id, ", ".join(failed),
+                               scores.ssim, scores.psnr, scores.vmaf)
+        status = "flagged" if any(output.quality_flagged for output in outputs) else "passed"
+    except (probe.ProbeError, ffmpeg.Error, ValueError) as e:
+        logger.warning("Quality check of job %s failed: %s", video_job.id, e)
+        status = "error"
+
+    video_job.quality_status = status
+    db.commit()
+    metrics.QUALITY_CHECKS.labels(status).inc()
+    webhooks.emit(
+        video_job.user_id, "job.quality_checked", video_job.id,
+        quality_status=status,
+        renditions=[
+            {
+                "rendition": output.profile_detail_id, "ssim": output.ssim, "psnr": output.psnr,
+                "vmaf": output.vmaf, "flagged": output.quality_flagged,
+            }
+            for output in outputs
+        ],
+    )
+
+
+def load_packaging(video_job, db):
+    profile = profile_service.get_profile(video_job.encoding_profile, db)
+    return profile.packaging if profile else None
+
+
+def extras_plan(video_job, db, meta):
+    profile = profile_service.get_profile(video_job.encoding_profile, db)
+    stem, _ = os.path.splitext(video_job.video_filename)
+    return extras.plan(profile.extras if profile else None, f"{VIDEO_DIR}/{stem}", meta)
+
+
+def encode_extras(video_path, meta, plan):
+    # For jobs whose renditions were not decoded in one pass here: all linked
+    # or remuxed, or chunked. Decoding is the whole cost.
+    cost = ladder_cost(meta, [])
+    with scheduler.budget.reserve(cost):
+        encode_ladder(video_path, [], [], False, threads=cost.threads, extras_plan=plan)
+
+
+def link_cached_output(video_job, detail, output_path):
+    if not encode_cache.CACHE_ENABLED or not video_job.source_sha256:
+        return False
+    return encode_cache.link_cached(video_job.source_sha256, rendition_fingerprint(detail), output_path)
+
+
+def cache_outputs(video_job, renditions, output_paths):
+    if not encode_cache.CACHE_ENABLED or not video_job.source_sha256:
+        return
+    for detail, output_path in zip(renditions, output_paths):
+        try:
+            encode_cache.store(video_job.source_sha256, rendition_fingerprint(detail), output_path)
+        except OSError as e:
+            # A cache failure must not fail an encode that succeeded
+            logger.warning("Could not cache %s: %s", output_path, e)
+
+
+def process_video_encoding(video_job, db, upload_id=None):
+    try:
+        renditions = load_renditions(video_job, db)
+    except profile_service.ProfileError as e:
+        # Profiles saved before validation existed can still be unusable
+        logger.error("Encoding profile %s is invalid: %s", video_job.encoding_profile, e)
+        mark_job_failed(video_job, db)
+        return
+
+    if not renditions:
+        logger.error("Encoding profile %s not found", video_job.encoding_profile)
+        mark_job_failed(video_job, db)
+        return
+
+    video_path = f"{VIDEO_DIR}/{video_job.video_filename}"
+
+    try:
+        if upload_id:
+            stream_ingest.wait_for_bytes(upload_id, STREAM_PROBE_BYTES)
+            # The content hash isn't known yet, so this probe is not cached
+            meta = probe.probe_source(video_path)
+            renditions = plan_renditions(meta, renditions)
+            output_paths = [rendition_output_path(video_job.video_filename, detail) for detail in renditions]
+            plan = extras_plan(video_job, db, meta)
+            cost = ladder_cost(meta, renditions)
+            with scheduler.budget.reserve(cost):
+                encode_ladder(
+                    video_path, renditions, output_paths, meta["audio"] is not None,
+                    upload_id=upload_id, reporter=ProgressReporter(video_job.id, user_id=video_job.user_id),
+                    threads=cost.threads,
+                    extras_plan=plan,
+                )
+            # The API records the content hash once the upload has finished
+            db.refresh(video_job)
+            cache_outputs(video_job, renditions, output_paths)
+            finish_job(video_job, db, renditions, output_paths, meta, plan)
+            return
+
+        # Undecodable input fails here, before any encoder is started
+        meta = source_metadata(video_job, video_path)
+        renditions = plan_renditions(meta, renditions)
+        renditions = analyse_complexity(video_job, db, video_path, meta, renditions)
+        output_paths = [rendition_output_path(video_job.video_filename, detail) for detail in renditions]
+        plan = extras_plan(video_job, db, meta)
+
+        # Renditions already encoded from identical bytes are just linked
+        pending = [
+            (detail, output_path)
+            for detail, output_path in zip(renditions, output_paths)
+            if not link_cached_output(video_job, detail, output_path)
+        ]
+
+        # Renditions the source already satisfies are remuxed, not transcoded,
+        # unless they are packaged for streaming and need aligned keyframes
+        streaming = load_packaging(video_job, db) is not None
+        remuxed = [
+            (detail, output_path) for detail, output_path in pending
+            if not streaming and probe.can_copy_video(meta, detail)
+        ]
+        for detail, output_path in remuxed:
+            remux_rendition(video_path, detail, output_path, meta)
+        cache_outputs(video_job, [detail for detail, _ in remuxed], [output_path for _, output_path in remuxed])
+
+        pending = [item for item in pending if item not in remuxed]
+        if not pending:
+            if plan is not None:
+                encode_extras(video_path, meta, plan)
+            finish_job(video_job, db, renditions, output_paths, meta, plan)
+            return
+        pending_renditions = [detail for detail, _ in pending]
+        pending_paths = [output_path for _, output_path in pending]
+
+        duration, with_audio = meta["duration"], meta["audio"] is not None
+
+        if chunked_encoder.should_chunk(duration):
+            specs = rendition_specs(pending_renditions)
+            if chunked_encoder.CHUNK_DISPATCH == "queue":
+                # Segments finish on any node; the last one queues the assembly
+                chunked_encoder.dispatch_chunks(
+                    video_job.id, video_path, specs, with_audio,
+                    [detail.id for detail in pending_renditions], video_job.priority,
+                    with_extras=plan is not None,
+                )
+                return
+            # The local process pool uses every core
+            with scheduler.budget.reserve(scheduler.whole_node()):
+                chunked_encoder.encode_chunked(
+                    video_job.id, video_path, specs, pending_paths, with_audio, user_id=video_job.user_id,
+                )
+            if plan is not None:
+                encode_extras(video_path, meta, plan)
+        else:
+            # Use FFmpeg to encode the whole ladder in one pass
+            cost = ladder_cost(meta, pending_renditions)
+            with scheduler.budget.reserve(cost):
+                encode_ladder(
+                    video_path, pending_renditions, pending_paths, with_audio,
+                    reporter=ProgressReporter(video_job.id, duration, video_job.user_id), threads=cost.threads,
+                    extras_plan=plan,
+                )
+
+        cache_outputs(video_job, pending_renditions, pending_paths)
+        finish_job(video_job, db, renditions, output_paths, meta, plan)
+
+    except probe.ProbeError as e:
+        logger.error("Cannot decode %s: %s", video_job.video_filename, e)
+        mark_job_failed(video_job, db)
+    except ffmpeg.Error as e:
+        logger.error("FFmpeg error in job %s: %s", video_job.id, e)
+        mark_job_failed(video_job, db)
+    except stream_ingest.UploadAborted as e:
+        logger.warning("Job %s: %s", video_job.id, e)
+        mark_job_failed(video_job, db)
+    except Exception:
+        logger.exception("Job %s failed with an unexpected error", video_job.id)
+        mark_job_failed(video_job, db)
+
+
+def send_job_completion_notification(video_job):
+    logger.info("Job %s completed", video_job.id)
+    webhooks.emit(
+        video_job.user_id, "job.completed", video_job.id,
+        status="completed", video_filename=video_job.video_filename, batch_id=video_job.batch_id,
+        outputs=[
+            {"kind": output.kind, "filename": output.filename, "width": output.width,
+             "height": output.height, "size_bytes": output.size_bytes}
+            for output in video_job.outputs
+        ],
+    )
+
+
+def send_job_failure_notification(video_job):
+    logger.warning("Job %s failed", video_job.id)
+    webhooks.emit(
+        video_job.user_id, "job.failed", video_job.id,
+        status="failed", video_filename=video_job.video_filename, batch_id=video_job.batch_id,
+    )
+
+
+def process_video_chunk(video_job, db, rendition_ids=None, segment=None, audio_group=None, extras=False):
+    renditions = load_renditions(video_job, db, rendition_ids)
+    video_path = f"{VIDEO_DIR}/{video_job.video_filename}"
+    meta = source_metadata(video_job, video_path)
+    with_audio = meta["audio"] is not None
+
+    if extras:
+        encode_extras(video_path, meta, extras_plan(video_job, db, meta))
+        return chunked_encoder.mark_chunk_done(video_job.id, "extras", video_job.user_id)
+
+    if segment is None:
+        # Audio is cheap and runs outside the node budget
+        return chunked_encoder.run_chunk(
+            video_job.id, video_path, rendition_specs(renditions), with_audio, audio_group=audio_group,
+            user_id=video_job.user_id,
+        )
+    cost = ladder_cost(meta, renditions)
+    with scheduler.budget.reserve(cost):
+        return chunked_encoder.run_chunk(
+            video_job.id, video_path, rendition_specs(renditions), with_audio,
+            segment=segment, threads=cost.threads, user_id=video_job.user_id,
+        )
+
+
+def assemble_video_chunks(video_job, db, rendition_ids=None):
+    pending = load_renditions(video_job, db, rendition_ids)
+    video_path = f"{VIDEO_DIR}/{video_job.video_filename}"
+    pending_paths = [rendition_output_path(video_job.video_filename, detail) for detail in pending]
+
+    try:
+        meta = source_metadata(video_job, video_path)
+        with_audio = meta["audio"] is not None
+        # Same plan as the encode task, so linked and remuxed outputs are recorded too
+        renditions = plan_renditions(meta, load_renditions(video_job, db))
+        output_paths = [rendition_output_path(video_job.video_filename, detail) for detail in renditions]
+        chunked_encoder.assemble_chunks(video_job.id, video_path, rendition_specs(pending), pending_paths, with_audio)
+        cache_outputs(video_job, pending, pending_paths)
+        finish_job(video_job, db, renditions, output_paths, meta, extras_plan(video_job, db, meta))
+    except ffmpeg.Error as e:
+        logger.error("FFmpeg error in job %s: %s", video_job.id, e)
+        mark_job_failed(video_job, db)
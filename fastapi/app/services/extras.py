@@ -0,0 +1,160 @@
+import glob
+import math
+import os
+from typing import NamedTuple, Optional
+import ffmpeg
+
+# Posters, seek-preview sprite sheets and preview clips. They are extra
+# branches of the rendition encode's split filter, so the source is decoded
+# once for everything.
+POSTER_QUALITY = 3  # JPEG -q:v, 2 (best) to 31
+SPRITE_QUALITY = 5
+PREVIEW_CRF = 28
+
+
+class ExtrasPlan(NamedTuple):
+    config: tuple  # profile_service.ExtrasConfig
+    stem: str  # Output path without extension, shared with the job's renditions
+    duration: float
+    source_width: int
+    source_height: int
+
+
+class ExtraOutput(NamedTuple):
+    kind: str
+    path: str
+    width: Optional[int]
+    height: Optional[int]
+
+
+def plan(config, stem, meta):
+    if config is None:
+        return None
+    return ExtrasPlan(config, stem, meta["duration"], meta["video"]["width"], meta["video"]["height"])
+
+
+def scaled_height(plan, width):
+    # Explicit even height rather than scale's -2, so the sprite index knows the tile size
+    return max(2, int(round(width * plan.source_height / plan.source_width / 2)) * 2)
+
+
+def offset(plan, requested):
+    # Default to 10% in, and stay inside short sources
+    if requested is None:
+        return plan.duration * 0.1
+    return min(requested, plan.duration * 0.9)
+
+
+def poster_path(plan):
+    return f"{plan.stem}_poster.jpg"
+
+
+def sprite_pattern(plan):
+    return f"{plan.stem}_sprite_%03d.jpg"
+
+
+def sprite_index_path(plan):
+    return f"{plan.stem}_sprites.vtt"
+
+
+def preview_path(plan):
+    return f"{plan.stem}_preview.mp4"
+
+
+def clear(plan):
+    # Sheets left by an earlier attempt would otherwise be collected too
+    if plan is not None and plan.config.sprite_width is not None:
+        for sheet in glob.glob(glob.escape(plan.stem) + "_sprite_[0-9][0-9][0-9].jpg"):
+            os.remove(sheet)
+
+
+def branches(plan):
+    """Functions that turn one branch of the decoded video into an output, one per enabled extra."""
+    if plan is None:
+        return []
+    config = plan.config
+    result = []
+
+    if config.poster_width is not None:
+        def poster(stream):
+            stream = stream.filter("trim", start=offset(plan, config.poster_time))
+            stream = stream.filter("scale", config.poster_width, scaled_height(plan, config.poster_width))
+            return ffmpeg.output(stream, poster_path(plan), vframes=1, update=1, **{"q:v": POSTER_QUALITY})
+        result.append(poster)
+
+    if config.sprite_width is not None:
+        def sprites(stream):
+            stream = stream.filter("fps", fps=f"1/{config.sprite_interval}")
+            stream = stream.filter("scale", config.sprite_width, scaled_height(plan, config.sprite_width))
+            stream = stream.filter("tile", f"{config.sprite_columns}x{config.sprite_rows}")
+            return ffmpeg.output(stream, sprite_pattern(plan), **{"q:v": SPRITE_QUALITY})
+        result.append(sprites)
+
+    if config.preview_width is not None:
+        def preview(stream):
+            stream = stream.filter(
+                "trim", start=offset(plan, config.preview_start), duration=config.preview_duration
+            ).filter("setpts", "PTS-STARTPTS")
+            stream = stream.filter("scale", config.preview_width, scaled_height(plan, config.preview_width))
+            # Muted: previews play on hover
+            return ffmpeg.output(
+                stream, preview_path(plan), vcodec="libx264", crf=PREVIEW_CRF, preset="veryfast",
+                pix_fmt="yuv420p", movflags="faststart", threads=1,
+            )
+        result.append(preview)
+
+    return result
+
+
+def timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def write_sprite_index(plan, sheets):
+    """WebVTT cues mapping each interval of the source to its tile (#xywh)."""
+    config = plan.config
+    width, height = config.sprite_width, scaled_height(plan, config.sprite_width)
+    per_sheet = config.sprite_columns * config.sprite_rows
+    tiles = min(math.ceil(plan.duration / config.sprite_interval), per_sheet * len(sheets))
+
+    lines = ["WEBVTT", ""]
+    for tile in range(tiles):
+        start = tile * config.sprite_interval
+        end = min(start + config.sprite_interval, plan.duration)
+        sheet, position = divmod(tile, per_sheet)
+        row, column = divmod(position, config.sprite_columns)
+        lines += [
+            f"{timestamp(start)} --> {timestamp(end)}",
+            f"{os.path.basename(sheets[sheet])}#xywh={column * width},{row * height},{width},{height}",
+            "",
+        ]
+    with open(sprite_index_path(plan), "w") as f:
+        f.write("\n".join(lines))
+
+
+def collect(plan):
+    """The extras that were written, with the sprite index built from the sheets."""
+    if plan is None:
+        return []
+    config = plan.config
+    outputs = []
+
+    if config.poster_width is not None and os.path.exists(poster_path(plan)):
+        outputs.append(ExtraOutput("poster", poster_path(plan), config.poster_width,
+                                   scaled_height(plan, config.poster_width)))
+
+    if config.sprite_width is not None:
+        sheets = sorted(glob.glob(glob.escape(plan.stem) + "_sprite_[0-9][0-9][0-9].jpg"))
+        width = config.sprite_width * config.sprite_columns
+        height = scaled_height(plan, config.sprite_width) * config.sprite_rows
+        outputs += [ExtraOutput("sprite", sheet, width, height) for sheet in sheets]
+        if sheets:
+            write_sprite_index(plan, sheets)
+            outputs.append(ExtraOutput("sprite_index", sprite_index_path(plan), None, None))
+
+    if config.preview_width is not None and os.path.exists(preview_path(plan)):
+        outputs.append(ExtraOutput("preview", preview_path(plan), config.preview_width,
+                                   scaled_height(plan, config.preview_width)))
+    return outputs
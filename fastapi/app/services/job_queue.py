@@ -0,0 +1,153 @@
+import json
+import os
+import time
+from db.database import redis_client
+from utils import metrics
+
+# Dragonfly keys backing the encode queue. Pending tasks live in a sorted set
+# scored by the time they become runnable; claimed tasks move to the in-flight
+# set scored by their lease deadline, so a crashed worker's tasks reappear.
+QUEUE_KEY = "encoding:queue"
+INFLIGHT_KEY = "encoding:inflight"
+ATTEMPTS_KEY = "encoding:attempts"
+NOTIFY_KEY = "encoding:notify"
+
+VISIBILITY_TIMEOUT = int(os.getenv("ENCODE_VISIBILITY_TIMEOUT", "300"))
+MAX_ATTEMPTS = int(os.getenv("ENCODE_MAX_ATTEMPTS", "3"))
+
+# Priority classes, lowest first. Each class sorts as if its tasks had been
+# queued PRIORITY_AGING seconds before those of the class below, so a waiting
+# task is only overtaken by higher-class tasks queued less than that long
+# after it, and low priority work still drains under a steady stream of
+# high priority work.
+PRIORITIES = ("low", "normal", "high")
+DEFAULT_PRIORITY = "normal"
+PRIORITY_AGING = int(os.getenv("ENCODE_PRIORITY_AGING", "300"))
+
+# Pop the first runnable task and lease it in one atomic step
+_claim_script = redis_client.register_script("""
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+local item = items[1]
+if not item then
+    return false
+end
+local score = redis.call('ZSCORE', KEYS[1], item)
+redis.call('ZREM', KEYS[1], item)
+redis.call('ZADD', KEYS[2], ARGV[2], item)
+local attempts = redis.call('HINCRBY', KEYS[3], item, 1)
+return {item, attempts, score}
+""")
+
+# Move tasks whose lease ran out back onto the queue, keeping their priority
+_requeue_expired_script = redis_client.register_script("""
+local head_starts = cjson.decode(ARGV[3])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, item in ipairs(expired) do
+    local ok, task = pcall(cjson.decode, item)
+    local head_start = ok and head_starts[task.priority] or 0
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) - head_start, item)
+end
+return #expired
+""")
+
+
+def head_start(priority) -> int:
+    if priority not in PRIORITIES:
+        priority = DEFAULT_PRIORITY
+    return PRIORITIES.index(priority) * PRIORITY_AGING
+
+
+def queue_score(priority: str = DEFAULT_PRIORITY, delay: float = 0) -> float:
+    # A delayed task waits out its whole delay; priority only orders runnable tasks
+    if delay:
+        return time.time() + delay
+    return time.time() - head_start(priority)
+
+
+def make_task(task_type: str, **fields) -> str:
+    # Sorted keys keep the member stable, so enqueueing the same task twice is a no-op
+    return json.dumps(dict(fields, type=task_type), sort_keys=True)
+
+
+def enqueue(task: str, delay: float = 0, priority: str = DEFAULT_PRIORITY):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(QUEUE_KEY, {task: queue_score(priority, delay)})
+    pipe.rpush(NOTIFY_KEY, 1)
+    pipe.ltrim(NOTIFY_KEY, -1000, -1)
+    pipe.execute()
+
+
+def enqueue_many(tasks):
+    """Enqueue (task, priority) pairs in one round trip."""
+    if not tasks:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(QUEUE_KEY, {task: queue_score(priority) for task, priority in tasks})
+    # One wake-up per task, up to as many as the list keeps
+    pipe.rpush(NOTIFY_KEY, *[1] * min(len(tasks), 1000))
+    pipe.ltrim(NOTIFY_KEY, -1000, -1)
+    pipe.execute()
+
+
+def enqueue_job(job_id: int, priority: str = DEFAULT_PRIORITY, **fields):
+    enqueue(make_task("encode", job_id=job_id, priority=priority, **fields), priority=priority)
+
+
+def enqueue_jobs(jobs):
+    # jobs: (job_id, priority) pairs
+    enqueue_many([(make_task("encode", job_id=job_id, priority=priority), priority) for job_id, priority in jobs])
+
+
+def claim(visibility_timeout: int = VISIBILITY_TIMEOUT):
+    now = time.time()
+    result = _claim_script(
+        keys=[QUEUE_KEY, INFLIGHT_KEY, ATTEMPTS_KEY],
+        args=[now, now + visibility_timeout],
+    )
+    if not result:
+        return None, 0
+    task, attempts, score = result
+    fields = json.loads(task)
+    runnable_at = float(score) + head_start(fields.get("priority"))
+    metrics.QUEUE_WAIT_SECONDS.labels(fields.get("type", "unknown")).observe(max(0.0, now - runnable_at))
+    return task, int(attempts)
+
+
+def wait_for_work(timeout: int):
+    # Enqueue pushes a wake-up hint so idle workers don't have to spin
+    redis_client.blpop(NOTIFY_KEY, timeout=timeout)
+
+
+def extend_lease(task: str, visibility_timeout: int = VISIBILITY_TIMEOUT) -> bool:
+    # XX: only refresh a lease we still hold; 0 changed means it was reaped
+    return bool(redis_client.zadd(INFLIGHT_KEY, {task: time.time() + visibility_timeout}, xx=True, ch=True))
+
+
+def ack(task: str):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zrem(INFLIGHT_KEY, task)
+    pipe.hdel(ATTEMPTS_KEY, task)
+    pipe.execute()
+
+
+def retry(task: str, delay: float = 0):
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zrem(INFLIGHT_KEY, task)
+    pipe.zadd(QUEUE_KEY, {task: queue_score(json.loads(task).get("priority", DEFAULT_PRIORITY), delay)})
+    pipe.execute()
+
+
+def requeue_expired(batch_size: int = 100) -> int:
+    return int(_requeue_expired_script(
+        keys=[QUEUE_KEY, INFLIGHT_KEY],
+        args=[time.time(), batch_size, json.dumps({priority: head_start(priority) for priority in PRIORITIES})],
+    ))
+
+
+def queue_depth() -> dict:
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zcard(QUEUE_KEY)
+    pipe.zcard(INFLIGHT_KEY)
+    queued, inflight = pipe.execute()
+    return {"queued": queued, "inflight": inflight}
@@ -0,0 +1,137 @@
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import NamedTuple, Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from sqlalchemy import and_, or_, select
+from models.videojob import VideoJob, VideoJobOutput
+from services.packager import PACKAGE_KINDS
+from utils.cache import TTLCache
+
+VIDEO_DIR = "./videos"
+
+# Outputs never change once their job has completed, so what a request
+# resolves to (owner, path, size, mtime) is kept per process and hot files
+# are served without touching MySQL or the filesystem metadata
+OUTPUT_CACHE_SIZE = int(os.getenv("OUTPUT_CACHE_SIZE", "10000"))
+OUTPUT_CACHE_TTL = int(os.getenv("OUTPUT_CACHE_TTL", "300"))
+# How long clients may reuse a downloaded output without revalidating
+OUTPUT_MAX_AGE = int(os.getenv("OUTPUT_MAX_AGE", str(24 * 60 * 60)))
+# With a reverse proxy in front, hand the transfer to it: the response carries
+# X-Accel-Redirect: <prefix><filename> and nginx sends the file with
+# sendfile(2), ranges included, from an `internal` location such as
+#   location /protected-videos/ { internal; alias /app/videos/; }
+OUTPUT_ACCEL_PREFIX = os.getenv("OUTPUT_ACCEL_PREFIX", "")
+# Read size when the API sends the file itself
+OUTPUT_CHUNK_SIZE = int(os.getenv("OUTPUT_CHUNK_SIZE", str(1024 * 1024)))
+
+mimetypes.add_type("text/vtt", ".vtt")
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("application/dash+xml", ".mpd")
+mimetypes.add_type("video/iso.segment", ".m4s")
+mimetypes.add_type("video/mp2t", ".ts")
+
+
+class OutputFile(NamedTuple):
+    path: str
+    filename: str
+    user_id: Optional[int]
+    stat: os.stat_result
+    etag: str
+    last_modified: str
+    media_type: str
+
+
+class OutputFileResponse(FileResponse):
+    """FileResponse with bigger reads and a correctly labelled multi-range body."""
+
+    chunk_size = OUTPUT_CHUNK_SIZE
+
+    async def _handle_multiple_ranges(self, send, ranges, file_size, send_header_only):
+        # Starlette 0.46 sends multipart/byteranges as Content-Range instead of
+        # Content-Type (requirements.txt pins it). Left alone if that is fixed.
+        async def relabel(message):
+            if message["type"] == "http.response.start":
+                headers = dict(message["headers"])
+                if headers.get(b"content-range", b"").startswith(b"multipart/byteranges"):
+                    headers[b"content-type"] = headers.pop(b"content-range")
+                    message = dict(message, headers=list(headers.items()))
+            await send(message)
+
+        await super()._handle_multiple_ranges(relabel, ranges, file_size, send_header_only)
+
+
+_outputs = TTLCache(OUTPUT_CACHE_SIZE, OUTPUT_CACHE_TTL)
+
+
+def output_file(filename, user_id):
+    path = f"{VIDEO_DIR}/{filename}"
+    stat = os.stat(path)
+    return OutputFile(
+        path=path,
+        filename=filename,
+        user_id=user_id,
+        stat=stat,
+        # Strong: the bytes behind a size and mtime never change
+        etag=f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+        last_modified=formatdate(stat.st_mtime, usegmt=True),
+        media_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+    )
+
+
+async def find_output(db, job_id, rendition=None, filename=None):
+    """The completed job's output by rendition id or filename, else its largest rendition.
+
+    A filename may also name a playlist or segment inside one of the job's
+    HLS or DASH package directories.
+    """
+    if filename is not None and (os.path.isabs(filename) or os.path.normpath(filename) != filename
+                                 or filename.startswith("..")):
+        return None
+    key = (job_id, rendition, filename)
+    output = _outputs.get(key)
+    if output is not None:
+        return output
+
+    query = (
+        select(VideoJobOutput.filename, VideoJob.user_id)
+        .join(VideoJob, VideoJob.id == VideoJobOutput.job_id)
+        .where(VideoJobOutput.job_id == job_id, VideoJob.status == "completed")
+    )
+    if filename is not None:
+        package_dir = filename.split("/", 1)[0] + "/"
+        query = query.where(or_(
+            VideoJobOutput.filename == filename,
+            and_(VideoJobOutput.kind.in_(PACKAGE_KINDS), VideoJobOutput.filename.startswith(package_dir, autoescape=True)),
+        ))
+    else:
+        query = query.where(VideoJobOutput.kind == "rendition")
+        if rendition is not None:
+            query = query.where(VideoJobOutput.profile_detail_id == rendition)
+        query = query.order_by((VideoJobOutput.width * VideoJobOutput.height).desc())
+    row = (await db.execute(query.limit(1))).first()
+    if row is None:
+        return None
+
+    try:
+        output = await run_in_threadpool(output_file, filename or row.filename, row.user_id)
+    except FileNotFoundError:
+        return None
+    _outputs.set(key, output)
+    return output
+
+
+def not_modified(output, headers):
+    # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or output.etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(output.stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
@@ -0,0 +1,106 @@
+import os
+import shutil
+import ffmpeg
+from services.extras import ExtraOutput
+
+# Adaptive-streaming packages cut from a job's finished MP4 renditions with
+# a stream copy. The renditions were encoded with keyframes forced at every
+# segment boundary and no scene-cut keyframes, so segments start on the same
+# frame in every rendition and players can switch between them anywhere.
+PACKAGE_KINDS = ("hls", "dash")
+HLS_SEGMENT_EXTENSIONS = {"fmp4": "m4s", "mpegts": "ts"}
+
+
+def package_dir(stem, kind):
+    return f"{stem}_{kind}"
+
+
+def fresh_dir(path):
+    # A retried job must not list segments left by an earlier attempt
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def rendition_inputs(renditions, output_paths):
+    return [(detail, ffmpeg.input(path)) for detail, path in zip(renditions, output_paths)]
+
+
+def package_hls(config, stem, renditions, output_paths, with_audio):
+    """One variant playlist per rendition plus a master playlist; returns the master's path."""
+    root = fresh_dir(package_dir(stem, "hls"))
+    streams, variants = [], []
+    for index, (detail, source) in enumerate(rendition_inputs(renditions, output_paths)):
+        streams.append(source.video)
+        variant = f"v:{index}"
+        if with_audio:
+            streams.append(source.audio)
+            variant += f",a:{index}"
+        # Variant directories are named after the rendition
+        variants.append(f"{variant},name:{detail.id}")
+
+    args = {}
+    if config.hls_segment_type == "fmp4":
+        args["hls_fmp4_init_filename"] = "init.mp4"
+    ffmpeg.output(
+        *streams, f"{root}/%v/index.m3u8",
+        c="copy",
+        f="hls",
+        hls_time=config.segment_duration,
+        hls_playlist_type="vod",
+        hls_segment_type=config.hls_segment_type,
+        hls_segment_filename=f"{root}/%v/seg_%05d.{HLS_SEGMENT_EXTENSIONS[config.hls_segment_type]}",
+        hls_flags="independent_segments",
+        master_pl_name="master.m3u8",
+        var_stream_map=" ".join(variants),
+        **args,
+    ).run(overwrite_output=True, quiet=True)
+    return f"{root}/master.m3u8"
+
+
+def package_dash(config, stem, renditions, output_paths, with_audio, audio_groups):
+    """A single MPD with every rendition's video and one audio track per audio group."""
+    root = fresh_dir(package_dir(stem, "dash"))
+    sources = rendition_inputs(renditions, output_paths)
+    streams = [source.video for _, source in sources]
+    if with_audio:
+        # Renditions in the same audio group carry identical audio
+        seen = set()
+        for (_, source), group in zip(sources, audio_groups):
+            if group not in seen:
+                seen.add(group)
+                streams.append(source.audio)
+
+    ffmpeg.output(
+        *streams, f"{root}/manifest.mpd",
+        c="copy",
+        f="dash",
+        seg_duration=config.segment_duration,
+        use_template=1,
+        use_timeline=1,
+        adaptation_sets="id=0,streams=v id=1,streams=a" if with_audio else "id=0,streams=v",
+        init_seg_name="init-$RepresentationID$.m4s",
+        media_seg_name="chunk-$RepresentationID$-$Number%05d$.m4s",
+    ).run(overwrite_output=True, quiet=True)
+    return f"{root}/manifest.mpd"
+
+
+def package(config, stem, renditions, output_paths, with_audio, audio_groups):
+    """Write the profile's streaming packages; ExtraOutputs pointing at their manifests."""
+    if config is None or not renditions:
+        return []
+    outputs = []
+    if "hls" in config.formats:
+        outputs.append(ExtraOutput("hls", package_hls(config, stem, renditions, output_paths, with_audio), None, None))
+    if "dash" in config.formats:
+        outputs.append(ExtraOutput(
+            "dash", package_dash(config, stem, renditions, output_paths, with_audio, audio_groups), None, None,
+        ))
+    return outputs
+
+
+def package_size(manifest_path):
+    total = 0
+    for directory, _, filenames in os.walk(os.path.dirname(manifest_path)):
+        total += sum(os.path.getsize(os.path.join(directory, filename)) for filename in filenames)
+    return total
@@ -0,0 +1,145 @@
+import json
+import os
+import ffmpeg
+from db.database import redis_client
+from utils import metrics
+
+# ffprobe results are keyed by the source's content hash, so the API's
+# upload-time probe and every worker that later touches the file share one run
+PROBE_CACHE_TTL = int(os.getenv("PROBE_CACHE_TTL", str(7 * 24 * 60 * 60)))
+# Below this ffprobe is guessing at the container (random bytes can pass as raw H.263)
+PROBE_MIN_SCORE = int(os.getenv("PROBE_MIN_SCORE", "25"))
+# Seconds of the source scanned for keyframes
+KEYFRAME_SCAN_SECONDS = int(os.getenv("PROBE_KEYFRAME_SCAN_SECONDS", "30"))
+
+# Encoder name -> codec name as ffprobe reports it
+ENCODER_CODECS = {
+    "libx264": "h264",
+    "h264": "h264",
+    "libx265": "hevc",
+    "hevc": "hevc",
+    "libvpx-vp9": "vp9",
+    "libaom-av1": "av1",
+    "libsvtav1": "av1",
+    "aac": "aac",
+    "libfdk_aac": "aac",
+    "libopus": "opus",
+    "libmp3lame": "mp3",
+}
+
+
+class ProbeError(Exception):
+    pass
+
+
+def _rate(value):
+    try:
+        num, den = value.split("/")
+        return float(num) / float(den) if float(den) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse(raw):
+    streams = raw.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    if video is None:
+        raise ProbeError("No video stream found")
+
+    # Frames of every stream are listed; keyframe spacing is the video's
+    keyframes = sorted(
+        float(frame["pts_time"]) for frame in raw.get("frames", [])
+        if frame.get("stream_index") == video.get("index") and frame.get("pts_time") not in (None, "N/A")
+    )
+    keyframe_interval = None
+    if len(keyframes) > 1:
+        keyframe_interval = round((keyframes[-1] - keyframes[0]) / (len(keyframes) - 1), 3)
+
+    fmt = raw.get("format", {})
+    if _int(fmt.get("probe_score", 100)) < PROBE_MIN_SCORE:
+        raise ProbeError(f"Container not recognised (probe score {fmt.get('probe_score')})")
+    meta = {
+        "format_name": fmt.get("format_name"),
+        "duration": float(fmt.get("duration") or video.get("duration") or 0),
+        "bit_rate": _int(fmt.get("bit_rate")),
+        "video": {
+            "codec": video.get("codec_name"),
+            "width": _int(video.get("width")),
+            "height": _int(video.get("height")),
+            "pix_fmt": video.get("pix_fmt"),
+            "fps": _rate(video.get("avg_frame_rate")) or _rate(video.get("r_frame_rate")),
+            "bit_rate": _int(video.get("bit_rate")),
+            "keyframe_interval": keyframe_interval,
+        },
+        "audio": None,
+    }
+    if audio is not None:
+        meta["audio"] = {
+            "codec": audio.get("codec_name"),
+            "bit_rate": _int(audio.get("bit_rate")),
+            "channels": _int(audio.get("channels")),
+            "sample_rate": _int(audio.get("sample_rate")),
+        }
+    return meta
+
+
+def probe_source(video_path, source_sha256=None):
+    """Return stream metadata for a source, raising ProbeError if it can't be decoded."""
+    cache_key = f"probe:{source_sha256}" if source_sha256 else None
+    if cache_key:
+        cached = redis_client.get(cache_key)
+        if cached:
+            return json.loads(cached)
+
+    try:
+        with metrics.timed(metrics.FFPROBE_SECONDS):
+            # One ffprobe run: streams, format and keyframe times from the opening seconds
+            raw = ffmpeg.probe(
+                video_path,
+                skip_frame="nokey",
+                show_entries="frame=pts_time,stream_index",
+                read_intervals=f"%+{KEYFRAME_SCAN_SECONDS}",
+            )
+    except ffmpeg.Error as e:
+        raise ProbeError((e.stderr or b"").decode(errors="replace").strip() or "ffprobe failed")
+
+    meta = _parse(raw)
+    if cache_key:
+        redis_client.set(cache_key, json.dumps(meta), ex=PROBE_CACHE_TTL)
+    return meta
+
+
+def would_upscale(meta, detail):
+    return detail.width > meta["video"]["width"] or detail.height > meta["video"]["height"]
+
+
+def can_copy_video(meta, detail):
+    video = meta["video"]
+    return (
+        ENCODER_CODECS.get(detail.vcodec) == video["codec"]
+        and video["width"] == detail.width
+        and video["height"] == detail.height
+        and video["pix_fmt"] == detail.pix_fmt
+        and video["bit_rate"] is not None
+        and video["bit_rate"] <= detail.max_bitrate * 1000
+    )
+
+
+def can_copy_audio(meta, detail):
+    audio = meta["audio"]
+    return (
+        audio is not None
+        and ENCODER_CODECS.get(detail.acodec) == audio["codec"]
+        and audio["bit_rate"] is not None
+        and audio["bit_rate"] <= detail.audio_bitrate * 1000
+        and audio["channels"] == detail.audio_channel
+        and str(audio["sample_rate"]) == str(detail.audio_frequency)
+    )
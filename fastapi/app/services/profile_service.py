@@ -1,6 +1,433 @@
-from sqlalchemy.orm import Session
-from db.database import SessionLocal
-from models.encode_profiles import EncodeProfiles, EncodeProfileDetails
+import re
+import subprocess
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+from db.database import SessionLocal, redis_client
+from models.encodeprofile import EncodeProfiles
+from logging_config import logger as app_logger
+
+logger = app_logger.getChild("profiles")
+
+# Profiles are compiled once per process into immutable argument sets and
+# kept in memory. Writes through the API publish the profile id on this
+# channel so every worker drops its stale copy.
+INVALIDATE_CHANNEL = "encode_profiles:invalidate"
+# Longest wait between attempts to resubscribe after losing Dragonfly
+LISTENER_MAX_BACKOFF = 30
+
+H264_LEVELS = {1.0, 1.1, 1.2, 1.3, 2.0, 2.1, 2.2, 3.0, 3.1, 3.2, 4.0, 4.1, 4.2, 5.0, 5.1, 5.2, 6.0, 6.1, 6.2}
+HEVC_LEVELS = {1.0, 2.0, 2.1, 3.0, 3.1, 4.0, 4.1, 5.0, 5.1, 5.2, 6.0, 6.1, 6.2}
+
+# libx264 profile -> pixel formats it can carry
+X264_PROFILE_PIX_FMTS = {
+    "baseline": {"yuv420p", "yuvj420p"},
+    "main": {"yuv420p", "yuvj420p"},
+    "high": {"yuv420p", "yuvj420p", "nv12"},
+    "high10": {"yuv420p", "yuvj420p", "nv12", "yuv420p10le"},
+    "high422": {"yuv420p", "yuvj420p", "nv12", "yuv420p10le", "yuv422p", "yuvj422p", "yuv422p10le", "nv16"},
+    "high444": None,  # anything the encoder supports
+}
+X265_PROFILES = {"main", "main10", "main12", "main422-10", "main422-12", "main444-8", "main444-10", "main444-12"}
+
+# EncodeProfiles.output_format -> streaming packages written next to the MP4s
+OUTPUT_FORMATS = {"mp4": (), "hls": ("hls",), "dash": ("dash",), "hls_dash": ("hls", "dash")}
+HLS_SEGMENT_TYPES = ("fmp4", "mpegts")
+MAX_SEGMENT_DURATION = 60
+
+
+class ProfileError(ValueError):
+    pass
+
+
+class CompiledRendition(NamedTuple):
+    id: int
+    profile_id: int
+    width: int
+    height: int
+    vcodec: str
+    acodec: str
+    pix_fmt: str
+    profile: Optional[str]
+    level: Optional[float]
+    video_bitrate: int
+    max_bitrate: int
+    bufsize: int
+    sc_threshold: int
+    audio_bitrate: int
+    audio_channel: int
+    audio_frequency: str
+    movflags: str
+    video_args: Mapping
+    audio_args: Mapping
+
+
+class ExtrasConfig(NamedTuple):
+    poster_width: Optional[int]
+    poster_time: Optional[float]
+    sprite_width: Optional[int]
+    sprite_interval: float
+    sprite_columns: int
+    sprite_rows: int
+    preview_width: Optional[int]
+    preview_start: Optional[float]
+    preview_duration: float
+
+
+class PackagingConfig(NamedTuple):
+    formats: Tuple[str, ...]  # "hls", "dash" or both
+    segment_duration: int
+    hls_segment_type: str
+
+
+class PerTitleConfig(NamedTuple):
+    min_scale: float
+    max_scale: float
+
+
+class QualityConfig(NamedTuple):
+    # Floors a rendition's sampled scores must reach; None leaves a metric unchecked
+    min_ssim: Optional[float]
+    min_psnr: Optional[float]
+    min_vmaf: Optional[float]
+
+
+class CompiledProfile(NamedTuple):
+    id: int
+    name: str
+    renditions: Tuple[CompiledRendition, ...]
+    extras: Optional[ExtrasConfig]  # None when the profile asks for no posters, sprites or previews
+    packaging: Optional[PackagingConfig]  # None for plain MP4 output
+    per_title: Optional[PerTitleConfig]  # None when the ladder's bitrates are used as they are
+    quality: Optional[QualityConfig]  # None when finished renditions are not verified
+
+
+def _ffmpeg_help(*args):
+    result = subprocess.run(["ffmpeg", "-hide_banner", *args], capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+@lru_cache(maxsize=None)
+def encoder_capabilities():
+    """Video and audio encoders of the local ffmpeg build, probed once per process."""
+    video, audio = set(), set()
+    for line in _ffmpeg_help("-encoders").splitlines():
+        match = re.match(r"\s*([VA])[\w.]{5}\s+(\S+)", line)
+        if not match or match.group(2) == "=":
+            continue
+        (video if match.group(1) == "V" else audio).add(match.group(2))
+    return {"video": frozenset(video), "audio": frozenset(audio)}
+
+
+@lru_cache(maxsize=None)
+def filter_capabilities():
+    """Names of the filters in the local ffmpeg build."""
+    names = set()
+    for line in _ffmpeg_help("-filters").splitlines():
+        match = re.match(r"\s*[T.][S.][C.]?\s+(\S+)\s+\S+->\S+", line)
+        if match:
+            names.add(match.group(1))
+    return frozenset(names)
+
+
+@lru_cache(maxsize=None)
+def encoder_pix_fmts(encoder):
+    match = re.search(r"Supported pixel formats:\s*(.+)", _ffmpeg_help("-h", f"encoder={encoder}"))
+    # Encoders that don't list formats accept whatever the scaler gives them
+    return frozenset(match.group(1).split()) if match else None
+
+
+REQUIRED_DETAIL_FIELDS = ("vcodec", "acodec", "pix_fmt", "width", "height", "video_bitrate", "max_bitrate", "audio_bitrate")
+
+
+def validate_detail(detail):
+    """Raise ProfileError if this ffmpeg build can't encode the rendition as configured."""
+    missing = [field for field in REQUIRED_DETAIL_FIELDS if getattr(detail, field) is None]
+    if missing:
+        raise ProfileError(f"Missing {', '.join(missing)}")
+
+    capabilities = encoder_capabilities()
+    if detail.vcodec not in capabilities["video"]:
+        raise ProfileError(f"Video encoder '{detail.vcodec}' is not available")
+    if detail.acodec not in capabilities["audio"]:
+        raise ProfileError(f"Audio encoder '{detail.acodec}' is not available")
+
+    pix_fmts = encoder_pix_fmts(detail.vcodec)
+    if pix_fmts is not None and detail.pix_fmt not in pix_fmts:
+        raise ProfileError(f"{detail.vcodec} does not support pix_fmt '{detail.pix_fmt}'")
+
+    if detail.vcodec == "libx264":
+        if detail.profile not in X264_PROFILE_PIX_FMTS:
+            raise ProfileError(f"Unknown libx264 profile '{detail.profile}'")
+        allowed = X264_PROFILE_PIX_FMTS[detail.profile]
+        if allowed is not None and detail.pix_fmt not in allowed:
+            raise ProfileError(f"libx264 profile '{detail.profile}' cannot carry pix_fmt '{detail.pix_fmt}'")
+        if detail.level is not None and float(detail.level) not in H264_LEVELS:
+            raise ProfileError(f"Invalid H.264 level {detail.level}")
+    elif detail.vcodec == "libx265":
+        if detail.profile and detail.profile not in X265_PROFILES:
+            raise ProfileError(f"Unknown libx265 profile '{detail.profile}'")
+        if detail.level is not None and float(detail.level) not in HEVC_LEVELS:
+            raise ProfileError(f"Invalid HEVC level {detail.level}")
+
+    if detail.width <= 0 or detail.height <= 0:
+        raise ProfileError("Width and height must be positive")
+    if detail.pix_fmt.startswith(("yuv420", "yuvj420", "nv12")) and (detail.width % 2 or detail.height % 2):
+        raise ProfileError(f"{detail.pix_fmt} needs even width and height")
+    if detail.video_bitrate <= 0 or detail.audio_bitrate <= 0:
+        raise ProfileError("Bitrates must be positive")
+    if detail.max_bitrate < detail.video_bitrate:
+        raise ProfileError("max_bitrate must not be below video_bitrate")
+
+
+def validate_extras(profile):
+    for field in ("poster_width", "sprite_width", "preview_width"):
+        width = getattr(profile, field)
+        if width is not None and (width <= 0 or width % 2):
+            raise ProfileError(f"{field} must be a positive even number")
+    for field in ("poster_time", "preview_start"):
+        if getattr(profile, field) is not None and getattr(profile, field) < 0:
+            raise ProfileError(f"{field} must not be negative")
+    if profile.sprite_width is not None:
+        if not profile.sprite_interval or profile.sprite_interval <= 0:
+            raise ProfileError("sprite_interval must be positive")
+        if not profile.sprite_columns or not profile.sprite_rows or profile.sprite_columns < 1 or profile.sprite_rows < 1:
+            raise ProfileError("sprite_columns and sprite_rows must be at least 1")
+    if profile.preview_width is not None and (not profile.preview_duration or profile.preview_duration <= 0):
+        raise ProfileError("preview_duration must be positive")
+
+
+def compile_extras(profile):
+    validate_extras(profile)
+    if profile.poster_width is None and profile.sprite_width is None and profile.preview_width is None:
+        return None
+    return ExtrasConfig(
+        poster_width=profile.poster_width,
+        poster_time=profile.poster_time,
+        sprite_width=profile.sprite_width,
+        sprite_interval=profile.sprite_interval,
+        sprite_columns=profile.sprite_columns,
+        sprite_rows=profile.sprite_rows,
+        preview_width=profile.preview_width,
+        preview_start=profile.preview_start,
+        preview_duration=profile.preview_duration,
+    )
+
+
+def validate_packaging(profile):
+    if profile.output_format not in OUTPUT_FORMATS:
+        raise ProfileError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
+    if OUTPUT_FORMATS[profile.output_format]:
+        if not profile.segment_duration or not 1 <= profile.segment_duration <= MAX_SEGMENT_DURATION:
+            raise ProfileError(f"segment_duration must be between 1 and {MAX_SEGMENT_DURATION} seconds")
+        if profile.hls_segment_type not in HLS_SEGMENT_TYPES:
+            raise ProfileError(f"hls_segment_type must be one of {', '.join(HLS_SEGMENT_TYPES)}")
+
+
+def compile_packaging(profile):
+    validate_packaging(profile)
+    if not OUTPUT_FORMATS[profile.output_format]:
+        return None
+    return PackagingConfig(
+        formats=OUTPUT_FORMATS[profile.output_format],
+        segment_duration=profile.segment_duration,
+        hls_segment_type=profile.hls_segment_type,
+    )
+
+
+def validate_per_title(profile):
+    if profile.per_title:
+        if not profile.per_title_min_scale or not profile.per_title_max_scale or profile.per_title_min_scale <= 0:
+            raise ProfileError("per_title_min_scale and per_title_max_scale must be positive")
+        if profile.per_title_min_scale > profile.per_title_max_scale:
+            raise ProfileError("per_title_min_scale must not be above per_title_max_scale")
+
+
+def compile_per_title(profile):
+    validate_per_title(profile)
+    if not profile.per_title:
+        return None
+    return PerTitleConfig(min_scale=profile.per_title_min_scale, max_scale=profile.per_title_max_scale)
+
+
+def validate_quality(profile):
+    if profile.min_ssim is not None and not 0 < profile.min_ssim <= 1:
+        raise ProfileError("min_ssim must be between 0 and 1")
+    if profile.min_psnr is not None and profile.min_psnr <= 0:
+        raise ProfileError("min_psnr must be positive")
+    if profile.min_vmaf is not None and not 0 < profile.min_vmaf <= 100:
+        raise ProfileError("min_vmaf must be between 0 and 100")
+
+
+def compile_quality(profile):
+    validate_quality(profile)
+    if not profile.verify_quality:
+        return None
+    return QualityConfig(min_ssim=profile.min_ssim, min_psnr=profile.min_psnr, min_vmaf=profile.min_vmaf)
+
+
+def scale_bitrates(detail, scale):
+    """The rendition with its bitrate, maxrate and VBV buffer multiplied by scale."""
+    video_bitrate = max(1, round(detail.video_bitrate * scale))
+    max_bitrate = max(video_bitrate, round(detail.max_bitrate * scale))
+    video_args = dict(detail.video_args, video_bitrate=f"{video_bitrate}k", maxrate=f"{max_bitrate}k")
+    bufsize = detail.bufsize
+    if bufsize is not None:
+        bufsize = max(1, round(bufsize * scale))
+        video_args["bufsize"] = f"{bufsize}k"
+    return detail._replace(
+        video_bitrate=video_bitrate, max_bitrate=max_bitrate, bufsize=bufsize,
+        video_args=MappingProxyType(video_args),
+    )
+
+
+def compile_detail(detail, packaging=None):
+    validate_detail(detail)
+
+    video_args = {
+        "vcodec": detail.vcodec,
+        "video_bitrate": f"{detail.video_bitrate}k",
+        "maxrate": f"{detail.max_bitrate}k",
+        "pix_fmt": detail.pix_fmt,
+        "sc_threshold": detail.sc_threshold,
+    }
+    # Without a buffer size the encoder picks its own VBV buffer
+    if detail.bufsize is not None:
+        video_args["bufsize"] = f"{detail.bufsize}k"
+    # Profile and level names are codec specific; other encoders reject them
+    if detail.vcodec in ("libx264", "libx265"):
+        if detail.profile:
+            video_args["profile:v"] = detail.profile
+        if detail.level is not None:
+            video_args["level"] = detail.level
+    if packaging is not None:
+        # Keyframes at every segment boundary and nowhere content dependent,
+        # so all renditions cut into segments at the same frames
+        video_args["force_key_frames"] = f"expr:gte(t,n_forced*{packaging.segment_duration})"
+        video_args["sc_threshold"] = 0
+        if detail.vcodec == "libx265":
+            video_args["x265-params"] = "scenecut=0"
+
+    audio_args = {
+        "acodec": detail.acodec,
+        "audio_bitrate": f"{detail.audio_bitrate}k",
+        "ac": detail.audio_channel,
+        "ar": detail.audio_frequency,
+    }
+
+    return CompiledRendition(
+        id=detail.id,
+        profile_id=detail.profile_id,
+        width=detail.width,
+        height=detail.height,
+        vcodec=detail.vcodec,
+        acodec=detail.acodec,
+        pix_fmt=detail.pix_fmt,
+        profile=detail.profile,
+        level=detail.level,
+        video_bitrate=detail.video_bitrate,
+        max_bitrate=detail.max_bitrate,
+        bufsize=detail.bufsize,
+        sc_threshold=detail.sc_threshold,
+        audio_bitrate=detail.audio_bitrate,
+        audio_channel=detail.audio_channel,
+        audio_frequency=detail.audio_frequency,
+        movflags=detail.movflags,
+        video_args=MappingProxyType(video_args),
+        audio_args=MappingProxyType(audio_args),
+    )
+
+
+def compile_profile(profile):
+    details = sorted(profile.profile_details, key=lambda detail: detail.id)
+    packaging = compile_packaging(profile)
+    return CompiledProfile(
+        id=profile.id,
+        name=profile.name,
+        renditions=tuple(compile_detail(detail, packaging) for detail in details),
+        extras=compile_extras(profile),
+        packaging=packaging,
+        per_title=compile_per_title(profile),
+        quality=compile_quality(profile),
+    )
+
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+# Bumped on every invalidation so a compile that raced with one isn't cached
+_generation = 0
+
+
+def get_profile(profile_id, db=None):
+    """Compiled profile from the in-process cache, or None if it doesn't exist."""
+    with _profiles_lock:
+        compiled = _profiles.get(profile_id)
+        generation = _generation
+    if compiled is not None:
+        return compiled
+
+    session = db or SessionLocal()
+    try:
+        profile = session.query(EncodeProfiles).filter(EncodeProfiles.id == profile_id).first()
+        if profile is None:
+            return None
+        compiled = compile_profile(profile)
+    finally:
+        if db is None:
+            session.close()
+
+    with _profiles_lock:
+        if generation == _generation:
+            _profiles[profile_id] = compiled
+    return compiled
+
+
+def forget_profile(profile_id=None):
+    global _generation
+    with _profiles_lock:
+        _generation += 1
+        if profile_id is None:
+            _profiles.clear()
+        else:
+            _profiles.pop(profile_id, None)
+
+
+def invalidate_profile(profile_id):
+    forget_profile(profile_id)
+    try:
+        redis_client.publish(INVALIDATE_CHANNEL, profile_id)
+    except Exception as e:
+        logger.warning("Could not publish profile invalidation for %s: %s", profile_id, e)
+
+
+def listen_for_invalidations(stop_event):
+    """Drop cached profiles when another process changes them. Runs until stop_event is set."""
+    delay = 1
+    while not stop_event.is_set():
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            # Anything published while we weren't subscribed is lost, so start clean
+            forget_profile()
+            delay = 1
+            while not stop_event.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message and message["type"] == "message":
+                    forget_profile(int(message["data"]))
+        except Exception:
+            logger.exception("Profile invalidation listener failed, resubscribing in %ss", delay)
+            stop_event.wait(delay)
+            delay = min(delay * 2, LISTENER_MAX_BACKOFF)
+        finally:
+            pubsub.close()
+
+
+def start_invalidation_listener(stop_event):
+    thread = threading.Thread(target=listen_for_invalidations, args=(stop_event,), daemon=True)
+    thread.start()
+    return thread
+
 
 def get_profiles_with_details():
     session = SessionLocal()  # Get a session from SessionLocal
@@ -0,0 +1,155 @@
+import json
+import os
+import time
+from db.database import redis_client, async_redis_client
+from services import webhooks
+from logging_config import logger as app_logger
+
+logger = app_logger.getChild("progress")
+
+# Live job progress kept in Dragonfly so clients never have to poll MySQL.
+# Writes are throttled to one per PROGRESS_INTERVAL seconds per job.
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1.0"))
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", str(24 * 60 * 60)))
+
+FINAL_STATUSES = ("completed", "failed")
+
+
+def progress_key(job_id):
+    return f"job_progress:{job_id}"
+
+
+def _publish(job_id, fields):
+    fields["updated_at"] = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(progress_key(job_id), mapping=fields)
+    pipe.expire(progress_key(job_id), PROGRESS_TTL)
+    pipe.publish(progress_key(job_id), json.dumps(fields))
+    pipe.execute()
+
+
+def publish_status(job_id, status):
+    fields = {"job_id": job_id, "status": status}
+    if status == "completed":
+        fields["percent"] = 100.0
+    try:
+        _publish(job_id, fields)
+    except Exception as e:
+        # Progress is best effort; never fail an encode over it
+        logger.warning("Could not publish status for job %s: %s", job_id, e)
+
+
+class ProgressReporter:
+    """Turns ffmpeg `-progress` output into throttled Dragonfly updates.
+
+    With a user_id, every WEBHOOK_PROGRESS_INTERVAL seconds an update also
+    goes out as a job.progress callback.
+    """
+
+    def __init__(self, job_id, duration=None, user_id=None):
+        self.job_id = job_id
+        self.duration = duration or None
+        self.user_id = user_id
+        self.last_sent = 0.0
+        self.last_callback = 0.0
+        # Set while Dragonfly is refusing updates, so an outage is logged
+        # once per job instead of once per progress tick
+        self.publish_failing = False
+
+    def _parse_block(self, block):
+        fields = {"job_id": self.job_id, "status": "processing"}
+        if "frame" in block:
+            fields["frame"] = int(block["frame"])
+        try:
+            fields["fps"] = float(block.get("fps", 0))
+        except ValueError:
+            pass
+        speed = block.get("speed", "").rstrip("x")
+        try:
+            fields["speed"] = float(speed)
+        except ValueError:
+            pass
+        out_time_us = block.get("out_time_us") or block.get("out_time_ms")
+        try:
+            out_time = int(out_time_us) / 1_000_000
+            fields["out_time"] = round(out_time, 3)
+            if self.duration:
+                fields["percent"] = round(min(100.0, out_time * 100 / self.duration), 1)
+        except (TypeError, ValueError):
+            pass
+        return fields
+
+    def consume(self, stream):
+        # ffmpeg writes key=value lines and ends each report with progress=...
+        block = {}
+        for raw_line in stream:
+            line = raw_line.decode(errors="replace").strip() if isinstance(raw_line, bytes) else raw_line.strip()
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            block[key] = value
+            if key == "progress":
+                self.report(self._parse_block(block), force=value == "end")
+                block = {}
+
+    def report(self, fields, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_sent < PROGRESS_INTERVAL:
+            return
+        self.last_sent = now
+        try:
+            _publish(self.job_id, fields)
+        except Exception as e:
+            if not self.publish_failing:
+                self.publish_failing = True
+                logger.warning("Could not publish progress for job %s (not logged again until it recovers): %s",
+                               self.job_id, e)
+        else:
+            if self.publish_failing:
+                self.publish_failing = False
+                logger.info("Publishing progress for job %s again", self.job_id)
+        if self.user_id is not None and now - self.last_callback >= webhooks.WEBHOOK_PROGRESS_INTERVAL:
+            self.last_callback = now
+            webhooks.emit(
+                self.user_id, "job.progress", self.job_id,
+                **{key: value for key, value in fields.items() if key not in ("job_id", "updated_at")}
+            )
+
+    def report_parts(self, done, total):
+        # Used by segment-parallel encodes, where there is no single ffmpeg
+        self.report({
+            "job_id": self.job_id,
+            "status": "processing",
+            "segments_done": done,
+            "segments_total": total,
+            "percent": round(done * 100 / total, 1) if total else 0.0,
+        }, force=done == total)
+
+
+def _decode(fields):
+    for key in ("job_id", "frame", "segments_done", "segments_total"):
+        if key in fields:
+            fields[key] = int(fields[key])
+    for key in ("fps", "speed", "out_time", "percent", "updated_at"):
+        if key in fields:
+            fields[key] = float(fields[key])
+    return fields
+
+
+async def get_progress(job_id):
+    fields = await async_redis_client.hgetall(progress_key(job_id))
+    return _decode(fields) if fields else None
+
+
+async def get_progress_many(job_ids):
+    pipe = async_redis_client.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hgetall(progress_key(job_id))
+    results = await pipe.execute()
+    return {job_id: _decode(fields) for job_id, fields in zip(job_ids, results) if fields}
+
+
+async def subscribe(job_id):
+    pubsub = async_redis_client.pubsub()
+    await pubsub.subscribe(progress_key(job_id))
+    return pubsub
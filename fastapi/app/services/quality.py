@@ -0,0 +1,93 @@
+import os
+import re
+from typing import NamedTuple, Optional
+import ffmpeg
+from services import profile_service
+from services.complexity import sample_windows
+
+# Sampled quality check of finished renditions. Each rendition is compared
+# with the source over a few short windows at fixed positions, scaled up to
+# the source's size as the metrics expect, so a check costs seconds of decode
+# rather than a second pass over the whole title.
+QUALITY_SAMPLES = int(os.getenv("QUALITY_SAMPLES", "4"))
+QUALITY_SAMPLE_SECONDS = float(os.getenv("QUALITY_SAMPLE_SECONDS", "2"))
+# Identical frames have infinite PSNR; stored as this instead
+PSNR_CAP = 100.0
+
+SSIM_PATTERN = re.compile(r"SSIM .*All:([\d.]+)")
+PSNR_PATTERN = re.compile(r"PSNR .*average:([\d.]+|inf)")
+VMAF_PATTERN = re.compile(r"VMAF score: ([\d.]+)")
+
+
+class QualityScores(NamedTuple):
+    ssim: float
+    psnr: float
+    vmaf: Optional[float]  # None when ffmpeg was built without libvmaf
+
+
+def vmaf_available():
+    return "libvmaf" in profile_service.filter_capabilities()
+
+
+def _score(pattern, log):
+    match = pattern.search(log)
+    if match is None:
+        raise ValueError(f"ffmpeg reported no {pattern.pattern.split()[0]} score")
+    return min(float(match.group(1)), PSNR_CAP)
+
+
+def measure_window(source_path, rendition_path, meta, start, length, with_vmaf, threads=0):
+    width, height = meta["video"]["width"], meta["video"]["height"]
+    reference = (
+        ffmpeg.input(source_path, ss=start, t=length).video
+        .filter("format", "yuv420p").filter("setpts", "PTS-STARTPTS")
+    )
+    distorted = (
+        ffmpeg.input(rendition_path, ss=start, t=length).video
+        .filter("scale", width, height, flags="bicubic")
+        .filter("format", "yuv420p").filter("setpts", "PTS-STARTPTS")
+    )
+    metrics = ["ssim", "psnr"] + (["libvmaf"] if with_vmaf else [])
+    references, distorteds = reference.split(), distorted.split()
+    streams = []
+    for index, name in enumerate(metrics):
+        # The filters take the distorted stream first
+        args = {"n_threads": threads or 1} if name == "libvmaf" else {}
+        streams.append(ffmpeg.filter([distorteds[index], references[index]], name, **args))
+    _, log = ffmpeg.output(*streams, "-", f="null").run(capture_stdout=True, capture_stderr=True)
+    log = log.decode(errors="replace")
+    return QualityScores(
+        ssim=_score(SSIM_PATTERN, log),
+        psnr=_score(PSNR_PATTERN, log),
+        vmaf=_score(VMAF_PATTERN, log) if with_vmaf else None,
+    )
+
+
+def measure(source_path, rendition_path, meta, threads=0):
+    """Scores over the sampled windows, averaged by window length."""
+    with_vmaf = vmaf_available()
+    windows = sample_windows(meta["duration"], QUALITY_SAMPLES, QUALITY_SAMPLE_SECONDS)
+    if meta["duration"] <= 0:
+        raise ValueError("Source has no duration to sample")
+    totals, seconds = [0.0, 0.0, 0.0], 0.0
+    for start, length in windows:
+        scores = measure_window(source_path, rendition_path, meta, start, length, with_vmaf, threads)
+        for index, value in enumerate(scores):
+            if value is not None:
+                totals[index] += value * length
+        seconds += length
+    return QualityScores(
+        ssim=round(totals[0] / seconds, 4),
+        psnr=round(totals[1] / seconds, 2),
+        vmaf=round(totals[2] / seconds, 2) if with_vmaf else None,
+    )
+
+
+def below_floor(scores, config):
+    """Names of the metrics that came in under the profile's floors."""
+    failed = []
+    for name in ("ssim", "psnr", "vmaf"):
+        floor, value = getattr(config, f"min_{name}"), getattr(scores, name)
+        if floor is not None and value is not None and value < floor:
+            failed.append(name)
+    return failed
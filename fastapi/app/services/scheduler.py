@@ -0,0 +1,130 @@
+import math
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple
+from services.job_queue import DEFAULT_PRIORITY, PRIORITIES
+
+# Highest priority class each role may ask for; its jobs get that class by
+# default. Uploads without a token are treated like the "user" role.
+ROLE_PRIORITIES = {"super_admin": "high", "admin": "high", "user": "normal"}
+
+
+def detect_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    # A container's CPU quota (cgroup v2) can be lower than the visible cores
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def detect_memory_mb():
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            memory = min(memory, int(limit))
+    return memory // (1024 * 1024)
+
+
+# What this node's encodes may use between them. 0 means detect; memory
+# keeps a fifth back for the worker itself and the page cache.
+NODE_CPUS = int(os.getenv("ENCODE_NODE_CPUS", "0")) or detect_cpus()
+NODE_MEMORY_MB = int(os.getenv("ENCODE_NODE_MEMORY_MB", "0")) or detect_memory_mb() * 4 // 5
+# Pixels per frame (decoded, scaled or encoded) that keep one thread busy
+PIXELS_PER_THREAD = int(os.getenv("ENCODE_PIXELS_PER_THREAD", str(1280 * 720)))
+# ffmpeg's resident memory: a fixed part plus a part per megapixel of frame
+# size, mostly x264 lookahead and reference frames
+BASE_MEMORY_MB = int(os.getenv("ENCODE_BASE_MEMORY_MB", "64"))
+MEMORY_MB_PER_MEGAPIXEL = int(os.getenv("ENCODE_MEMORY_MB_PER_MEGAPIXEL", "110"))
+
+
+class Cost(NamedTuple):
+    threads: int
+    memory_mb: int
+
+
+def priority_for(role, requested=None):
+    """Priority class for a job; ValueError if the role may not ask for `requested`."""
+    allowed = ROLE_PRIORITIES.get(role, DEFAULT_PRIORITY)
+    if requested is None:
+        return allowed
+    if PRIORITIES.index(requested) > PRIORITIES.index(allowed):
+        raise ValueError(f"Priority '{requested}' is above what this account may request ('{allowed}')")
+    return requested
+
+
+def encode_cost(source_width, source_height, sizes):
+    """Threads and memory for decoding a source once and encoding it at each (width, height)."""
+    pixels = source_width * source_height + sum(width * height for width, height in sizes)
+    # Never more than the node has, so every job can eventually run on its own
+    return Cost(
+        threads=min(NODE_CPUS, max(1, math.ceil(pixels / PIXELS_PER_THREAD))),
+        memory_mb=min(NODE_MEMORY_MB, BASE_MEMORY_MB + math.ceil(MEMORY_MB_PER_MEGAPIXEL * pixels / 1_000_000)),
+    )
+
+
+def whole_node():
+    return Cost(threads=NODE_CPUS, memory_mb=NODE_MEMORY_MB)
+
+
+def split_threads(threads, sizes):
+    """Share a job's threads between its outputs by frame size, at least one each."""
+    total = sum(width * height for width, height in sizes) or 1
+    return [max(1, round(threads * width * height / total)) for width, height in sizes]
+
+
+class NodeBudget:
+    """Threads and memory left on this node, handed out first come first served.
+
+    A job that doesn't fit waits, and everything behind it waits too, so a
+    stream of small jobs can't keep a big one from ever starting.
+    """
+
+    def __init__(self, threads, memory_mb):
+        self.free_threads = threads
+        self.free_memory_mb = memory_mb
+        self._waiting = deque()
+        self._changed = threading.Condition()
+
+    def _fits(self, cost):
+        return cost.threads <= self.free_threads and cost.memory_mb <= self.free_memory_mb
+
+    @contextmanager
+    def reserve(self, cost):
+        ticket = object()
+        with self._changed:
+            self._waiting.append(ticket)
+            self._changed.wait_for(lambda: self._waiting[0] is ticket and self._fits(cost))
+            self._waiting.popleft()
+            self.free_threads -= cost.threads
+            self.free_memory_mb -= cost.memory_mb
+            self._changed.notify_all()
+        try:
+            yield cost
+        finally:
+            with self._changed:
+                self.free_threads += cost.threads
+                self.free_memory_mb += cost.memory_mb
+                self._changed.notify_all()
+
+    def wait_for_headroom(self, timeout):
+        """Wait until no job is queued for resources and a thread is free; False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._waiting and self.free_threads > 0, timeout)
+
+
+budget = NodeBudget(NODE_CPUS, NODE_MEMORY_MB)
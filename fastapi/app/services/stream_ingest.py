@@ -0,0 +1,122 @@
+import os
+import struct
+import time
+from db.database import redis_client
+
+# How many leading bytes we are willing to buffer while deciding whether the
+# container can be decoded progressively
+SNIFF_LIMIT = int(os.getenv("STREAM_SNIFF_LIMIT", str(1024 * 1024)))
+FOLLOW_POLL_INTERVAL = 0.2
+FOLLOW_READ_SIZE = 1024 * 1024
+# Give up on a streaming upload that stops growing for this long
+FOLLOW_IDLE_TIMEOUT = int(os.getenv("STREAM_IDLE_TIMEOUT", "300"))
+# Stream-mode uploads still arriving, as video_filename -> when their upload
+# entry could next have expired. Until the upload completes the file is only
+# a partial source; the sweep deletes those whose upload entry ran out.
+STREAMS_KEY = "uploads:streaming"
+
+TS_PACKET_SIZE = 188
+
+
+class UploadAborted(Exception):
+    pass
+
+
+def sniff_streamable(head, final=False):
+    """Decide from the first bytes whether ffmpeg can decode the file as it arrives.
+
+    Returns True for MPEG-TS, fragmented MP4 and faststart MP4 (moov before
+    mdat), False when the moov atom comes after the media data or the format
+    is unknown, and None when more bytes are needed.
+    """
+    if len(head) >= TS_PACKET_SIZE * 2 and head[0] == 0x47 and head[TS_PACKET_SIZE] == 0x47:
+        return True
+
+    position = 0
+    while position + 8 <= len(head):
+        size, box_type = struct.unpack(">I4s", head[position:position + 8])
+        if size == 1:
+            if position + 16 > len(head):
+                break
+            size = struct.unpack(">Q", head[position + 8:position + 16])[0]
+        if box_type in (b"moov", b"moof"):
+            return True
+        if box_type == b"mdat":
+            return False
+        if position == 0 and box_type != b"ftyp":
+            return False  # Not ISO-BMFF either
+        if size < 8:
+            return False  # Box runs to end of file or is corrupt
+        position += size
+
+    if final or len(head) >= SNIFF_LIMIT:
+        return False
+    return None
+
+
+def follow_upload(upload_id, path, out):
+    """Copy a file that is still being uploaded into out until the upload completes.
+
+    Only bytes up to the offset committed in Dragonfly are read, so nothing
+    is fed that a resumed request might still rewrite.
+    """
+    key = f"upload:{upload_id}"
+    position = 0
+    last_progress = time.monotonic()
+
+    with open(path, "rb") as source:
+        while True:
+            state = redis_client.hgetall(key)
+            if not state or state.get("aborted"):
+                raise UploadAborted(f"Upload {upload_id} was aborted")
+
+            committed = int(state["offset"])
+            while position < committed:
+                block = source.read(min(FOLLOW_READ_SIZE, committed - position))
+                if not block:
+                    break
+                out.write(block)
+                position += len(block)
+                last_progress = time.monotonic()
+
+            if state.get("complete") and position >= committed:
+                return position
+            if time.monotonic() - last_progress > FOLLOW_IDLE_TIMEOUT:
+                raise UploadAborted(f"Upload {upload_id} stalled")
+            time.sleep(FOLLOW_POLL_INTERVAL)
+
+
+def discard_partial_source(path):
+    """Delete the file of a stream upload that will never complete."""
+    redis_client.zrem(STREAMS_KEY, os.path.basename(path))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def sweep_abandoned_streams(upload_dir):
+    """Delete partial sources whose upload entry expired. Returns how many."""
+    now = time.time()
+    removed = 0
+    for video_filename in redis_client.zrangebyscore(STREAMS_KEY, 0, now):
+        ttl = redis_client.ttl(f"upload:{video_filename[:36]}")
+        if ttl > 0:
+            # Checkpoints extended the entry; look again once it may be gone
+            redis_client.zadd(STREAMS_KEY, {video_filename: now + ttl})
+        else:
+            discard_partial_source(f"{upload_dir}/{video_filename}")
+            removed += 1
+    return removed
+
+
+def wait_for_bytes(upload_id, min_bytes):
+    # Let enough of the file arrive for ffprobe to see the stream layout
+    key = f"upload:{upload_id}"
+    deadline = time.monotonic() + FOLLOW_IDLE_TIMEOUT
+    while time.monotonic() < deadline:
+        state = redis_client.hgetall(key)
+        if not state or state.get("aborted"):
+            raise UploadAborted(f"Upload {upload_id} was aborted")
+        if state.get("complete") or int(state["offset"]) >= min_bytes:
+            return
+        time.sleep(FOLLOW_POLL_INTERVAL)
+    raise UploadAborted(f"Upload {upload_id} stalled")
@@ -0,0 +1,392 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+import anyio
+from sqlalchemy import select
+from db.database import async_redis_client, redis_client
+from models.videojob import VideoJob, VideoJobOutput
+from services import stream_ingest
+from services.stream_ingest import sniff_streamable
+from utils.cache import TTLCache
+from logging_config import logger as app_logger
+
+UPLOAD_DIR = "./videos"
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", str(24 * 60 * 60)))
+# How often one API node deletes the partial files of expired stream uploads
+STREAM_SWEEP_INTERVAL = int(os.getenv("STREAM_SWEEP_INTERVAL", "600"))
+# How often (in bytes) the committed offset is saved while a chunk streams in,
+# so a dropped connection loses at most this much
+UPLOAD_CHECKPOINT_BYTES = int(os.getenv("UPLOAD_CHECKPOINT_BYTES", str(8 * 1024 * 1024)))
+# Streamed uploads are read by an encoder while they arrive; commit more often
+STREAM_CHECKPOINT_BYTES = int(os.getenv("STREAM_CHECKPOINT_BYTES", str(256 * 1024)))
+# Seconds a chunk request holds an upload's lock without checking in. It is
+# renewed at every checkpoint, so a crashed API process blocks the upload
+# for at most this long.
+UPLOAD_LOCK_LEASE = int(os.getenv("UPLOAD_LOCK_LEASE", "60"))
+HASH_BLOCK_SIZE = 1024 * 1024
+# Batch submissions may reference files under this directory on the API host
+# instead of uploading them; they are linked into UPLOAD_DIR. Empty disables it.
+INGEST_ROOT = os.getenv("INGEST_ROOT", "")
+
+# Running sha256 per upload as (offset, hasher), valid while the offset
+# matches the stored one. A chunk that lands on a process without a current
+# hasher is not hashed there; the digest is then read from the file once, at
+# finalize, rather than rehashing the prefix on every chunk. Routing an
+# upload's requests to one process (sticky on the upload id) avoids that read.
+UPLOAD_HASHER_CACHE_SIZE = int(os.getenv("UPLOAD_HASHER_CACHE_SIZE", "10000"))
+_hashers = TTLCache(UPLOAD_HASHER_CACHE_SIZE, UPLOAD_TTL)
+
+logger = app_logger.getChild("uploads")
+
+# Save the offset and extend the lock, if this request still holds it
+_checkpoint_script = async_redis_client.register_script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'offset', ARGV[2])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+return 1
+""")
+
+# Save the final offset and release the lock, if this request still holds it
+_release_script = async_redis_client.register_script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'offset', ARGV[2])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+redis.call('DEL', KEYS[2])
+return 1
+""")
+
+
+class UploadConflict(Exception):
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadBusy(Exception):
+    pass
+
+
+class IngestError(ValueError):
+    pass
+
+
+def upload_key(upload_id):
+    return f"upload:{upload_id}"
+
+
+async def create_upload(filename, size, encoding_profile, user_id=None, priority="normal", stream=False):
+    upload_id = str(uuid.uuid4())
+    video_filename = f"{upload_id}_{os.path.basename(filename)}"
+    path = f"{UPLOAD_DIR}/{video_filename}"
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    async with await anyio.open_file(path, "wb"):
+        pass
+
+    state = {
+        "video_filename": video_filename,
+        "path": path,
+        "size": size if size is not None else -1,
+        "offset": 0,
+        "encoding_profile": encoding_profile,
+        "user_id": user_id or "",
+        "priority": priority,
+    }
+    pipe = async_redis_client.pipeline(transaction=True)
+    pipe.hset(upload_key(upload_id), mapping=state)
+    pipe.expire(upload_key(upload_id), UPLOAD_TTL)
+    if stream:
+        pipe.zadd(stream_ingest.STREAMS_KEY, {video_filename: time.time() + UPLOAD_TTL})
+    await pipe.execute()
+
+    _hashers.set(upload_id, (0, hashlib.sha256()))
+    return upload_id, state
+
+
+async def get_upload(upload_id):
+    state = await async_redis_client.hgetall(upload_key(upload_id))
+    if not state:
+        return None
+    state["size"] = int(state["size"])
+    state["offset"] = int(state["offset"])
+    state["encoding_profile"] = int(state["encoding_profile"])
+    state["user_id"] = int(state["user_id"]) if state.get("user_id") else None
+    state.setdefault("priority", "normal")
+    return state
+
+
+def save_and_hash(source, path):
+    # Blocking, open included; run it in the threadpool
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    hasher = hashlib.sha256()
+    with open(path, "wb") as target:
+        while True:
+            block = source.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            target.write(block)
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def ingest_local_file(path):
+    """Link a file under INGEST_ROOT into UPLOAD_DIR and return its video filename."""
+    if not INGEST_ROOT:
+        raise IngestError("Local ingest is disabled (INGEST_ROOT is not set)")
+    root = os.path.realpath(INGEST_ROOT)
+    source = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, source]) != root or not os.path.isfile(source):
+        raise IngestError(f"'{path}' is not a file under the ingest root")
+
+    video_filename = f"{uuid.uuid4()}_{os.path.basename(source)}"
+    target = f"{UPLOAD_DIR}/{video_filename}"
+    try:
+        os.link(source, target)
+    except OSError:
+        # Different filesystem; workers must see INGEST_ROOT at the same path
+        os.symlink(source, target)
+    return video_filename
+
+
+async def submittable_sources(db, video_filenames, user_id=None):
+    """The filenames that are sources of earlier jobs or finished uploads.
+
+    With a user_id only that user's sources count. Encoded outputs are never
+    sources, whoever asks, so nobody can re-encode their way to another
+    user's results.
+    """
+    video_filenames = set(video_filenames)
+    if not video_filenames:
+        return set()
+    query = select(VideoJob.video_filename).where(VideoJob.video_filename.in_(video_filenames))
+    if user_id is not None:
+        query = query.where(VideoJob.user_id == user_id)
+    sources = set(await db.scalars(query))
+
+    # Uploaded in full but not finalized: the upload id prefixes the filename
+    pending = sorted(video_filenames - sources)
+    if pending:
+        pipe = async_redis_client.pipeline(transaction=False)
+        for video_filename in pending:
+            pipe.hmget(upload_key(video_filename[:36]), "video_filename", "user_id", "offset", "size")
+        for video_filename, (stored, owner, offset, size) in zip(pending, await pipe.execute()):
+            if (stored == video_filename and int(size) >= 0 and offset == size
+                    and (user_id is None or owner == str(user_id))):
+                sources.add(video_filename)
+
+    outputs = set(await db.scalars(
+        select(VideoJobOutput.filename).where(VideoJobOutput.filename.in_(video_filenames))
+    ))
+    return sources - outputs
+
+
+def existing_upload(video_filename, sources):
+    if (os.path.basename(video_filename) != video_filename or video_filename not in sources
+            or not os.path.isfile(f"{UPLOAD_DIR}/{video_filename}")):
+        raise IngestError(f"'{video_filename}' is not one of your uploaded files")
+    return video_filename
+
+
+def resolve_batch_sources(jobs, sources):
+    """Video filenames for a batch's jobs, ingesting local paths. Blocking.
+
+    `sources` are the uploaded files the caller may submit (submittable_sources).
+
+    Files linked in before a failure are removed again, so a rejected batch
+    leaves nothing behind.
+    """
+    filenames, ingested = [], []
+    try:
+        for index, job in enumerate(jobs):
+            try:
+                if (job.video_filename is None) == (job.path is None):
+                    raise IngestError("Give exactly one of video_filename or path")
+                if job.path is not None:
+                    filenames.append(ingest_local_file(job.path))
+                    ingested.append(filenames[-1])
+                else:
+                    filenames.append(existing_upload(job.video_filename, sources))
+            except IngestError as e:
+                raise IngestError(f"jobs[{index}]: {e}")
+    except BaseException:
+        for video_filename in ingested:
+            os.remove(f"{UPLOAD_DIR}/{video_filename}")
+        raise
+    return filenames
+
+
+def _hash_prefix(path, length):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def current_hasher(upload_id, offset):
+    """This process's running hash of the upload's first `offset` bytes, or None."""
+    cached = _hashers.pop(upload_id)
+    if cached and cached[0] == offset:
+        return cached[1]
+    return hashlib.sha256() if offset == 0 else None
+
+
+async def append_chunk(upload_id, state, offset, chunks, checkpoint_bytes=UPLOAD_CHECKPOINT_BYTES):
+    """Write a stream of chunks at offset; returns the new committed offset.
+
+    The offset is saved as the chunk streams in, so after a dropped
+    connection the client resumes from the last checkpoint instead of zero.
+    """
+    lock_key = f"{upload_key(upload_id)}:lock"
+    lock_token = uuid.uuid4().hex
+    if not await async_redis_client.set(lock_key, lock_token, nx=True, ex=UPLOAD_LOCK_LEASE):
+        raise UploadBusy()
+
+    try:
+        # Read under the lock: `state` may predate a chunk that just finished
+        committed = await async_redis_client.hget(upload_key(upload_id), "offset")
+        if committed is None:
+            raise ValueError("Upload not found or expired")
+        if offset != int(committed):
+            raise UploadConflict(int(committed))
+    except BaseException:
+        await async_redis_client.delete(lock_key)
+        raise
+
+    hasher = current_hasher(upload_id, offset)
+    written = offset
+    checkpoint = offset
+    renewed_at = time.monotonic()
+    try:
+        async with await anyio.open_file(state["path"], "r+b") as f:
+
+            async def save_checkpoint():
+                nonlocal checkpoint, renewed_at
+                await f.flush()
+                if not await _checkpoint_script(
+                    keys=[upload_key(upload_id), lock_key], args=[lock_token, written, UPLOAD_LOCK_LEASE],
+                ):
+                    # The lease ran out and another request may be writing now
+                    raise UploadBusy()
+                checkpoint, renewed_at = written, time.monotonic()
+
+            # Drop any bytes past the committed offset from an earlier broken request
+            await f.truncate(offset)
+            await f.seek(offset)
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if state["size"] >= 0 and written + len(chunk) > state["size"]:
+                    raise ValueError("Chunk runs past the declared upload size")
+                # A slow client may not reach the next checkpoint within the
+                # lease; check in before writing rather than after
+                if time.monotonic() - renewed_at >= UPLOAD_LOCK_LEASE / 3:
+                    await save_checkpoint()
+                await f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                written += len(chunk)
+
+                if written - checkpoint >= checkpoint_bytes:
+                    await save_checkpoint()
+            await f.flush()
+    finally:
+        released = await _release_script(
+            keys=[upload_key(upload_id), lock_key], args=[lock_token, written, UPLOAD_TTL],
+        )
+        if released and hasher is not None:
+            _hashers.set(upload_id, (written, hasher))
+
+    return written
+
+
+async def upload_digest(upload_id, state):
+    hasher = current_hasher(upload_id, state["offset"])
+    if hasher is None:
+        # Some chunks were written by another process (or before a restart)
+        hasher = await anyio.to_thread.run_sync(_hash_prefix, state["path"], state["offset"])
+    _hashers.set(upload_id, (state["offset"], hasher))
+    return hasher.hexdigest()
+
+
+async def discard_upload(upload_id, video_filename=None):
+    # The file stays as a source; with a video_filename the upload was a
+    # stream and is no longer partial
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.delete(upload_key(upload_id))
+    if video_filename:
+        pipe.zrem(stream_ingest.STREAMS_KEY, video_filename)
+    await pipe.execute()
+    _hashers.pop(upload_id)
+
+
+async def complete_upload(upload_id, video_filename):
+    # Tells an encoder following the file that no more bytes are coming
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.hset(upload_key(upload_id), "complete", 1)
+    pipe.zrem(stream_ingest.STREAMS_KEY, video_filename)
+    await pipe.execute()
+    _hashers.pop(upload_id)
+
+
+async def abort_upload(upload_id, path):
+    # An encoder following the file stops at its next poll; it reads through
+    # its own open handle, so the file can go now
+    await async_redis_client.hset(upload_key(upload_id), "aborted", 1)
+    _hashers.pop(upload_id)
+    await anyio.to_thread.run_sync(stream_ingest.discard_partial_source, path)
+
+
+def sweep_streams_periodically(stop_event):
+    while not stop_event.wait(STREAM_SWEEP_INTERVAL):
+        try:
+            # One API node per interval does the sweep
+            if redis_client.set("uploads:streaming:sweep_lock", 1, nx=True, ex=STREAM_SWEEP_INTERVAL):
+                removed = stream_ingest.sweep_abandoned_streams(UPLOAD_DIR)
+                if removed:
+                    logger.info("Removed %s partial file(s) of expired stream uploads", removed)
+        except Exception:
+            logger.exception("Stream upload sweep failed")
+
+
+def start_stream_sweeper(stop_event):
+    thread = threading.Thread(target=sweep_streams_periodically, args=(stop_event,), daemon=True)
+    thread.start()
+    return thread
+
+
+async def peek_stream(chunks):
+    """Buffer just enough of a request body to tell if it can be streamed.
+
+    Returns the decision and an iterator that replays the buffered bytes
+    followed by the rest of the body.
+    """
+    iterator = chunks.__aiter__()
+    head = b""
+    streamable = None
+    while streamable is None:
+        try:
+            head += await iterator.__anext__()
+        except StopAsyncIteration:
+            streamable = sniff_streamable(head, final=True)
+            break
+        streamable = sniff_streamable(head)
+
+    async def replay():
+        if head:
+            yield head
+        async for chunk in iterator:
+            yield chunk
+
+    return streamable, replay()
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+from typing import NamedTuple
+from urllib.parse import urlsplit
+from uuid import uuid4
+from sqlalchemy import select
+from db.database import AsyncSessionLocal, async_redis_client, redis_client
+from models.user import User
+from utils import metrics
+from logging_config import logger as app_logger
+
+logger = app_logger.getChild("webhooks")
+
+# Job events for each user's callback_url, delivered by webhook_worker.py.
+# Encoders only append to a per-user outbox list in Dragonfly; the events
+# wait there until the user's endpoint has accepted them, so a slow or dead
+# endpoint never holds up an encode and a restarted dispatcher loses
+# nothing. Delivery is at least once: receivers dedupe on the event id.
+EVENTS_KEY = "webhooks:events:{}"
+# Users with events waiting, scored by when their next delivery is due
+DUE_KEY = "webhooks:due"
+ATTEMPTS_KEY = "webhooks:attempts"
+DEAD_KEY = "webhooks:dead"
+
+# Events for a user that arrive within this many seconds go out as one request
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "1.0"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+# Deliveries in flight per dispatcher, and per receiving host
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))
+WEBHOOK_HOST_CONCURRENCY = int(os.getenv("WEBHOOK_HOST_CONCURRENCY", "4"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+# A claimed batch comes back after this long if its dispatcher died
+WEBHOOK_LEASE = int(os.getenv("WEBHOOK_LEASE", "60"))
+# Retries back off exponentially with full jitter, up to the cap, and give
+# up after WEBHOOK_MAX_ATTEMPTS (around two hours at the defaults)
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "15"))
+WEBHOOK_RETRY_BASE = float(os.getenv("WEBHOOK_RETRY_BASE", "5"))
+WEBHOOK_RETRY_CAP = float(os.getenv("WEBHOOK_RETRY_CAP", "1800"))
+# Progress events per job are sent at most this often
+WEBHOOK_PROGRESS_INTERVAL = float(os.getenv("WEBHOOK_PROGRESS_INTERVAL", "30"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "0.5"))
+# How long a user's callback settings are cached by the dispatcher
+WEBHOOK_TARGET_TTL = int(os.getenv("WEBHOOK_TARGET_TTL", "60"))
+DEAD_LETTERS_KEPT = 1000
+
+# Take up to ARGV[3] users whose delivery is due and lease them
+_claim_script = async_redis_client.register_script("""
+local users = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+local result = {}
+for _, user in ipairs(users) do
+    redis.call('ZADD', KEYS[1], ARGV[2], user)
+    table.insert(result, user)
+    table.insert(result, redis.call('HINCRBY', KEYS[2], user, 1))
+end
+return result
+""")
+
+# Drop the delivered events and schedule the user again if more arrived
+_ack_script = async_redis_client.register_script("""
+redis.call('LTRIM', KEYS[1], tonumber(ARGV[1]), -1)
+redis.call('HDEL', KEYS[3], ARGV[2])
+if redis.call('LLEN', KEYS[1]) > 0 then
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+else
+    redis.call('ZREM', KEYS[2], ARGV[2])
+end
+""")
+
+
+class CallbackTarget(NamedTuple):
+    url: str
+    key: str
+    secret: str
+
+
+def make_event(event_type, job_id, **data):
+    return {"id": uuid4().hex, "type": event_type, "job_id": job_id, "created_at": time.time(), "data": data}
+
+
+def emit(user_id, event_type, job_id, **data):
+    """Queue an event for the user's callback. Never raises."""
+    if user_id is None:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.rpush(EVENTS_KEY.format(user_id), json.dumps(make_event(event_type, job_id, **data)))
+        # NX: a burst keeps the due time of its first event
+        pipe.zadd(DUE_KEY, {user_id: time.time() + WEBHOOK_COALESCE_WINDOW}, nx=True)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Could not queue %s callback for job %s: %s", event_type, job_id, e)
+
+
+def sign(secret, timestamp, body):
+    # Covers the timestamp too, so a captured request can't be replayed later
+    return hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+
+def coalesce(events):
+    """Drop progress events that a later event for the same job supersedes."""
+    last = {event["job_id"]: index for index, event in enumerate(events)}
+    return [
+        event for index, event in enumerate(events)
+        if event["type"] != "job.progress" or last[event["job_id"]] == index
+    ]
+
+
+def retry_delay(attempts):
+    return random.uniform(0, min(WEBHOOK_RETRY_CAP, WEBHOOK_RETRY_BASE * 2 ** attempts))
+
+
+def is_permanent(status):
+    # The receiver rejected the request itself; sending it again won't help
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+class Dispatcher:
+    """Delivers due batches from the outbox over one pooled HTTP client."""
+
+    def __init__(self, client):
+        self.client = client
+        self.host_slots = {}
+        self.targets = {}
+
+    async def claim(self, limit):
+        now = time.time()
+        claimed = await _claim_script(keys=[DUE_KEY, ATTEMPTS_KEY], args=[now, now + WEBHOOK_LEASE, limit])
+        users = [(int(claimed[i]), int(claimed[i + 1])) for i in range(0, len(claimed), 2)]
+        if not users:
+            return []
+        pipe = async_redis_client.pipeline(transaction=False)
+        for user_id, _ in users:
+            pipe.lrange(EVENTS_KEY.format(user_id), 0, WEBHOOK_BATCH_SIZE - 1)
+        batches = await pipe.execute()
+        return [(user_id, attempts, events) for (user_id, attempts), events in zip(users, batches)]
+
+    async def ack(self, user_id, count):
+        await _ack_script(
+            keys=[EVENTS_KEY.format(user_id), DUE_KEY, ATTEMPTS_KEY],
+            args=[count, user_id, time.time() + WEBHOOK_COALESCE_WINDOW],
+        )
+
+    async def reschedule(self, user_id, delay, count_attempt=True):
+        pipe = async_redis_client.pipeline(transaction=True)
+        pipe.zadd(DUE_KEY, {user_id: time.time() + delay}, xx=True)
+        if not count_attempt:
+            pipe.hincrby(ATTEMPTS_KEY, user_id, -1)
+        await pipe.execute()
+
+    async def dead_letter(self, user_id, raw_events, reason):
+        logger.error("Giving up on %s callback event(s) for user %s: %s", len(raw_events), user_id, reason)
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.lpush(DEAD_KEY, json.dumps({
+            "user_id": user_id, "reason": reason, "failed_at": time.time(),
+            "events": [json.loads(raw) for raw in raw_events],
+        }))
+        pipe.ltrim(DEAD_KEY, 0, DEAD_LETTERS_KEPT - 1)
+        await pipe.execute()
+        metrics.WEBHOOK_EVENTS.labels("dead").inc(len(raw_events))
+        await self.ack(user_id, len(raw_events))
+
+    async def target(self, user_id):
+        cached = self.targets.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(User.callback_url, User.callback_key, User.callback_secret_key).where(User.id == user_id)
+            )).first()
+        target = CallbackTarget(*row) if row else None
+        self.targets[user_id] = (time.monotonic() + WEBHOOK_TARGET_TTL, target)
+        return target
+
+    async def deliver(self, user_id, attempts, raw_events):
+        if not raw_events:
+            await self.ack(user_id, 0)
+            return
+        target = await self.target(user_id)
+        if target is None or not target.url:
+            await self.dead_letter(user_id, raw_events, "no callback_url")
+            return
+
+        # A host that is already at its limit is skipped for now rather than
+        # waited on, so its backlog doesn't take slots from everyone else
+        host = urlsplit(target.url).netloc
+        slots = self.host_slots.setdefault(host, asyncio.Semaphore(WEBHOOK_HOST_CONCURRENCY))
+        if slots.locked():
+            await self.reschedule(user_id, WEBHOOK_COALESCE_WINDOW, count_attempt=False)
+            return
+
+        async with slots:
+            body = json.dumps(
+                {"events": coalesce([json.loads(raw) for raw in raw_events])}, separators=(",", ":")
+            ).encode()
+            timestamp = str(int(time.time()))
+            headers = {
+                "Content-Type": "application/json",
+                "X-Callback-Key": target.key,
+                "X-Webhook-Timestamp": timestamp,
+                "X-Webhook-Signature": f"sha256={sign(target.secret, timestamp, body)}",
+            }
+            started = time.perf_counter()
+            try:
+                response = await self.client.post(target.url, content=body, headers=headers)
+                status, reason = response.status_code, f"HTTP {response.status_code}"
+            except Exception as e:
+                status, reason = None, f"{type(e).__name__}: {e}"
+            outcome = "delivered" if status is not None and 200 <= status < 300 else "failed"
+            metrics.WEBHOOK_DELIVERY_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+        if outcome == "delivered":
+            metrics.WEBHOOK_EVENTS.labels("delivered").inc(len(raw_events))
+            await self.ack(user_id, len(raw_events))
+        elif (status is not None and is_permanent(status)) or attempts >= WEBHOOK_MAX_ATTEMPTS:
+            await self.dead_letter(user_id, raw_events, reason)
+        else:
+            delay = retry_delay(attempts)
+            logger.warning("Callback for user %s failed (%s), attempt %s; retrying in %.0fs",
+                           user_id, reason, attempts, delay)
+            await self.reschedule(user_id, delay)
+
+    async def deliver_logged(self, user_id, attempts, raw_events):
+        try:
+            await self.deliver(user_id, attempts, raw_events)
+        except Exception:
+            # The batch stays leased and is retried once the lease runs out
+            logger.exception("Callback delivery for user %s crashed", user_id)
+
+    async def run(self, stop_event):
+        in_flight = set()
+        while not stop_event.is_set():
+            room = WEBHOOK_CONCURRENCY - len(in_flight)
+            claimed = []
+            if room > 0:
+                try:
+                    claimed = await self.claim(room)
+                except Exception:
+                    logger.exception("Could not claim callbacks")
+            for user_id, attempts, raw_events in claimed:
+                task = asyncio.create_task(self.deliver_logged(user_id, attempts, raw_events))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if not claimed:
+                if in_flight:
+                    await asyncio.wait(in_flight, timeout=WEBHOOK_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(WEBHOOK_POLL_INTERVAL)
+        # Unfinished batches are still leased and come back after WEBHOOK_LEASE
+        if in_flight:
+            await asyncio.wait(in_flight, timeout=WEBHOOK_TIMEOUT)
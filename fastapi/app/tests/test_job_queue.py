@@ -0,0 +1,52 @@
+import pytest
+
+from services import job_queue, scheduler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(job_queue.time, "time", lambda: now[0])
+    return now
+
+
+def test_higher_priority_sorts_first_when_queued_together(clock):
+    scores = {priority: job_queue.queue_score(priority) for priority in job_queue.PRIORITIES}
+    assert scores["high"] < scores["normal"] < scores["low"]
+
+
+def test_higher_priority_overtakes_within_the_aging_window(clock):
+    low = job_queue.queue_score("low")
+    clock[0] += job_queue.PRIORITY_AGING - 1
+    assert job_queue.queue_score("normal") < low
+
+
+def test_waiting_task_is_not_overtaken_after_the_aging_window(clock):
+    low = job_queue.queue_score("low")
+    clock[0] += job_queue.PRIORITY_AGING + 1
+    assert job_queue.queue_score("normal") > low
+    clock[0] += job_queue.PRIORITY_AGING
+    assert job_queue.queue_score("high") > low
+
+
+def test_delay_ignores_priority(clock):
+    assert job_queue.queue_score("high", delay=30) == job_queue.queue_score("low", delay=30) == clock[0] + 30
+
+
+def test_unknown_priority_is_treated_as_default():
+    assert job_queue.head_start("urgent") == job_queue.head_start(job_queue.DEFAULT_PRIORITY)
+
+
+@pytest.mark.parametrize("role, expected", [("super_admin", "high"), ("admin", "high"), ("user", "normal"), (None, "normal")])
+def test_priority_for_defaults_to_the_role_class(role, expected):
+    assert scheduler.priority_for(role) == expected
+
+
+def test_priority_for_allows_asking_for_less():
+    assert scheduler.priority_for("user", "low") == "low"
+    assert scheduler.priority_for("admin", "normal") == "normal"
+
+
+def test_priority_for_refuses_a_class_above_the_role():
+    with pytest.raises(ValueError):
+        scheduler.priority_for("user", "high")
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from utils.pagination import decode_cursor, encode_cursor, parse_fields
+
+
+def test_cursor_round_trip():
+    values = ["2026-01-02T03:04:05.678901", 42]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+def test_cursor_serializes_datetimes_as_strings():
+    created_at = datetime(2026, 1, 2, 3, 4, 5)
+    assert decode_cursor(encode_cursor([created_at, 7])) == [str(created_at), 7]
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor(["x" * 17, 1])
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "!!!", encode_cursor([1])[:-2]])
+def test_bad_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_parse_fields_keeps_required_columns_first():
+    assert parse_fields("status, name", ["id", "name", "status"]) == ["id", "status", "name"]
+
+
+def test_parse_fields_defaults_to_all():
+    assert parse_fields(None, ["id", "name"]) == ["id", "name"]
+
+
+def test_parse_fields_rejects_unknown_columns():
+    with pytest.raises(HTTPException) as error:
+        parse_fields("id,secret", ["id", "name"])
+    assert error.value.status_code == 400
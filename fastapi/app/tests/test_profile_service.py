@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+from services import profile_service
+from services.profile_service import ProfileError
+
+
+@pytest.fixture(autouse=True)
+def ffmpeg_build(monkeypatch):
+    # Stand in for `ffmpeg -encoders`, so no ffmpeg binary is needed
+    monkeypatch.setattr(profile_service, "encoder_capabilities",
+                        lambda: {"video": frozenset({"libx264"}), "audio": frozenset({"aac"})})
+    monkeypatch.setattr(profile_service, "encoder_pix_fmts", lambda encoder: None)
+
+
+def make_detail(**fields):
+    detail = dict(
+        id=1, profile_id=1, width=1280, height=720, vcodec="libx264", acodec="aac", pix_fmt="yuv420p",
+        profile="high", level=4.0, video_bitrate=2000, max_bitrate=3000, bufsize=4000, sc_threshold=0,
+        audio_bitrate=128, audio_channel=2, audio_frequency="44100", movflags="faststart",
+    )
+    detail.update(fields)
+    return SimpleNamespace(**detail)
+
+
+def test_compile_detail_sets_bufsize():
+    rendition = profile_service.compile_detail(make_detail())
+    assert rendition.video_args["bufsize"] == "4000k"
+    assert rendition.video_args["maxrate"] == "3000k"
+
+
+def test_compile_detail_without_bufsize_leaves_it_to_the_encoder():
+    rendition = profile_service.compile_detail(make_detail(bufsize=None))
+    assert rendition.bufsize is None
+    assert "bufsize" not in rendition.video_args
+
+
+@pytest.mark.parametrize("field", ["width", "height", "video_bitrate", "max_bitrate", "audio_bitrate", "pix_fmt"])
+def test_validate_detail_rejects_missing_values(field):
+    with pytest.raises(ProfileError, match=field):
+        profile_service.validate_detail(make_detail(**{field: None}))
+
+
+def test_validate_detail_lists_every_missing_value():
+    with pytest.raises(ProfileError, match="width, height"):
+        profile_service.validate_detail(make_detail(width=None, height=None))
+
+
+def test_validate_detail_rejects_odd_size_for_420():
+    with pytest.raises(ProfileError, match="even"):
+        profile_service.validate_detail(make_detail(width=1279))
+
+
+def test_scale_bitrates_scales_bufsize():
+    rendition = profile_service.scale_bitrates(profile_service.compile_detail(make_detail()), 0.5)
+    assert (rendition.video_bitrate, rendition.max_bitrate, rendition.bufsize) == (1000, 1500, 2000)
+    assert rendition.video_args["video_bitrate"] == "1000k"
+    assert rendition.video_args["maxrate"] == "1500k"
+    assert rendition.video_args["bufsize"] == "2000k"
+
+
+def test_scale_bitrates_without_bufsize():
+    rendition = profile_service.scale_bitrates(profile_service.compile_detail(make_detail(bufsize=None)), 1.5)
+    assert rendition.bufsize is None
+    assert "bufsize" not in rendition.video_args
+    assert rendition.video_args["video_bitrate"] == "3000k"
+
+
+def test_scale_bitrates_keeps_maxrate_at_least_bitrate():
+    rendition = profile_service.scale_bitrates(
+        profile_service.compile_detail(make_detail(video_bitrate=2000, max_bitrate=2000)), 0.0001
+    )
+    assert rendition.video_bitrate == 1
+    assert rendition.max_bitrate >= rendition.video_bitrate
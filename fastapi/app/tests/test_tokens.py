@@ -0,0 +1,34 @@
+from uuid import uuid4
+
+from auth.tokens import BloomFilter
+
+
+def test_bloom_filter_contains_what_was_added():
+    bloom = BloomFilter(100)
+    added = [f"{uuid4().hex}.{uuid4().hex}" for _ in range(100)]
+    for token in added:
+        bloom.add(token)
+    assert all(token in bloom for token in added)
+
+
+def test_bloom_filter_false_positives_stay_near_the_target_rate():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for _ in range(1000):
+        bloom.add(uuid4().hex)
+    false_positives = sum(uuid4().hex in bloom for _ in range(10000))
+    assert false_positives < 300
+
+
+def test_empty_bloom_filter_contains_nothing():
+    assert "a.b" not in BloomFilter(0)
+
+
+def test_bloom_filter_round_trips_through_dumps():
+    bloom = BloomFilter(50)
+    added = [uuid4().hex for _ in range(50)]
+    for token in added:
+        bloom.add(token)
+
+    loaded = BloomFilter.loads(bloom.dumps())
+    assert (loaded.size, loaded.hashes, loaded.bits) == (bloom.size, bloom.hashes, bloom.bits)
+    assert all(token in loaded for token in added)
@@ -0,0 +1,98 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from logging_config import logger as app_logger
+
+logger = app_logger.getChild("metrics")
+
+# Port the encode worker serves /metrics on; 0 disables it. The API serves
+# its metrics on its own port at GET /metrics.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+# Sub-millisecond to seconds: DB queries, pool checkouts, Redis commands
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Seconds to hours: encodes and time spent queued
+SLOW_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route template",
+    ["method", "route", "status"],
+)
+UPLOAD_WRITE_SECONDS = Histogram(
+    "upload_write_duration_seconds", "Time spent writing and hashing an uploaded file",
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_duration_seconds", "Wait for a pooled database connection",
+    ["engine"], buckets=FAST_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Database statement execution time",
+    ["engine", "statement"], buckets=FAST_BUCKETS,
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    "redis_command_duration_seconds", "Dragonfly round trip per command; pipelines count once",
+    ["command"], buckets=FAST_BUCKETS,
+)
+FFPROBE_SECONDS = Histogram(
+    "ffprobe_duration_seconds", "Time to probe a source that wasn't in the probe cache",
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "encode_queue_wait_seconds", "Time a task was runnable before a worker claimed it",
+    ["task"], buckets=(0.1, 0.5) + SLOW_BUCKETS,
+)
+ENCODE_SECONDS = Histogram(
+    "encode_duration_seconds", "Wall time from a job starting to process to its outputs being recorded",
+    ["profile"], buckets=SLOW_BUCKETS,
+)
+ENCODE_REALTIME_FACTOR = Histogram(
+    "encode_realtime_factor", "Seconds of source encoded per second of wall time",
+    ["profile"], buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+ENCODE_OUTPUT_BYTES = Counter(
+    "encode_output_bytes", "Bytes of rendition output recorded",
+    ["profile"],
+)
+ENCODE_JOBS = Counter(
+    "encode_jobs", "Jobs that finished, by outcome",
+    ["profile", "status"],
+)
+QUALITY_CHECKS = Counter(
+    "quality_checks", "Sampled quality checks of finished jobs, by result",
+    ["status"],
+)
+WEBHOOK_DELIVERY_SECONDS = Histogram(
+    "webhook_delivery_duration_seconds", "Time to deliver one batch of job events to a callback_url",
+    ["outcome"],
+)
+WEBHOOK_EVENTS = Counter(
+    "webhook_events", "Job events that left the outbox, delivered or given up on",
+    ["outcome"],
+)
+REVOCATION_FILTER_AGE = Gauge(
+    "revocation_filter_age_seconds", "Time since this process last installed a revocation filter",
+)
+REVOCATION_REFRESH_FAILURES = Counter(
+    "revocation_filter_refresh_failures", "Revocation filter refreshes that failed and kept the previous filter",
+)
+
+
+@contextmanager
+def timed(histogram, *labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(*labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+def statement_kind(statement):
+    # First keyword only, so label values stay few
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def start_worker_server():
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT)
+        logger.info("Serving metrics on port %s", WORKER_METRICS_PORT)
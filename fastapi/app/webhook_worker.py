@@ -0,0 +1,45 @@
+import asyncio
+import signal
+import threading
+import httpx
+from db.database import async_engine, async_redis_client
+from services import webhooks
+from utils import metrics
+from logging_config import logger as app_logger
+
+# Delivers job callbacks queued by the API and the encode workers. Run one or
+# more next to them; dispatchers share the outbox in Dragonfly.
+stop_event = threading.Event()
+logger = app_logger.getChild("webhook_worker")
+
+
+def shutdown(signum, frame):
+    logger.info("Webhook dispatcher stopping after the current deliveries...")
+    stop_event.set()
+
+
+async def run():
+    # One pooled client: connections to a receiver are kept alive between batches
+    limits = httpx.Limits(
+        max_connections=webhooks.WEBHOOK_CONCURRENCY, max_keepalive_connections=webhooks.WEBHOOK_CONCURRENCY,
+    )
+    timeout = httpx.Timeout(webhooks.WEBHOOK_TIMEOUT, connect=min(3.0, webhooks.WEBHOOK_TIMEOUT))
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=False) as client:
+            await webhooks.Dispatcher(client).run(stop_event)
+    finally:
+        await async_engine.dispose()
+        await async_redis_client.aclose()
+
+
+def main():
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    metrics.start_worker_server()
+    logger.info("Webhook dispatcher started with %s delivery slot(s), %s per host",
+                webhooks.WEBHOOK_CONCURRENCY, webhooks.WEBHOOK_HOST_CONCURRENCY)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import json
+import os
+import signal
+import threading
+from datetime import datetime
+from db.database import SessionLocal
+from models.videojob import VideoJob
+from services import job_queue, profile_service, scheduler
+from services.progress import publish_status
+from utils import metrics
+from logging_config import logger as app_logger
+from services.encoder import (
+    process_video_encoding,
+    process_video_chunk,
+    assemble_video_chunks,
+    verify_job_quality,
+    send_job_failure_notification,
+    discard_stream_source,
+)
+
+# Most tasks this node runs at once. How many actually run is decided by the
+# scheduler's thread and memory budget, so a node can take many small jobs
+# or one or two large ones. Start more worker processes (on this or other
+# machines pointing at the same Dragonfly) to scale out.
+ENCODE_CONCURRENCY = int(os.getenv("ENCODE_CONCURRENCY", str(scheduler.NODE_CPUS)))
+POLL_INTERVAL = int(os.getenv("ENCODE_POLL_INTERVAL", "5"))
+
+stop_event = threading.Event()
+active_tasks = set()
+active_lock = threading.Lock()
+logger = app_logger.getChild("worker")
+
+
+def handle_encode(task):
+    db = SessionLocal()
+    try:
+        video_job = db.query(VideoJob).filter(VideoJob.id == task["job_id"]).first()
+        if not video_job:
+            logger.warning("Job %s not found, dropping task", task["job_id"])
+            return
+        if video_job.status in ("completed", "failed"):
+            # Redelivered after the lease expired but the job already finished
+            return
+
+        video_job.status = "processing"
+        video_job.updated_at = datetime.utcnow()
+        db.commit()
+        publish_status(video_job.id, "processing")
+
+        process_video_encoding(video_job, db, upload_id=task.get("upload_id"))
+        if task.get("upload_id") and video_job.status == "failed":
+            discard_stream_source(video_job)
+    finally:
+        db.close()
+
+
+def handle_chunk(task):
+    db = SessionLocal()
+    try:
+        video_job = db.query(VideoJob).filter(VideoJob.id == task["job_id"]).first()
+        if not video_job or video_job.status != "processing":
+            return
+
+        last = process_video_chunk(
+            video_job, db,
+            rendition_ids=task.get("renditions"),
+            segment=task.get("segment"),
+            audio_group=task.get("audio_group"),
+            extras=task.get("extras", False),
+        )
+        if last:
+            priority = task.get("priority", job_queue.DEFAULT_PRIORITY)
+            job_queue.enqueue(job_queue.make_task(
+                "assemble", job_id=video_job.id, renditions=task.get("renditions"), priority=priority
+            ), priority=priority)
+    finally:
+        db.close()
+
+
+def handle_assemble(task):
+    db = SessionLocal()
+    try:
+        video_job = db.query(VideoJob).filter(VideoJob.id == task["job_id"]).first()
+        if not video_job or video_job.status != "processing":
+            return
+        assemble_video_chunks(video_job, db, rendition_ids=task.get("renditions"))
+    finally:
+        db.close()
+
+
+def handle_verify(task):
+    db = SessionLocal()
+    try:
+        video_job = db.query(VideoJob).filter(VideoJob.id == task["job_id"]).first()
+        if not video_job or video_job.status != "completed" or video_job.quality_status != "pending":
+            return
+        verify_job_quality(video_job, db)
+    finally:
+        db.close()
+
+
+def fail_encode(task):
+    db = SessionLocal()
+    try:
+        video_job = db.query(VideoJob).filter(VideoJob.id == task["job_id"]).first()
+        if video_job and video_job.status not in ("completed", "failed"):
+            video_job.status = "failed"
+            video_job.updated_at = datetime.utcnow()
+            db.commit()
+            publish_status(video_job.id, "failed")
+            metrics.ENCODE_JOBS.labels(str(video_job.encoding_profile), "failed").inc()
+            send_job_failure_notification(video_job)
+            if task.get("upload_id"):
+                discard_stream_source(video_job)
+    finally:
+        db.close()
+
+
+def fail_verify(task):
+    # The encode itself succeeded; only its quality report is missing
+    db = SessionLocal()
+    try:
+        video_job = db.query(VideoJob).filter(VideoJob.id == task["job_id"]).first()
+        if video_job and video_job.quality_status == "pending":
+            video_job.quality_status = "error"
+            db.commit()
+            metrics.QUALITY_CHECKS.labels("error").inc()
+    finally:
+        db.close()
+
+
+TASK_HANDLERS = {
+    "encode": handle_encode,
+    "chunk": handle_chunk,
+    "assemble": handle_assemble,
+    "verify": handle_verify,
+}
+
+# Called when a task keeps crashing its worker and is given up on
+FAILURE_HANDLERS = {
+    "encode": fail_encode,
+    "chunk": fail_encode,
+    "assemble": fail_encode,
+    "verify": fail_verify,
+}
+
+
+def run_task(raw_task, attempts):
+    task = json.loads(raw_task)
+    handler = TASK_HANDLERS.get(task.get("type"))
+    if handler is None:
+        logger.warning("Unknown task type, dropping: %s", raw_task)
+        return
+
+    if attempts > job_queue.MAX_ATTEMPTS:
+        logger.error("Task %s exceeded %s attempts, giving up", raw_task, job_queue.MAX_ATTEMPTS)
+        on_failure = FAILURE_HANDLERS.get(task["type"])
+        if on_failure:
+            on_failure(task)
+        return
+
+    handler(task)
+
+
+def slot_loop(slot):
+    while not stop_event.is_set():
+        # Leave queued work to other nodes while this one has no room for it
+        if not scheduler.budget.wait_for_headroom(POLL_INTERVAL):
+            continue
+        raw_task, attempts = job_queue.claim()
+        if raw_task is None:
+            job_queue.wait_for_work(POLL_INTERVAL)
+            continue
+
+        with active_lock:
+            active_tasks.add(raw_task)
+        try:
+            run_task(raw_task, attempts)
+            job_queue.ack(raw_task)
+        except Exception:
+            # Leave the task leased; once the lease expires it is retried
+            logger.exception("Slot %s crashed on %s", slot, raw_task)
+        finally:
+            with active_lock:
+                active_tasks.discard(raw_task)
+
+
+def lease_keeper():
+    # Keep leases of running encodes alive and return tasks of dead workers
+    interval = max(1, job_queue.VISIBILITY_TIMEOUT // 3)
+    while not stop_event.wait(interval):
+        with active_lock:
+            tasks = list(active_tasks)
+        try:
+            for raw_task in tasks:
+                if not job_queue.extend_lease(raw_task):
+                    logger.warning("Lost lease on %s; it may run twice", raw_task)
+            requeued = job_queue.requeue_expired()
+            if requeued:
+                logger.info("Requeued %s expired task(s)", requeued)
+        except Exception as e:
+            logger.warning("Lease upkeep failed: %s", e)
+
+
+def shutdown(signum, frame):
+    logger.info("Worker stopping after the current encodes finish...")
+    stop_event.set()
+
+
+def main():
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Probe the ffmpeg build once, before any profile is compiled
+    capabilities = profile_service.encoder_capabilities()
+    logger.info("ffmpeg offers %s video and %s audio encoders", len(capabilities["video"]), len(capabilities["audio"]))
+    profile_service.start_invalidation_listener(stop_event)
+    metrics.start_worker_server()
+
+    threads = [threading.Thread(target=lease_keeper, daemon=True)]
+    threads += [
+        threading.Thread(target=slot_loop, args=(slot,), name=f"encode-slot-{slot}")
+        for slot in range(ENCODE_CONCURRENCY)
+    ]
+    for thread in threads:
+        thread.start()
+
+    logger.info("Encode worker started with %s slot(s), %s thread(s) and %s MB to schedule",
+                ENCODE_CONCURRENCY, scheduler.NODE_CPUS, scheduler.NODE_MEMORY_MB)
+    for thread in threads[1:]:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
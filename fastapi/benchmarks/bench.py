@@ -0,0 +1,302 @@
+"""Offline benchmarks for the API and the encoder.
+
+Runs on one Linux box with no network: SQLite instead of MySQL, an
+in-process fakeredis server instead of Dragonfly (or a local Redis via
+--redis-url), and test sources generated with ffmpeg's lavfi testsrc2/sine.
+Results are printed as JSON so runs can be diffed across commits.
+
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python benchmarks/bench.py --out bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+# Ladder encoded by the encode benchmark, one EncodeProfileDetails row each
+PRESETS = [
+    {"name": "1080p", "width": 1920, "height": 1080, "video_bitrate": 5000},
+    {"name": "720p", "width": 1280, "height": 720, "video_bitrate": 2800},
+    {"name": "480p", "width": 854, "height": 480, "video_bitrate": 1400},
+    {"name": "360p", "width": 640, "height": 360, "video_bitrate": 800},
+]
+PRESET_DEFAULTS = {
+    "audio_bitrate": 128, "audio_channel": 2, "audio_frequency": "44100", "sc_threshold": 0,
+    "profile": "high", "level": 4.1, "movflags": "faststart", "pix_fmt": "yuv420p",
+    "acodec": "aac", "vcodec": "libx264",
+}
+
+
+def preset_detail(index, preset):
+    fields = dict(PRESET_DEFAULTS, **{key: value for key, value in preset.items() if key != "name"})
+    fields["max_bitrate"] = fields["video_bitrate"] * 2
+    fields["bufsize"] = fields["video_bitrate"] * 2
+    return dict(fields, id=index + 1, profile_id=1)
+
+
+def setup_environment(workdir, redis_url):
+    """Point the app at local stand-ins. Must run before any app module is imported."""
+    # Always overwritten, never taken from the shell or .env: the seed data
+    # includes a super_admin with a known password
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ["DRAGONFLY_URL"] = redis_url or "redis://localhost:6379/0"
+    if not redis_url:
+        import fakeredis
+        import redis
+        import redis.asyncio
+
+        server = fakeredis.FakeServer()
+        redis.Redis.from_url = classmethod(lambda cls, url, **kw: fakeredis.FakeRedis(server=server, **kw))
+        redis.asyncio.Redis.from_url = classmethod(
+            lambda cls, url, **kw: fakeredis.FakeAsyncRedis(server=server, **kw)
+        )
+    sys.path.insert(0, APP_DIR)
+    os.chdir(workdir)
+
+
+def make_source(path, duration, width=1920, height=1080, rate=30):
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={rate}",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(duration), "-ac", "2",
+        "-c:v", "libx264", "-preset", "veryfast", "-g", str(rate * 2), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-movflags", "+faststart", path,
+    ], check=True)
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    # Linux reports ru_maxrss in kilobytes
+    return resource.getrusage(who).ru_maxrss
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        } if latencies else None,
+    }
+
+
+async def load(client, make_request, total, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def user():
+        nonlocal errors
+        for index in remaining:
+            started = time.perf_counter()
+            response = await make_request(client, index)
+            if response.status_code < 400:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def seed_database():
+    """Create and fill the tables; returns the app."""
+    import main  # registers every model and creates the tables
+    from db.database import SessionLocal
+    from models.encodeprofile import EncodeProfileDetails, EncodeProfiles
+    from models.user import User
+    from utils.security import hash_password
+
+    db = SessionLocal()
+    try:
+        db.add(EncodeProfiles(id=1, name="bench"))
+        for index, preset in enumerate(PRESETS):
+            db.add(EncodeProfileDetails(**preset_detail(index, preset)))
+        db.add(User(
+            name="bench", email="bench@example.com", password=hash_password("bench"),
+            callback_key="k", callback_url="http://localhost", callback_secret_key="s",
+            stream_url="http://localhost", mobile="0", address="-", role="super_admin",
+            is_activated=True, status=True,
+        ))
+        for index in range(200):
+            db.add(User(
+                name=f"user{index}", email=f"user{index}@example.com", password="-",
+                callback_key="k", callback_url="http://localhost", callback_secret_key="s",
+                stream_url="http://localhost", mobile="0", address="-", role="user",
+                is_activated=bool(index % 2), status=True,
+            ))
+        db.commit()
+    finally:
+        db.close()
+    return main.app
+
+
+async def bench_api(args, upload_path, app):
+    import httpx
+    from db.database import async_engine
+
+    credentials = {"username": "bench@example.com", "password": "bench"}
+    with open(upload_path, "rb") as f:
+        upload_bytes = f.read()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await client.post("/token", data=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async def login(client, index):
+            return await client.post("/token", data=credentials)
+
+        async def list_users(client, index):
+            return await client.get("/users", params={"limit": 100}, headers=headers)
+
+        async def upload(client, index):
+            files = {"video": (f"bench{index}.mp4", upload_bytes, "video/mp4")}
+            return await client.put("/encoding/upload_video", files=files)
+
+        try:
+            return {
+                "token": await load(client, login, args.login_requests, args.concurrency),
+                "users": await load(client, list_users, args.requests, args.concurrency),
+                "upload_video": await load(client, upload, args.upload_requests, args.concurrency),
+                "peak_rss_kb": peak_rss_kb(),
+            }
+        finally:
+            # Pooled connections hold threads that would keep the process alive
+            await async_engine.dispose()
+
+
+def bench_encode_one(index, source, duration, frames):
+    """Encode one preset in this process and report speed and memory."""
+    from services import encoder, probe, profile_service
+
+    preset = PRESETS[index]
+    detail = profile_service.compile_detail(SimpleNamespace(**preset_detail(index, preset)))
+    output = f"bench_{preset['name']}.mp4"
+    with_audio = probe.probe_source(source)["audio"] is not None
+
+    started = time.perf_counter()
+    encoder.encode_ladder(source, [detail], [output], with_audio)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "preset": preset["name"],
+        "width": detail.width,
+        "height": detail.height,
+        "video_bitrate_kbps": detail.video_bitrate,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / elapsed, 1),
+        "realtime_factor": round(duration / elapsed, 2),
+        "output_bytes": os.path.getsize(output),
+        "worker_peak_rss_kb": peak_rss_kb(),
+        "ffmpeg_peak_rss_kb": peak_rss_kb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def bench_encode(args, source, workdir):
+    # One child process per preset so each one's peak RSS is its own
+    results = []
+    for index in range(len(PRESETS)):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--encode-one", str(index), "--source", source,
+             "--workdir", workdir, "--duration", str(args.duration), "--rate", str(args.rate)]
+            + (["--redis-url", args.redis_url] if args.redis_url else []),
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", help="Write the JSON results here as well as to stdout")
+    parser.add_argument("--redis-url", help="Use a local Redis-compatible server instead of fakeredis")
+    parser.add_argument("--workdir", help="Scratch directory (default: a new temp dir)")
+    parser.add_argument("--requests", type=int, default=500, help="Requests for cheap endpoints")
+    parser.add_argument("--login-requests", type=int, default=50, help="Requests to /token (bcrypt bound)")
+    parser.add_argument("--upload-requests", type=int, default=50, help="Requests to /encoding/upload_video")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of generated source video")
+    parser.add_argument("--rate", type=int, default=30, help="Frame rate of the generated source")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--skip-encode", action="store_true")
+    parser.add_argument("--encode-one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="video-bench-"))
+    os.makedirs(os.path.join(workdir, "videos"), exist_ok=True)
+
+    if args.encode_one is not None:
+        setup_environment(workdir, args.redis_url)
+        frames = int(args.duration * args.rate)
+        print(json.dumps(bench_encode_one(args.encode_one, args.source, args.duration, frames)))
+        return
+
+    source = os.path.join(workdir, "source_1080p.mp4")
+    upload = os.path.join(workdir, "upload_360p.mp4")
+    make_source(source, args.duration, rate=args.rate)
+    make_source(upload, 2, width=640, height=360)
+
+    setup_environment(workdir, args.redis_url)
+    app = seed_database()
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "redis": args.redis_url or "fakeredis",
+            "database": os.environ["DATABASE_URL"],
+            "concurrency": args.concurrency,
+            "source_seconds": args.duration,
+        },
+    }
+    if not args.skip_api:
+        results["api"] = asyncio.run(bench_api(args, upload, app))
+    if not args.skip_encode:
+        results["encode"] = bench_encode(args, source, workdir)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if out_path:
+        with open(out_path, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
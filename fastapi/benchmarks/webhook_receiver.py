@@ -0,0 +1,82 @@
+"""Local stand-in for a customer's callback_url.
+
+Checks each request's signature, counts events and duplicate deliveries,
+and can be made slow or flaky to exercise the dispatcher's retries and
+per-host limits. Point a user's callback_url at it:
+
+    python benchmarks/webhook_receiver.py --port 8900 --secret s --delay 2 --fail-rate 0.2
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+stats = {"requests": 0, "rejected": 0, "failed": 0, "events": 0, "duplicates": 0}
+seen = set()
+lock = threading.Lock()
+
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            timestamp = self.headers.get("X-Webhook-Timestamp", "")
+            expected = hmac.new(args.secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+            signed = hmac.compare_digest(self.headers.get("X-Webhook-Signature", ""), f"sha256={expected}")
+            time.sleep(args.delay)
+
+            with lock:
+                stats["requests"] += 1
+                if not signed:
+                    stats["rejected"] += 1
+                    status = 401
+                elif random.random() < args.fail_rate:
+                    stats["failed"] += 1
+                    status = 503
+                else:
+                    status = 204
+                    for event in json.loads(body)["events"]:
+                        stats["events"] += 1
+                        if event["id"] in seen:
+                            stats["duplicates"] += 1
+                        seen.add(event["id"])
+                        if args.verbose:
+                            print(json.dumps(event))
+            self.send_response(status)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def report(interval):
+    while True:
+        time.sleep(interval)
+        with lock:
+            print(json.dumps(stats), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--secret", required=True, help="The user's callback_secret_key")
+    parser.add_argument("--delay", type=float, default=0, help="Seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0, help="Share of requests answered with 503")
+    parser.add_argument("--report-interval", type=float, default=5)
+    parser.add_argument("--verbose", action="store_true", help="Print every event")
+    args = parser.parse_args()
+
+    threading.Thread(target=report, args=(args.report_interval,), daemon=True).start()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args))
+    print(f"Listening on http://127.0.0.1:{args.port}/", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()